@@ -0,0 +1,203 @@
+# Đo tốc độ của query_handler / data_processor trên dữ liệu giả.
+#
+#   python benchmarks/bench_queries.py                       # 1k, 100k, 1M giao dịch
+#   python benchmarks/bench_queries.py --sizes 1000,100000 --output before.json
+#   python benchmarks/bench_queries.py --compare before.json # báo các case chậm hơn ngưỡng
+#
+# Kết quả JSON: {"meta": {...}, "results": [{"size", "case", "kind", "p50_ms", ...}]}
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_processor  # noqa: E402
+import query_handler  # noqa: E402
+from synthetic import generate_batches  # noqa: E402
+from transaction_frame import TransactionFrame  # noqa: E402
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+
+def question_cases(today):
+    """(tên case, câu hỏi) cho từng nhánh intent của query_handler"""
+    month, year = (today.month - 2) % 12 + 1, today.year - (today.month <= 1)
+    return [
+        ("total", "Tổng giao dịch năm nay"),
+        ("total_all_time", "thống kê"),
+        ("income", "Tổng thu nhập năm nay"),
+        ("expense", "Tổng chi tiêu tháng này"),
+        ("highest", "Tôi chi nhiều nhất cho khoản nào năm nay?"),
+        ("lowest", "chi ít nhất năm nay"),
+        ("compare", "so sánh tiền điện và tiền nước năm nay"),
+        ("category", "tiền cà phê tháng trước"),
+        ("explicit_month", f"tiền điện tháng {month}/{year}"),
+    ]
+
+
+def _summary(samples, peak=None):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    mean = statistics.fmean(samples)
+    return {
+        "iterations": len(samples),
+        "mean_ms": mean * 1000,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": p99 * 1000,
+        "throughput_per_s": 1 / mean if mean else None,
+        "peak_mem_bytes": peak,
+    }
+
+
+def _measure(func, iterations):
+    """Chạy func `iterations` lần lấy thời gian, thêm một lần với tracemalloc để lấy bộ nhớ đỉnh"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return _summary(samples, peak)
+
+
+def _load_frame(size, seed, today):
+    """Dựng TransactionFrame + RollupCube từng lô như main.py. Returns: (frame, giây dựng bảng)"""
+    frame = TransactionFrame.from_transactions([], rollup=True)
+    elapsed = 0.0
+    for batch in generate_batches(size, seed, today=today):
+        # Chỉ tính thời gian dựng bảng, không tính thời gian sinh dữ liệu giả
+        start = time.perf_counter()
+        frame.extend(batch)
+        elapsed += time.perf_counter() - start
+    return frame, elapsed
+
+
+def _load_peak_memory(size, seed, today):
+    """Bộ nhớ đỉnh khi tải dữ liệu (chạy lại với tracemalloc, chậm hơn nhiều nên tách riêng)"""
+    tracemalloc.start()
+    _load_frame(size, seed, today)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_size(size, iterations, seed, today, measure_memory=True):
+    results = []
+
+    def record(case, kind, summary, **extra):
+        row = {"size": size, "case": case, "kind": kind, **extra, **summary}
+        results.append(row)
+        peak = row['peak_mem_bytes']
+        peak_text = f"{peak / 2**20:8.1f} MiB" if peak is not None else "       -"
+        print(f"{size:>9,} {case:<22} p50 {row['p50_ms']:9.3f} ms  p99 {row['p99_ms']:9.3f} ms"
+              f"  peak {peak_text}", file=sys.stderr)
+
+    # Tải dữ liệu (một lần, tốn nhất)
+    frame, elapsed = _load_frame(size, seed, today)
+    peak = _load_peak_memory(size, seed, today) if measure_memory else None
+    summary = _summary([elapsed], peak)
+    summary["throughput_per_s"] = size / elapsed
+    record("load", "load", summary, unit="rows")
+
+    # Từng nhánh intent qua execute_plan (xóa cache câu trả lời để đo phần tính thật).
+    # Câu hỏi được phân tích theo --today, không theo ngày thật, để "năm nay" /
+    # "tháng trước" rơi vào đúng vùng dữ liệu giả và kết quả lặp lại được
+    cases = question_cases(today)
+    plans = [query_handler.parse_question(question, today=today) for _, question in cases]
+    for (case, question), plan in zip(cases, plans):
+        def run():
+            query_handler.clear_answer_cache()
+            query_handler.execute_plan(plan, frame)
+        record(case, "question", _measure(run, iterations), question=question)
+
+    # Cả lô câu hỏi qua execute_plans (một lượt duyệt chung)
+    def run_batch():
+        query_handler.clear_answer_cache()
+        query_handler.execute_plans(plans, frame)
+    record("batch_all_intents", "batch", _measure(run_batch, iterations), questions=len(plans))
+
+    # Từng engine của data_processor trên cùng một truy vấn (chi tiêu 90 ngày gần nhất, lệch biên tháng)
+    start_date = date.fromordinal(today.toordinal() - 90)
+    for engine in sorted(data_processor._ENGINES):
+        def run_engine():
+            data_processor.get_transaction_stats(frame, 'expense', None, start_date, today, engine=engine)
+        record(f"engine_{engine}", "engine", _measure(run_engine, iterations))
+
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """In các case có p50 chậm hơn baseline quá threshold (tỉ lệ). Trả về số case bị chậm."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["size"], r["case"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    for row in results:
+        old = baseline.get((row["size"], row["case"]))
+        if not old or not old["p50_ms"]:
+            continue
+        ratio = row["p50_ms"] / old["p50_ms"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions += 1
+            flag = "  <-- CHẬM HƠN"
+        print(f"{row['size']:>9,} {row['case']:<22} {old['p50_ms']:9.3f} -> {row['p50_ms']:9.3f} ms"
+              f" ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark truy vấn giao dịch trên dữ liệu giả")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Số giao dịch, cách nhau bởi dấu phẩy")
+    parser.add_argument("--iterations", type=int, default=30, help="Số lần đo mỗi case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today(),
+                        help="Ngày 'hôm nay' (YYYY-MM-DD) để kết quả so sánh được giữa các lần chạy")
+    parser.add_argument("--no-load-memory", action="store_true",
+                        help="Bỏ qua đo bộ nhớ khi tải dữ liệu (lần tải chạy với tracemalloc rất chậm ở 1M dòng)")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file (mặc định in ra stdout)")
+    parser.add_argument("--compare", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Tỉ lệ chậm hơn cho phép khi --compare (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        results.extend(bench_size(size, args.iterations, args.seed, args.today,
+                                  measure_memory=not args.no_load_memory))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(data_processor.np, "__version__", None),
+            "default_engine": data_processor.DEFAULT_ENGINE,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "today": args.today.isoformat(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    elif not args.compare:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# Sinh dữ liệu giao dịch giả có cùng dạng với kết quả của
+# TransactionSnapshot.iter_batches (categories đã được làm phẳng).
+import random
+from datetime import date, datetime, time, timedelta
+
+# (tên danh mục, nhóm, số tiền trung vị, trọng số xuất hiện)
+CATEGORIES = [
+    ("Food", "expense", 80_000, 18),
+    ("Coffee", "expense", 45_000, 12),
+    ("Restaurant", "expense", 350_000, 6),
+    ("Grocery", "expense", 500_000, 8),
+    ("Shopping", "expense", 700_000, 5),
+    ("Clothing", "expense", 600_000, 2),
+    ("Gas", "expense", 120_000, 6),
+    ("Parking", "expense", 10_000, 5),
+    ("Electricity bill", "expense", 900_000, 1),
+    ("Water bill", "expense", 150_000, 1),
+    ("Internet bill", "expense", 250_000, 1),
+    ("Phone", "expense", 200_000, 1),
+    ("Rent", "expense", 5_000_000, 1),
+    ("Movies", "expense", 180_000, 2),
+    ("Fitness", "expense", 500_000, 1),
+    ("Healthcare", "expense", 400_000, 1),
+    ("Tuition", "expense", 8_000_000, 0.2),
+    ("Gifts", "expense", 300_000, 1),
+    ("Salary", "income", 20_000_000, 1),
+    ("Bonus", "income", 5_000_000, 0.3),
+    ("Freelance", "income", 3_000_000, 0.5),
+    ("Loan", "debt-loan", 2_000_000, 0.3),
+    ("Debt repayment", "debt-loan", 1_500_000, 0.3),
+]
+
+NOTES = ["", "Ăn trưa", "Cà phê với bạn", "Đi chợ cuối tuần", "Thanh toán hóa đơn",
+         "Đổ xăng", "Mua quà sinh nhật", "Lương tháng", "Trả góp", "Xem phim"]
+
+
+def generate_batches(n, seed=0, days=3 * 365, today=None, wallets=3, batch_size=1000, undated_ratio=0.001):
+    """
+    Sinh n giao dịch theo từng lô, mới nhất trước (thứ tự date desc như
+    TransactionSnapshot.iter_batches), trải đều trên `days` ngày gần nhất tính đến today.
+    Một tỉ lệ nhỏ giao dịch không có ngày được đặt ở cuối, giống Supabase
+    (nulls last).
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    specs = [c[:3] for c in CATEGORIES]
+    weights = [c[3] for c in CATEGORIES]
+    undated = int(n * undated_ratio)
+    dated = n - undated
+
+    batch = []
+    for i in range(n):
+        name, group, median = rng.choices(specs, weights)[0]
+        if i < dated:
+            day = today - timedelta(days=i * days // max(dated, 1))
+            created = datetime.combine(day, time(rng.randrange(24), rng.randrange(60)))
+        else:
+            day = None
+            created = datetime.combine(today, time())
+        batch.append({
+            "id": n - i,
+            "wallet_id": rng.randrange(1, wallets + 1),
+            "amount": round(median * rng.lognormvariate(0, 0.5), -3),
+            "date": day.isoformat() if day else None,
+            "note": rng.choice(NOTES),
+            "created_at": created.isoformat(),
+            "updated_at": created.isoformat(),
+            "categories": {"categoryname": name, "group_name": group},
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_transactions(n, seed=0, **kwargs):
+    """Như generate_batches nhưng trả về một danh sách"""
+    rows = []
+    for batch in generate_batches(n, seed, **kwargs):
+        rows.extend(batch)
+    return rows
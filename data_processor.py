@@ -1,95 +1,335 @@
-def calculate_total(transactions, group_name=None, category_name=None, start_date=None, end_date=None):
+from datetime import date
+from typing import NamedTuple, Optional
+
+from log_utils import TRACE, get_logger, sample_indices
+from profiling import span
+from transaction_frame import as_frame, month_label
+from transaction_record import to_ordinal
+
+try:
+    import numpy as np
+except ImportError:  # NumPy là tùy chọn, thiếu thì tính bằng vòng lặp Python
+    np = None
+
+logger = get_logger(__name__)
+
+
+class StatsQuery(NamedTuple):
     """
-    Tính tổng số tiền từ danh sách giao dịch dựa trên các điều kiện lọc
+    Một truy vấn thống kê trên dữ liệu giao dịch.
+    kind: 'stats' (get_transaction_stats) hoặc 'highest' (find_highest_spending_category)
     """
-    total = 0.0
-    matched_count = 0
-    
-    if not transactions:
-        print("[DEBUG] Không có giao dịch nào để xử lý")
-        return total
-    
-    # Chuẩn hóa tên nhóm và danh mục để so sánh không phân biệt hoa thường
-    target_group = group_name.lower() if group_name else None
-    target_category = category_name.lower() if category_name else None
-    
-    for t in transactions:
-        try:
-            # Lấy thông tin giao dịch
-            amount = float(t.get('amount', 0))
-            t_date = t.get('date')
-            
-            # Lấy thông tin category và group
-            category = t.get('category', {}) or {}
-            
-            # Lấy tên category từ nhiều trường có thể có
-            cname = (
-                category.get('name') or 
-                category.get('categoryname') or 
-                t.get('category_name') or 
-                ''
-            ).strip().lower()
-            
-            # Lấy tên nhóm từ nhiều trường có thể có
-            grp = (
-                t.get('group') or 
-                category.get('group') or 
-                t.get('group_name') or 
-                ''
-            ).lower()
-            
-            # Debug thông tin chi tiết
-            print(f"[DEBUG] Category data: {category}")
-            print(f"[DEBUG] Transaction data: {t}")
-            print(f"[DEBUG] Extracted category: {cname}, group: {grp}")
-            
-            # Debug log
-            debug_info = (
-                f"\n[DEBUG] Xử lý giao dịch {t.get('id')}:\n"
-                f"- Số tiền: {amount:,.0f}\n"
-                f"- Ngày: {t_date}\n"
-                f"- Danh mục: {cname}\n"
-                f"- Nhóm: {grp}"
-            )
-            
-            # Lọc theo group_name nếu có
-            if target_group and grp != target_group:
-                print(f"{debug_info}\n  => BỎ QUA (nhóm không khớp: '{grp}' != '{target_group}')")
-                continue
-            
-            # Lọc theo category_name nếu có
-            if target_category:
-                if not cname:
-                    print(f"{debug_info}\n  => BỎ QUA (không có thông tin danh mục)")
+    kind: str = 'stats'
+    group_name: Optional[str] = None
+    category_name: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+
+def _resolve_filters(frame, group_name=None, category_name=None, start_date=None, end_date=None):
+    """
+    Chuyển điều kiện lọc thành dạng mã số của TransactionFrame:
+    (mã nhóm hoặc None, tập mã danh mục hoặc None, ordinal bắt đầu, ordinal kết thúc)
+    """
+    group = frame.group_code(group_name) if group_name else None
+    categories = frame.category_codes_matching(category_name) if category_name else None
+    lo = to_ordinal(start_date) if start_date else 0
+    hi = to_ordinal(end_date) if end_date else 0
+    return group, categories, lo, hi
+
+
+def _dated_bounds(frame, lo, hi):
+    """Đoạn [start, stop) của các dòng có ngày nằm trong [lo, hi]"""
+    for start, stop in frame.row_ranges(lo, hi):
+        if start < frame._dated:
+            return start, stop
+    return 0, 0
+
+
+def _aggregate_python(frame, specs):
+    """
+    Tính tổng bằng vòng lặp Python thuần cho nhiều bộ lọc trong CÙNG một lượt duyệt,
+    mỗi bộ lọc có bộ cộng dồn riêng.
+
+    specs: danh sách (mã nhóm, tập mã danh mục, lo, hi) như _resolve_filters trả về
+    Returns: danh sách (total, count, {mã danh mục: số tiền}, {mã tháng: số tiền})
+    """
+    results = [[0.0, 0, {}, {}] for _ in specs]
+    # Khoảng ngày được giải bằng tìm nhị phân, chỉ duyệt hợp các đoạn cần thiết
+    bounds = [_dated_bounds(frame, lo, hi) for _, _, lo, hi in specs]
+    used = [b for b in bounds if b[0] < b[1]]
+    ranges = []
+    if used:
+        ranges.append((min(b[0] for b in used), max(b[1] for b in used)))
+    if frame._dated < len(frame):
+        ranges.append((frame._dated, len(frame)))
+
+    checks = list(zip(specs, bounds, results))
+    for start, stop in ranges:
+        rows = zip(
+            frame.amounts[start:stop],
+            frame.months[start:stop],
+            frame.category_codes[start:stop],
+            frame.group_codes[start:stop],
+        )
+        undated = start >= frame._dated
+        for i, (amount, month, ccode, gcode) in enumerate(rows, start):
+            for (group, categories, _, _), (first, last), acc in checks:
+                # Apply filters
+                if not undated and not first <= i < last:
                     continue
-                if target_category not in cname:
-                    print(f"{debug_info}\n  => BỎ QUA (danh mục '{cname}' không khớp với '{target_category}')")
+                if group is not None and gcode != group:
                     continue
-            
-            # Lọc theo ngày nếu có
-            if start_date and t_date and t_date < start_date:
-                print(f"{debug_info}\n  => BỎ QUA (ngày {t_date} trước {start_date})")
-                continue
-                
-            if end_date and t_date and t_date > end_date:
-                print(f"{debug_info}\n  => BỎ QUA (ngày {t_date} sau {end_date})")
-                continue
-
-            # Nếu đến đây, giao dịch thỏa mãn tất cả điều kiện
-            total += amount
-            matched_count += 1
-            print(f"{debug_info}\n  => THÊM VÀO TỔNG: {amount:,.0f} (tổng hiện tại: {total:,.0f})")
-
-        except Exception as e:
-            print(f"[ERROR] Lỗi khi xử lý giao dịch: {e}")
+                if categories is not None and ccode not in categories:
+                    continue
+
+                # Update statistics
+                acc[0] += amount
+                acc[1] += 1
+                by_code = acc[2]
+                by_code[ccode] = by_code.get(ccode, 0) + amount
+                if month >= 0:
+                    by_month = acc[3]
+                    by_month[month] = by_month.get(month, 0) + amount
+
+    return [tuple(acc) for acc in results]
+
+
+def _aggregate_numpy(frame, specs):
+    """
+    Cùng kết quả với _aggregate_python nhưng lọc bằng mặt nạ boolean
+    và gom nhóm bằng np.bincount trên mã danh mục / mã tháng.
+    Các cột chỉ được lấy ra một lần cho mọi bộ lọc.
+    """
+    bounds = [_dated_bounds(frame, lo, hi) for _, _, lo, hi in specs]
+    used = [b for b in bounds if b[0] < b[1]]
+    first = min((b[0] for b in used), default=0)
+    last = max((b[1] for b in used), default=0)
+    # Chỉ lấy các đoạn nằm trong khoảng ngày (tìm nhị phân), sau đó lọc bằng mặt nạ
+    rows = np.concatenate([np.arange(first, last), np.arange(frame._dated, len(frame))])
+
+    amounts = np.frombuffer(frame.amounts, dtype=np.float64)[rows]
+    months = np.frombuffer(frame.months, dtype=np.int32)[rows]
+    category_codes = np.frombuffer(frame.category_codes, dtype=np.int32)[rows]
+    group_codes = np.frombuffer(frame.group_codes, dtype=np.int32)[rows]
+    undated = rows >= frame._dated
+    size = len(frame.category_keys)
+
+    results = []
+    for (group, categories, _, _), (start, stop) in zip(specs, bounds):
+        mask = undated | ((rows >= start) & (rows < stop))
+        if group is not None:
+            mask &= group_codes == group
+        if categories is not None:
+            wanted = np.zeros(size, dtype=bool)
+            wanted[list(categories)] = True
+            mask &= wanted[category_codes]
+
+        selected = amounts[mask]
+        count = int(selected.size)
+        if not count:
+            results.append((0.0, 0, {}, {}))
             continue
 
-    print(f"\n[DEBUG] Kết thúc tính tổng:\n- Số giao dịch phù hợp: {matched_count}\n- Tổng cộng: {total:,.0f} VND")
-    return total
+        codes = category_codes[mask]
+        code_sums = np.bincount(codes, weights=selected, minlength=size)
+        code_counts = np.bincount(codes, minlength=size)
+        by_code = {int(c): float(code_sums[c]) for c in np.flatnonzero(code_counts)}
+
+        by_month = {}
+        month_values = months[mask]
+        dated = month_values >= 0
+        if dated.any():
+            month_values = month_values[dated]
+            base = int(month_values.min())
+            month_sums = np.bincount(month_values - base, weights=selected[dated])
+            month_counts = np.bincount(month_values - base)
+            by_month = {base + int(m): float(month_sums[m]) for m in np.flatnonzero(month_counts)}
+
+        results.append((float(selected.sum()), count, by_code, by_month))
+    return results
+
+
+def _aggregate_rollup(frame, specs):
+    """
+    Trả lời từ RollupCube của bảng (các tháng trọn vẹn không cần duyệt từng giao dịch).
+    Bảng dựng không kèm rollup (engine='rollup' chọn tường minh) được dựng cube một lần.
+    """
+    return frame.build_rollup().aggregate_many(specs)
+
+
+_ENGINES = {'python': _aggregate_python, 'rollup': _aggregate_rollup}
+if np is not None:
+    _ENGINES['numpy'] = _aggregate_numpy
+DEFAULT_ENGINE = 'numpy' if np is not None else 'python'
+
+
+def _engine_for(frame, engine=None):
+    """Chọn engine: ưu tiên rollup nếu bảng đã dựng sẵn, sau đó NumPy, cuối cùng Python"""
+    if engine:
+        return _ENGINES[engine]
+    if frame.rollup is not None:
+        return _aggregate_rollup
+    return _ENGINES[DEFAULT_ENGINE]
+
+
+def _empty_stats():
+    return {
+        'total': 0.0,
+        'count': 0,
+        'by_category': {},
+        'by_month': {},
+        'average': 0.0
+    }
+
+
+def _build_stats(frame, aggregate):
+    total, count, by_code, by_month = aggregate
+    stats = _empty_stats()
+    stats['total'] = total
+    stats['count'] = count
+    for code, amount in by_code.items():
+        key = frame.category_keys[code]
+        if key:
+            stats['by_category'][key] = amount
+    stats['by_month'] = {month_label(m): amount for m, amount in by_month.items()}
+
+    # Calculate average
+    if stats['count'] > 0:
+        stats['average'] = stats['total'] / stats['count']
+
+    # Sort categories by amount (descending)
+    stats['by_category'] = dict(sorted(
+        stats['by_category'].items(),
+        key=lambda x: x[1],
+        reverse=True
+    ))
+
+    return stats
+
+
+def _build_highest(frame, aggregate):
+    # Tìm danh mục có số tiền lớn nhất
+    category_totals = aggregate[2]
+    if not category_totals:
+        return None, 0
+
+    code, amount = max(category_totals.items(), key=lambda x: x[1])
+    return frame.categories[code] or "Khác", amount
+
+
+def _reject_reason(frame, i, spec):
+    """Lý do dòng i không khớp bộ lọc spec, None nếu khớp"""
+    group, categories, lo, hi = spec
+    if group is not None and frame.group_codes[i] != group:
+        return f"nhóm '{frame.groups[frame.group_codes[i]]}'"
+    if categories is not None and frame.category_codes[i] not in categories:
+        return f"danh mục '{frame.category_keys[frame.category_codes[i]]}'"
+    ordinal = frame.dates[i]
+    if ordinal and ((lo and ordinal < lo) or (hi and ordinal > hi)):
+        return "ngoài khoảng ngày"
+    return None
+
+
+def _trace_filter(frame, query, spec):
+    """
+    Chế độ trace (LOG_LEVEL=TRACE): ghi lại một mẫu giao dịch cùng kết quả lọc
+    để tìm nguyên nhân khi con số không khớp mong đợi.
+    """
+    logger.log(TRACE, "Truy vấn %s: %d giao dịch", query, len(frame))
+    for i in sample_indices(len(frame)):
+        ordinal = frame.dates[i]
+        logger.log(
+            TRACE, "  %s | %s | %s/%s | %s -> %s",
+            frame.ids[i],
+            date.fromordinal(ordinal) if ordinal else None,
+            frame.groups[frame.group_codes[i]],
+            frame.category_keys[frame.category_codes[i]],
+            frame.amounts[i],
+            _reject_reason(frame, i, spec) or "khớp",
+        )
+
+
+def _run_remote(source, queries):
+    """Mỗi bộ lọc khác nhau gom tổng một lần trên database (source.aggregate_remote)"""
+    filters = {}
+    for q in queries:
+        filters.setdefault(q[1:], None)
+    with span("aggregate"):
+        for key in filters:
+            filters[key] = source.aggregate_remote(*key)
 
-def get_transaction_stats(transactions, group_name=None, category_name=None, start_date=None, end_date=None):
+    results = []
+    for q in queries:
+        stats = filters[q[1:]]
+        if q.kind == 'stats':
+            results.append(stats)
+        else:
+            # by_category đã sắp xếp giảm dần
+            results.append(next(iter(stats['by_category'].items()), (None, 0)))
+    return results
+
+
+def run_queries(transactions, queries, engine=None):
+    """
+    Trả lời nhiều StatsQuery trong một lượt duyệt dữ liệu (mỗi truy vấn một bộ cộng dồn).
+    Kết quả của từng truy vấn giống hệt khi gọi riêng lẻ get_transaction_stats /
+    find_highest_spending_category.
+
+    transactions cũng có thể là nguồn gom tổng trên database (có phương thức
+    aggregate_remote(group_name, category_name, start_date, end_date) trả về dict
+    thống kê, xem supabase_client.RemoteTransactions); khi đó tên danh mục là chữ thường.
+
+    Returns:
+        Danh sách kết quả theo thứ tự queries: dict thống kê cho 'stats',
+        tuple (tên danh mục, số tiền) cho 'highest'
+    """
+    if hasattr(transactions, 'aggregate_remote'):
+        return _run_remote(transactions, queries)
+    if not transactions:
+        return [_empty_stats() if q.kind == 'stats' else (None, 0) for q in queries]
+
+    with span("normalize"):
+        frame = as_frame(transactions)
+    with span("filter"):
+        specs = [
+            _resolve_filters(frame, q.group_name, q.category_name, q.start_date, q.end_date)
+            for q in queries
+        ]
+    # Các truy vấn trùng bộ lọc chỉ tính một lần
+    unique_specs = list(dict.fromkeys(specs))
+    with span("aggregate"):
+        aggregates = dict(zip(unique_specs, _engine_for(frame, engine)(frame, unique_specs)))
+
+    if logger.isEnabledFor(TRACE):
+        for q, spec in zip(queries, specs):
+            _trace_filter(frame, q, spec)
+
+    results = []
+    with span("build_stats"):
+        for q, spec in zip(queries, specs):
+            build = _build_stats if q.kind == 'stats' else _build_highest
+            results.append(build(frame, aggregates[spec]))
+    return results
+
+
+def calculate_total(transactions, group_name=None, category_name=None, start_date=None, end_date=None):
+    """
+    Tính tổng số tiền từ danh sách giao dịch dựa trên các điều kiện lọc
+    """
+    if not transactions:
+        logger.debug("Không có giao dịch nào để xử lý")
+        return 0.0
+
+    stats = get_transaction_stats(transactions, group_name, category_name, start_date, end_date)
+    logger.debug("Kết thúc tính tổng: %d giao dịch phù hợp, tổng cộng %.0f VND",
+                 stats['count'], stats['total'])
+    return stats['total']
+
+def get_transaction_stats(transactions, group_name=None, category_name=None, start_date=None, end_date=None, engine=None):
     """
     Get detailed statistics for transactions matching the given filters
+    engine: 'rollup', 'numpy' hoặc 'python', mặc định chọn tự động (xem _engine_for)
     Returns: {
         'total': float,
         'count': int,
@@ -98,6 +338,14 @@ def get_transaction_stats(transactions, group_name=None, category_name=None, sta
         'average': float
     }
     """
+    query = StatsQuery('stats', group_name, category_name, start_date, end_date)
+    return run_queries(transactions, [query], engine)[0]
+
+def stats_from_aggregate_rows(rows):
+    """
+    Dựng dict thống kê (cùng dạng get_transaction_stats) từ các dòng đã gom tổng
+    trên database: (month 'YYYY-MM' hoặc None, category, total, count) hoặc dict cùng khóa.
+    """
     stats = {
         'total': 0.0,
         'count': 0,
@@ -105,98 +353,26 @@ def get_transaction_stats(transactions, group_name=None, category_name=None, sta
         'by_month': {},
         'average': 0.0
     }
-    
-    if not transactions:
-        return stats
-    
-    target_group = group_name.lower() if group_name else None
-    target_category = category_name.lower() if category_name else None
-    
-    for t in transactions:
-        try:
-            # Get transaction details
-            amount = float(t.get('amount', 0))
-            t_date = t.get('date')
-            
-            # Handle different possible category field names
-            category = (
-                t.get('category', {}).get('name') or 
-                t.get('category_name') or 
-                t.get('categories', {}).get('name') or 
-                t.get('categories', {}).get('categoryname') or 
-                ''
-            ).lower().strip()
-            
-            # Handle different possible group field names
-            group = (
-                t.get('group') or 
-                t.get('group_name') or 
-                t.get('categories', {}).get('group_name') or 
-                ''
-            ).lower().strip()
-            
-            # Debug info
-            print(f"[DEBUG] Processing transaction - Amount: {amount}, Date: {t_date}, Category: {category}, Group: {group}")
-            
-            # Chuẩn hóa t_date về kiểu date để so sánh
-            if t_date:
-                try:
-                    from datetime import datetime, date as _date
-                    if isinstance(t_date, str):
-                        t_date = datetime.strptime(t_date, '%Y-%m-%d').date()
-                    elif isinstance(t_date, datetime):
-                        t_date = t_date.date()
-                    elif isinstance(t_date, _date):
-                        # đã là date, giữ nguyên
-                        pass
-                except Exception as e:
-                    print(f"[WARNING] Could not normalize date {t_date}: {e}")
-                    t_date = None
-
-            # Apply filters
-            if target_group and group != target_group:
-                continue
-            if target_category and target_category not in category:
-                continue
-            if start_date and t_date and t_date < start_date:
-                continue
-            if end_date and t_date and t_date > end_date:
-                continue
-            
-            # Update statistics
-            stats['total'] += amount
-            stats['count'] += 1
-            
-            # Update category stats
-            if category:
-                stats['by_category'][category] = stats['by_category'].get(category, 0) + amount
-            
-            # Update monthly stats
-            if t_date:
-                try:
-                    if hasattr(t_date, 'strftime'):
-                        month_key = t_date.strftime('%Y-%m')
-                    else:
-                        month_key = t_date[:7]  # Assuming format YYYY-MM-DD
-                    stats['by_month'][month_key] = stats['by_month'].get(month_key, 0) + amount
-                except Exception as e:
-                    print(f"[WARNING] Could not process date {t_date}: {e}")
-                    
-        except Exception as e:
-            print(f"[ERROR] Error processing transaction: {e}")
-            continue
-    
-    # Calculate average
+    for row in rows:
+        if isinstance(row, dict):
+            row = (row.get('month'), row.get('category'), row.get('total'), row.get('count'))
+        month, category, total, count = row
+        total = float(total or 0)
+        stats['total'] += total
+        stats['count'] += int(count or 0)
+        category = (category or '').strip().lower()
+        if category:
+            stats['by_category'][category] = stats['by_category'].get(category, 0) + total
+        if month:
+            stats['by_month'][month] = stats['by_month'].get(month, 0) + total
+
     if stats['count'] > 0:
         stats['average'] = stats['total'] / stats['count']
-    
-    # Sort categories by amount (descending)
     stats['by_category'] = dict(sorted(
-        stats['by_category'].items(), 
-        key=lambda x: x[1], 
+        stats['by_category'].items(),
+        key=lambda x: x[1],
         reverse=True
     ))
-    
     return stats
 
 def format_currency(amount):
@@ -244,7 +420,7 @@ def find_highest_spending_category(transactions, group_name=None, start_date=Non
     """Find the category with the highest spending.
 
     Args:
-        transactions: Danh sách các giao dịch.
+        transactions: Danh sách các giao dịch hoặc TransactionFrame.
         group_name: Tên nhóm cần lọc ('income', 'expense', 'debt-loan'), có thể None.
         start_date: Ngày bắt đầu (datetime.date), tùy chọn.
         end_date: Ngày kết thúc (datetime.date), tùy chọn.
@@ -253,55 +429,8 @@ def find_highest_spending_category(transactions, group_name=None, start_date=Non
         Tuple (tên danh mục, số tiền) hoặc (None, 0) nếu không tìm thấy.
     """
     if not transactions:
-        print("[DEBUG] Không có giao dịch nào để xử lý")
-        return None, 0
-
-    category_totals = {}
-
-    for t in transactions:
-        try:
-            # Lấy thông tin category và group
-            cat = t.get("categories", {}) or {}
-            group = (cat.get("group_name") or "").strip().lower()
-            category = (cat.get("categoryname") or "Khác").strip()
-
-            # Lọc theo group_name nếu có
-            if group_name and group_name.lower() != group:
-                continue
-
-            # Lọc theo ngày nếu có
-            t_date = t.get("date")
-            if t_date and isinstance(t_date, str):
-                try:
-                    from datetime import datetime
-                    t_date = datetime.strptime(t_date, "%Y-%m-%d").date()
-                except Exception:
-                    t_date = None
-            elif t_date and hasattr(t_date, "date"):
-                # Trường hợp datetime
-                t_date = t_date.date()
-
-            if start_date and t_date and t_date < start_date:
-                continue
-            if end_date and t_date and t_date > end_date:
-                continue
-
-            # Tính tổng theo danh mục
-            try:
-                amount = float(t.get("amount", 0))
-                if category not in category_totals:
-                    category_totals[category] = 0
-                category_totals[category] += amount
-            except (ValueError, TypeError):
-                continue
-
-        except Exception as e:
-            print(f"[ERROR] Lỗi khi xử lý giao dịch {t.get('id')}: {str(e)}")
-            continue
-
-    # Tìm danh mục có số tiền lớn nhất
-    if not category_totals:
+        logger.debug("Không có giao dịch nào để xử lý")
         return None, 0
 
-    max_category = max(category_totals.items(), key=lambda x: x[1])
-    return max_category[0], max_category[1]
+    query = StatsQuery('highest', group_name, None, start_date, end_date)
+    return run_queries(transactions, [query])[0]
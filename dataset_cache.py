@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from log_utils import get_logger
+from transaction_loader import TransactionLoader
+
+logger = get_logger(__name__)
+
+# Tổng bộ nhớ tối đa cho dữ liệu giao dịch của mọi người dùng (MB)
+DATASET_CACHE_MB = float(os.getenv("DATASET_CACHE_MB", "512"))
+# Sau bao nhiêu giây thì đồng bộ lại dữ liệu của một người dùng (chạy nền, vẫn trả lời bằng dữ liệu cũ)
+DATASET_MAX_AGE = float(os.getenv("DATASET_MAX_AGE", "300"))
+
+
+class _Entry:
+    __slots__ = ("wallet_key", "loader", "frame", "loaded_at", "size")
+
+    def __init__(self, wallet_key, loader):
+        self.wallet_key = wallet_key
+        self.loader = loader
+        self.frame = None
+        self.loaded_at = None
+        self.size = 0
+
+
+class DatasetCache:
+    """
+    Cache TransactionFrame theo người dùng, dùng chung cho mọi request của server.
+
+    - Các request đồng thời của cùng một người dùng chờ chung một lần tải
+    - Tổng bộ nhớ (TransactionFrame.memory_usage) giới hạn bởi max_bytes,
+      vượt quá thì bỏ người dùng ít được dùng nhất (LRU)
+    - Dữ liệu cũ hơn max_age giây được đồng bộ lại trên thread nền, trong lúc
+      đó request vẫn được trả lời bằng dữ liệu đang có
+    """
+
+    def __init__(self, max_bytes=DATASET_CACHE_MB * 2**20, max_age=DATASET_MAX_AGE,
+                 loader_factory=TransactionLoader, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.loader_factory = loader_factory
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _start(self, user_id, wallet_ids):
+        return self.loader_factory(user_id, wallet_ids).start()
+
+    def prefetch(self, user_id, wallet_ids):
+        """Bắt đầu tải dữ liệu của người dùng (nếu chưa có) mà không chờ"""
+        self._entry(user_id, wallet_ids)
+
+    def _entry(self, user_id, wallet_ids):
+        wallet_key = tuple(sorted(str(w) for w in wallet_ids))
+        started = None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.wallet_key != wallet_key:
+                self.misses += 1
+                started = self._start(user_id, wallet_ids)
+                entry = _Entry(wallet_key, started)
+                self._entries[user_id] = entry
+            else:
+                self.hits += 1
+                stale = entry.loaded_at is not None and self.clock() - entry.loaded_at > self.max_age
+                if stale and entry.loader is None:
+                    started = entry.loader = self._start(user_id, wallet_ids)
+            self._entries.move_to_end(user_id)
+        if started is not None:
+            # Ghi nhận kết quả ngay khi tải xong, kể cả khi chưa request nào đọc
+            # (prefetch lúc đăng nhập), để dữ liệu được tính vào giới hạn bộ nhớ.
+            # Đăng ký ngoài khóa vì callback chạy luôn nếu lần tải đã xong.
+            started.add_done_callback(lambda loader: self._loaded(user_id, entry, loader))
+        return entry
+
+    def _loaded(self, user_id, entry, loader):
+        try:
+            frame = loader.result(0)
+        except Exception as e:
+            with self._lock:
+                if entry.loader is loader:
+                    entry.loader = None
+                    if entry.frame is None and self._entries.get(user_id) is entry:
+                        # Tải lần đầu thất bại: request sau tải lại từ đầu
+                        del self._entries[user_id]
+            logger.debug("Tải dữ liệu của %s thất bại: %s", user_id, e)
+            return
+        self._store(user_id, entry, loader, frame)
+
+    def get(self, user_id, wallet_ids, timeout=None):
+        """
+        TransactionFrame của người dùng, tải nếu chưa có (chờ tối đa timeout giây).
+        Quá timeout mà chưa tải xong thì ném concurrent.futures.TimeoutError; lần tải
+        vẫn tiếp tục, request sau dùng lại chính lần tải đó.
+        """
+        entry = self._entry(user_id, wallet_ids)
+        loader = entry.loader
+        if loader is None or (entry.frame is not None and not loader.done()):
+            # Đã có dữ liệu (có thể đang đồng bộ lại nền): trả lời ngay
+            return entry.frame
+        try:
+            frame = loader.result(timeout)
+        except FutureTimeoutError:
+            raise
+        except Exception as e:
+            # Entry đã được dọn trong _loaded
+            if entry.frame is None:
+                raise
+            # Đồng bộ lại thất bại: dùng tiếp dữ liệu cũ
+            logger.warning("Không đồng bộ lại được dữ liệu của %s: %s", user_id, e)
+            return entry.frame
+        self._store(user_id, entry, loader, frame)
+        return frame
+
+    def _store(self, user_id, entry, loader, frame):
+        size = frame.memory_usage()
+        with self._lock:
+            if entry.loader is not loader:
+                return
+            entry.frame = frame
+            entry.loader = None
+            entry.loaded_at = self.clock()
+            entry.size = size
+            logger.debug("Đã tải dữ liệu của %s: %d giao dịch, %d byte", user_id, len(frame), size)
+            self._evict(keep=user_id)
+
+    def _evict(self, keep):
+        """Bỏ các người dùng ít được dùng nhất đến khi vừa max_bytes, trừ keep (vừa tải xong)"""
+        total = sum(e.size for e in self._entries.values())
+        for user_id in list(self._entries):
+            if total <= self.max_bytes or len(self._entries) <= 1:
+                break
+            entry = self._entries[user_id]
+            if user_id == keep or (entry.loader is not None and entry.frame is None):
+                # Đang tải lần đầu (chưa biết kích thước); tải xong sẽ được tính và bỏ được
+                continue
+            del self._entries[user_id]
+            total -= entry.size
+            self.evictions += 1
+            logger.debug("Bỏ dữ liệu của %s khỏi cache (%d byte)", user_id, entry.size)
+
+    def invalidate(self, user_id):
+        """Bỏ dữ liệu của người dùng, lần sau sẽ đồng bộ lại"""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+        if entry is not None and entry.loader is not None:
+            entry.loader.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "bytes": sum(e.size for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
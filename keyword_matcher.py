@@ -0,0 +1,61 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    Tìm mọi cụm từ khóa xuất hiện (dạng chuỗi con) trong một câu bằng thuật toán
+    Aho-Corasick: dựng automaton một lần, sau đó mỗi câu chỉ cần duyệt một lượt,
+    chi phí không phụ thuộc vào số lượng từ khóa.
+
+    Kết quả giống hệt `{k for k in keywords if k in text}`.
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [frozenset()]
+        for keyword in keywords:
+            self._add(keyword)
+        self._build()
+
+    def _add(self, keyword):
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(frozenset())
+            state = next_state
+        self._out[state] = self._out[state] | {keyword}
+
+    def _build(self):
+        """Tính liên kết fail theo BFS, gộp output của trạng thái fail vào"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] | self._out[self._fail[next_state]]
+
+    def find(self, text):
+        """Tập các từ khóa có trong text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
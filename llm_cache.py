@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".finance_llm_cache.json"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+# Thời gian sống của một câu trả lời (giây), mặc định 1 ngày
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+
+
+def normalize_question(text):
+    """
+    Chuẩn hóa câu hỏi làm khóa cache: chữ thường, bỏ dấu tiếng Việt (kể cả đ → d),
+    gộp khoảng trắng. "Xin  Chào!" và "xin chao!" cho cùng một khóa.
+    """
+    text = unicodedata.normalize("NFD", text.casefold())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = text.replace("đ", "d")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class ResponseCache:
+    """
+    Cache câu trả lời của LLM theo (câu hỏi đã chuẩn hóa, tên model).
+
+    - Giới hạn số mục theo LRU (max_entries), mục quá ttl giây bị coi là hết hạn
+    - Lưu ra file JSON (path) sau mỗi lần ghi để dùng lại khi khởi động lại
+    - stats() trả về số lần hit/miss/eviction
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def _key(question, model):
+        return f"{model}\n{normalize_question(question)}"
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and self.clock() - stored_at > self.ttl
+
+    def get(self, question, model):
+        """Câu trả lời đã cache, None nếu chưa có hoặc đã hết hạn"""
+        key = self._key(question, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, question, model, answer):
+        key = self._key(question, model)
+        with self._lock:
+            self._entries[key] = (answer, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        """Đọc cache từ file (bỏ qua các mục đã hết hạn)"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Không đọc được cache LLM %s: %s", self.path, e)
+            return
+        with self._lock:
+            for key, answer, stored_at in items[-self.max_entries:]:
+                if not self._expired(stored_at):
+                    self._entries[key] = (answer, stored_at)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[k, a, t] for k, (a, t) in self._entries.items()], f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Không ghi được cache LLM %s: %s", self.path, e)
@@ -0,0 +1,219 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from log_utils import get_logger
+from profiling import record
+
+logger = get_logger(__name__)
+
+# Số lời gọi model chạy cùng lúc, nên bằng OLLAMA_NUM_PARALLEL của server Ollama
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", os.getenv("OLLAMA_NUM_PARALLEL", "1")))
+# Số lời gọi được xếp hàng chờ tối đa, vượt quá thì từ chối ngay
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "16"))
+
+# Mức ưu tiên: số nhỏ được phục vụ trước
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class QueueFull(RuntimeError):
+    """Hàng chờ LLM đã đầy (hoặc lời gọi bị lời gọi ưu tiên cao hơn đẩy ra)"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Hết thời hạn trước khi đến lượt gọi model"""
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "deadline", "enqueued", "event", "state", "waited")
+
+    def __init__(self, priority, seq, deadline, enqueued):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.enqueued = enqueued
+        self.event = threading.Event()
+        self.state = "queued"   # queued -> granted | expired | displaced | cancelled
+        self.waited = 0.0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """
+    Giới hạn số lời gọi model chạy cùng lúc (workers), các lời gọi còn lại chờ
+    trong hàng đợi có giới hạn (max_queue), theo thứ tự ưu tiên rồi thứ tự đến.
+
+    - Hàng chờ đầy: lời gọi INTERACTIVE đẩy lời gọi BATCH đến sau cùng ra,
+      còn lại thì bị từ chối ngay bằng QueueFull
+    - Mỗi lời gọi có thể có hạn chờ (timeout giây); hết hạn khi chưa đến lượt
+      thì bị bỏ khỏi hàng bằng DeadlineExceeded, không chiếm chỗ của model
+
+        with scheduler.slot(INTERACTIVE, timeout=30) as deadline:
+            ... gọi model ...
+    """
+
+    def __init__(self, workers=LLM_WORKERS, max_queue=LLM_QUEUE_SIZE, clock=time.monotonic,
+                 wait_samples=1024):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.clock = clock
+        self.admitted = 0
+        self.rejected = 0
+        self.displaced = 0
+        self.expired = 0
+        self.completed = 0
+        self._active = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._waits = {p: deque(maxlen=wait_samples) for p in PRIORITY_NAMES}
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """
+        Chờ đến lượt gọi model (tối đa timeout giây). Trả về hạn chót (theo clock)
+        hoặc None; phải gọi release() khi gọi model xong.
+        """
+        now = self.clock()
+        deadline = None if timeout is None else now + timeout
+        with self._lock:
+            waiter = None
+            if self._active < self.workers and not self._queue:
+                self._grant(priority, 0.0)
+            else:
+                if len(self._queue) >= self.max_queue:
+                    self._make_room(priority)
+                waiter = _Waiter(priority, next(self._seq), deadline, now)
+                heapq.heappush(self._queue, waiter)
+        if waiter is None:
+            record("llm.queue_wait", 0.0)
+            return deadline
+
+        try:
+            waiter.event.wait(None if deadline is None else max(0.0, deadline - self.clock()))
+        except BaseException:
+            # Bị ngắt khi đang chờ (KeyboardInterrupt...): không để lại waiter trong hàng
+            self._abandon(waiter)
+            raise
+        with self._lock:
+            if waiter.state == "queued":
+                # Hết hạn chờ mà chưa đến lượt
+                self._remove(waiter)
+                waiter.state = "expired"
+            state = waiter.state
+            if state == "expired":
+                self.expired += 1
+        if state == "granted":
+            # Ghi trên thread của lời gọi (không phải thread vừa release) để
+            # thời gian chờ nằm trong collect() của đúng câu hỏi
+            record("llm.queue_wait", waiter.waited)
+            return deadline
+        if state == "displaced":
+            raise QueueFull("Hàng chờ LLM đã đầy")
+        raise DeadlineExceeded("Hết thời gian chờ LLM")
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if waiter.state == "queued":
+                self._remove(waiter)
+            elif waiter.state == "granted":
+                # Vừa được cấp chỗ đúng lúc bị ngắt: trả lại cho lời gọi sau
+                self._active -= 1
+                self._dispatch()
+            waiter.state = "cancelled"
+
+    def _make_room(self, priority):
+        victim = max(self._queue)
+        if victim.priority <= priority:
+            self.rejected += 1
+            raise QueueFull("Hàng chờ LLM đã đầy")
+        self._remove(victim)
+        victim.state = "displaced"
+        victim.event.set()
+        self.displaced += 1
+        logger.debug("Đẩy một lời gọi %s ra khỏi hàng chờ LLM", PRIORITY_NAMES.get(victim.priority))
+
+    def _remove(self, waiter):
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+
+    def _grant(self, priority, waited):
+        self._active += 1
+        self.admitted += 1
+        self._waits[priority].append(waited)
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self.completed += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        now = self.clock()
+        while self._active < self.workers and self._queue:
+            waiter = heapq.heappop(self._queue)
+            if waiter.deadline is not None and now >= waiter.deadline:
+                waiter.state = "expired"
+            else:
+                waiter.state = "granted"
+                waiter.waited = now - waiter.enqueued
+                self._grant(waiter.priority, waiter.waited)
+            waiter.event.set()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, timeout=None):
+        """Giữ một chỗ gọi model trong khối with; yield hạn chót (hoặc None)"""
+        deadline = self.acquire(priority, timeout)
+        try:
+            yield deadline
+        finally:
+            self.release()
+
+    def stats(self):
+        """Độ sâu hàng chờ và thời gian chờ (ms) theo mức ưu tiên"""
+        with self._lock:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._queue:
+                queued[PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))] += 1
+            waits = {PRIORITY_NAMES[p]: sorted(samples) for p, samples in self._waits.items()}
+            stats = {
+                "workers": self.workers,
+                "active": self._active,
+                "queued": queued,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "displaced": self.displaced,
+                "expired": self.expired,
+                "completed": self.completed,
+            }
+        stats["wait_ms"] = {
+            name: {
+                "count": len(samples),
+                "p50": samples[len(samples) // 2] * 1000 if samples else 0.0,
+                "p90": samples[min(len(samples) - 1, int(len(samples) * 0.9))] * 1000 if samples else 0.0,
+                "max": samples[-1] * 1000 if samples else 0.0,
+            }
+            for name, samples in waits.items()
+        }
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """LLMScheduler dùng chung cho cả chương trình (tạo khi cần lần đầu)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
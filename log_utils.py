@@ -0,0 +1,46 @@
+import logging
+import os
+import random
+
+# Mức chi tiết hơn DEBUG, dùng cho chế độ trace lấy mẫu từng giao dịch
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+# LOG_LEVEL: TRACE, DEBUG, INFO, WARNING (mặc định), ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+# Tỉ lệ giao dịch được ghi lại ở mức TRACE và số dòng tối đa mỗi truy vấn
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SAMPLE_LIMIT = int(os.getenv("TRACE_SAMPLE_LIMIT", "50"))
+
+LOG_FORMAT = "[%(levelname)s] %(name)s: %(message)s"
+
+
+def get_logger(name):
+    """Logger của một module (dùng __name__), cấu hình chung qua configure_logging"""
+    return logging.getLogger(name)
+
+
+def configure_logging(level=None):
+    """
+    Cấu hình log cho chương trình (gọi một lần ở main).
+    Các module chỉ tạo logger, không tự in; khi mức DEBUG/TRACE tắt, lời gọi
+    logger.debug("...%s", x) không định dạng chuỗi nên gần như không tốn gì.
+    """
+    level = level or LOG_LEVEL
+    if isinstance(level, str):
+        level = TRACE if level == "TRACE" else logging.getLevelName(level)
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    logging.getLogger().setLevel(level)
+
+
+def sample_indices(size, rate=None, limit=None, seed=0):
+    """
+    Chỉ số các phần tử được chọn để trace (lấy mẫu ngẫu nhiên, cố định theo seed
+    để hai lần chạy cùng dữ liệu cho cùng mẫu).
+    """
+    rate = TRACE_SAMPLE_RATE if rate is None else rate
+    limit = TRACE_SAMPLE_LIMIT if limit is None else limit
+    if size <= 0 or rate <= 0 or limit <= 0:
+        return []
+    count = min(size, limit, max(1, int(size * rate)))
+    return sorted(random.Random(seed).sample(range(size), count))
@@ -1,6 +1,11 @@
-from supabase_client import get_user_by_email, get_wallets_by_user_id, get_transactions_by_wallet_ids
-from query_handler import handle_question
+from supabase_client import STATS_PUSHDOWN, RemoteTransactions, get_user_with_wallets, invalidate_cache
+from query_handler import execute_plan, needs_transactions, parse_question, wants_finance_context
 from ollama_client import ask_ollama
+from prompt_builder import PROMPT_TOKEN_BUDGET, build_prompt
+from transaction_loader import TransactionLoader
+from log_utils import configure_logging
+from profiling import collect, dump, format_breakdown, span, start_profiler
+import argparse
 import os
 import random
 
@@ -31,13 +36,104 @@ def print_help():
     print("\n TÌM KIẾM GIAO DỊCH:")
     print("- Tìm giao dịch mua sắm tháng này")
     print("- Tôi đã chi bao nhiêu cho ăn uống?")
-    print("\nGõ 'đổi' để đổi người dùng, 'thoát' để kết thúc\n")
+    print("\nGõ 'tải lại' để tải lại giao dịch, 'đổi' để đổi người dùng, 'thoát' để kết thúc\n")
 
 def format_currency(amount):
     """Format number as currency."""
     return "{:,.0f} VND".format(amount) if amount is not None else "0 VND"
 
-def main():
+def print_timings(timings):
+    """In thời gian từng bước (chỉ khi chạy với --profile)"""
+    breakdown = format_breakdown(timings)
+    if breakdown:
+        print("\n [PROFILE]")
+        print(breakdown)
+
+def wait_for_transactions(loader, profile=False):
+    """
+    Chờ thread nền tải xong giao dịch (nếu chưa xong) và báo số giao dịch đã tải.
+    Tải lỗi thì báo một lần và trả về danh sách rỗng để vẫn hỏi được LLM.
+    """
+    if not loader.done():
+        print("\n Đang chờ tải xong giao dịch...")
+    try:
+        transactions = loader.result()
+    except Exception as e:
+        print(f"\n Không tải được giao dịch: {e}")
+        print(" Gõ 'tải lại' để thử lại.")
+        return []
+    print(f"\n Đã đồng bộ {loader.fetched} giao dịch mới.")
+    if profile:
+        print_timings(loader.timings)
+    if transactions:
+        print(f" Đã tải {len(transactions)} giao dịch gần đây.")
+    else:
+        print(" Không tìm thấy giao dịch nào.")
+    return transactions
+
+def answer_from_partial(loader, question, plan, user_email=None):
+    """
+    Trả lời bằng phần giao dịch đã tải nếu đủ cho khoảng thời gian của câu hỏi
+    (giao dịch về theo ngày giảm dần). Trả về False nếu phải chờ tải xong.
+    """
+    if loader.done():
+        return False
+    with loader.partial(plan.start_date) as transactions:
+        if transactions is None:
+            return False
+        answer_question(question, plan, transactions, user_email)
+    return True
+
+def answer_question(question, plan, transactions, user_email=None):
+    """
+    Trả lời một câu hỏi: dữ liệu giao dịch trước, LLM nếu không phải câu hỏi tài chính.
+    Với câu hỏi tài chính mở (tư vấn, xem query_handler.wants_finance_context), nếu
+    đã có dữ liệu thì LLM nhận kèm bản tóm tắt giới hạn PROMPT_TOKEN_BUDGET token
+    (prompt_builder).
+    """
+    # Process with query_handler (dùng dữ liệu Supabase cho câu hỏi tài chính)
+    result, message = execute_plan(plan, transactions)
+
+    # Không đủ dữ liệu giao dịch
+    if message == "Không đủ dữ liệu để trả lời.":
+        print("\n Không đủ dữ liệu để trả lời.")
+        return
+
+    # Không tính được bằng truy vấn thống kê → gọi LLM. Chỉ câu hỏi tài chính mở
+    # mới kèm dữ liệu giao dịch, các câu khác (trò chuyện) gửi nguyên câu hỏi
+    if result is None and message is None:
+        # In từng đoạn ngay khi model sinh ra, ẩn phần <think> của deepseek-r1.
+        # Ctrl+C chỉ dừng câu trả lời này (model được dừng khi đóng generator),
+        # phiên làm việc và dữ liệu đã tải vẫn giữ nguyên
+        prompt = question
+        if transactions and PROMPT_TOKEN_BUDGET and wants_finance_context(plan):
+            prompt = build_prompt(user_email, transactions, question)
+        # Prompt có dữ liệu tài chính thì không cache: khóa đổi theo dữ liệu nên
+        # gần như không trúng, và không được ghi dữ liệu người dùng ra đĩa
+        answer = ask_ollama(prompt, stream=True, hide_thinking=True, use_cache=prompt is question)
+        try:
+            print("\n ", end="", flush=True)
+            for chunk in answer:
+                print(chunk, end="", flush=True)
+            print()
+        except KeyboardInterrupt:
+            print("\n (Đã dừng câu trả lời)")
+        except Exception as e:
+            print(f"\n Lỗi khi gọi LLM: {e}")
+            print("Vui lòng thử lại sau.")
+        finally:
+            answer.close()
+        return
+
+    # Câu hỏi tài chính có dữ liệu
+    if result is not None:
+        # message đã được format sẵn bằng format_stats/format_currency
+        print(f"\n {message}")
+    else:
+        print("\n Tôi không hiểu câu hỏi của bạn. Dưới đây là một số gợi ý:")
+        print_help()
+
+def main(profile=False):
     clear_screen()
     print_header()
     print(" Chào mừng bạn đến với hệ thống quản lý tài chính!")
@@ -55,7 +151,8 @@ def main():
                 continue
                 
             print(f"\n Đang tìm kiếm thông tin của {email}...")
-            user = get_user_by_email(email)
+            # Người dùng và ví được lấy trong cùng một lần gọi
+            user, wallets = get_user_with_wallets(email)
             
             if not user:
                 print(" Không tìm thấy người dùng. Vui lòng thử lại.")
@@ -63,7 +160,6 @@ def main():
 
             print(f"\n Xin chào {user.get('full_name', 'bạn')}!")
             
-            wallets = get_wallets_by_user_id(user["id"])
             if not wallets:
                 print(" Bạn chưa có ví nào. Vui lòng tạo ví mới.")
                 continue
@@ -73,14 +169,11 @@ def main():
                 print(f"   {i}. {wallet.get('name', 'Không tên')} ({format_currency(wallet.get('balance', 0))})")
             
             wallet_ids = [w["id"] for w in wallets]
-            print("\n Đang tải giao dịch...")
-            transactions = get_transactions_by_wallet_ids(wallet_ids)
-            
-            if not transactions:
-                print(" Không tìm thấy giao dịch nào.")
-                continue
-                
-            print(f" Đã tải {len(transactions)} giao dịch gần đây.")
+            # Đồng bộ bản sao cục bộ và dựng bảng cột trên thread nền; người dùng
+            # hỏi được ngay, câu hỏi cần dữ liệu chỉ chờ nếu chưa tải xong
+            loader = TransactionLoader(user["id"], wallet_ids).start()
+            transactions = None
+            print("\n Đang tải giao dịch trong nền, bạn có thể đặt câu hỏi ngay.")
             print_help()
             
             while True:
@@ -95,10 +188,19 @@ def main():
                         return
                         
                     if question.lower() in ["đổi", "đổi người dùng"]:
+                        loader.cancel()
                         clear_screen()
                         print_header()
                         break
                         
+                    if question.lower() in ["tải lại", "tai lai", "reload"]:
+                        loader.cancel()
+                        invalidate_cache(email=email, user_id=user["id"], wallet_ids=wallet_ids)
+                        loader = TransactionLoader(user["id"], wallet_ids).start()
+                        transactions = None
+                        print("\n Đang tải lại giao dịch trong nền.")
+                        continue
+
                     if question.lower() in ["giúp", "help", "hướng dẫn"]:
                         print_help()
                         continue
@@ -128,32 +230,22 @@ def main():
                         print("\n " + random.choice(greeting_responses))
                         continue
                     
-                    # Process with query_handler (dùng dữ liệu Supabase cho câu hỏi tài chính)
-                    result, message = handle_question(question, transactions)
-
-                    # Không đủ dữ liệu giao dịch
-                    if message == "Không đủ dữ liệu để trả lời.":
-                        print("\n Không đủ dữ liệu để trả lời.")
-                        continue
-
-                    # Không phải câu hỏi tài chính → gọi LLM như chatbot chung (không dùng dữ liệu giao dịch)
-                    if result is None and message is None:
-                        try:
-                            answer = ask_ollama(question)
-                            print(f"\n {answer}")
-                        except Exception as e:
-                            print(f"\n Lỗi khi gọi LLM: {e}")
-                            print("Vui lòng thử lại sau.")
-                        continue
+                    with collect() as timings, span("question"):
+                        with span("parse"):
+                            plan = parse_question(question)
+                        if STATS_PUSHDOWN and needs_transactions(plan):
+                            # Gom tổng trên database, không chờ tải giao dịch về
+                            answer_question(question, plan, RemoteTransactions(wallet_ids), email)
+                        elif not (transactions is None and needs_transactions(plan)
+                                  and answer_from_partial(loader, question, plan, email)):
+                            # Câu hỏi cho LLM dùng dữ liệu nếu đã tải xong, không chờ
+                            if transactions is None and (needs_transactions(plan) or loader.done()):
+                                with span("wait_transactions"):
+                                    transactions = wait_for_transactions(loader, profile)
+                            answer_question(question, plan, transactions, email)
+                    if profile:
+                        print_timings(timings)
 
-                    # Câu hỏi tài chính có dữ liệu
-                    if result is not None:
-                        # message đã được format sẵn bằng format_stats/format_currency
-                        print(f"\n {message}")
-                    else:
-                        print("\n Tôi không hiểu câu hỏi của bạn. Dưới đây là một số gợi ý:")
-                        print_help()
-                        
                 except KeyboardInterrupt:
                     print("\n Hẹn gặp lại bạn!")
                     return
@@ -168,9 +260,26 @@ def main():
             print(f"\n Có lỗi xảy ra: {str(e)}")
             print("Vui lòng thử lại.")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Trợ lý quản lý tài chính cá nhân")
+    parser.add_argument("--profile", action="store_true",
+                        help="In thời gian từng bước cho mỗi câu hỏi, ghi histogram + cProfile khi thoát")
+    parser.add_argument("--profile-output", default="profile.txt",
+                        help="File ghi số liệu profile (mặc định profile.txt, kèm profile.txt.prof)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    # Mức log lấy từ biến môi trường LOG_LEVEL (mặc định WARNING, TRACE để lấy mẫu từng giao dịch)
+    configure_logging()
+    profiler = start_profiler() if args.profile else None
     try:
-        main()
+        main(profile=args.profile)
     except Exception as e:
         print(f"\n Có lỗi nghiêm trọng: {str(e)}")
         input("Nhấn Enter để thoát...")
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            dump(args.profile_output, profiler)
+            print(f"\n Đã ghi số liệu profile vào {args.profile_output}")
@@ -1,19 +1,426 @@
+import codecs
+import json
+import os
+import re
+import signal
+import socket
 import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 
-def ask_ollama(prompt, model="deepseek-r1:7b"):
+from llm_cache import ResponseCache
+from llm_scheduler import INTERACTIVE, LLM_WORKERS, DeadlineExceeded, QueueFull, get_scheduler
+from log_utils import get_logger
+from profiling import record, span
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # Không có requests thì chỉ dùng được `ollama run`
+    requests = None
+
+logger = get_logger(__name__)
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Thời gian chờ kết nối / chờ trả lời (giây)
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+# Giữ model trong RAM giữa các câu hỏi (định dạng của Ollama: "30m", "1h", -1 = mãi mãi)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Thời gian tối đa cho một câu trả lời của model (giây), 0 = không giới hạn
+OLLAMA_DEADLINE = float(os.getenv("OLLAMA_DEADLINE", "120"))
+
+BUSY_MESSAGE = "❌ Ollama đang bận, vui lòng thử lại sau."
+TIMEOUT_NOTE = "⏱ (Hết thời gian chờ, câu trả lời có thể chưa đầy đủ.)"
+
+
+class Generation:
+    """
+    Hạn chót và nút dừng cho một lần gọi model. cancel() (gọi từ thread khác, hoặc
+    tự gọi khi đến hạn) dừng ngay lời gọi đang chờ: ngắt kết nối HTTP hoặc kill
+    process `ollama run`. Phần câu trả lời đã nhận vẫn được trả về.
+
+        with Generation(timeout=60) as generation:
+            ...
+    """
+
+    def __init__(self, timeout=None, clock=time.monotonic):
+        self.clock = clock
+        self.deadline = clock() + timeout if timeout else None
+        self.reason = None   # None | "deadline" | "cancelled"
+        self._aborts = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Số giây còn lại, None nếu không có hạn chót"""
+        return None if self.deadline is None else max(0.0, self.deadline - self.clock())
+
+    def stopped(self):
+        """Lý do dừng (kể cả khi đã quá hạn mà bộ đếm chưa kịp gọi cancel), None nếu chưa dừng"""
+        if self.reason is None and self.remaining() == 0.0:
+            self.cancel("deadline")
+        return self.reason
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            aborts = list(self._aborts)
+        logger.debug("Dừng lời gọi Ollama: %s", reason)
+        for abort in aborts:
+            try:
+                abort()
+            except OSError:
+                pass
+
+    @contextmanager
+    def watch(self, abort):
+        """Gọi abort() nếu lời gọi bị dừng trong lúc chạy khối with"""
+        with self._lock:
+            stopped = self.reason is not None
+            if not stopped:
+                self._aborts.append(abort)
+        if stopped:
+            abort()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if abort in self._aborts:
+                    self._aborts.remove(abort)
+
+    def __enter__(self):
+        remaining = self.remaining()
+        if remaining is not None and self._timer is None:
+            self._timer = threading.Timer(remaining, self.cancel, args=("deadline",))
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._timer is not None:
+            self._timer.cancel()
+        return False
+
+
+def _shutdown_response(res):
+    """Ngắt kết nối của response đang stream (close() không đánh thức được lần đọc đang chờ)"""
+    sock = getattr(getattr(res.raw, "connection", None), "sock", None)
+    if sock is not None:
+        sock.shutdown(socket.SHUT_RDWR)
+    else:
+        res.close()
+
+
+class OllamaClient:
+    """
+    Gọi Ollama qua HTTP API (/api/generate) trên một Session dùng chung,
+    kết nối keep-alive được tái sử dụng thay vì mở process `ollama run` mỗi câu hỏi.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout=OLLAMA_READ_TIMEOUT, keep_alive=OLLAMA_KEEP_ALIVE, pool_size=max(4, LLM_WORKERS)):
+        if requests is None:
+            raise RuntimeError("Cần cài thư viện requests để gọi Ollama qua HTTP")
+        self.host = host.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def stream(self, prompt, model="deepseek-r1:7b", generation=None):
+        """
+        Gửi prompt và yield từng đoạn câu trả lời ngay khi model sinh ra.
+        generation: Generation để dừng giữa chừng (đóng kết nối, Ollama ngừng sinh)
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+        }
+        timeout = self.timeout
+        remaining = generation.remaining() if generation is not None else None
+        if remaining is not None:
+            timeout = (timeout[0], min(timeout[1], max(remaining, 0.1)))
+        with self.session.post(f"{self.host}/api/generate", json=payload,
+                               timeout=timeout, stream=True) as res, \
+                (generation.watch(lambda: _shutdown_response(res)) if generation else nullcontext()):
+            res.raise_for_status()
+            for line in res.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    return
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_response_cache = None
+
+
+def get_client():
+    """OllamaClient dùng chung cho cả chương trình (tạo khi cần lần đầu)"""
+    global _client
+    if _client is None:
+        _client = OllamaClient()
+    return _client
+
+
+def get_response_cache():
+    """ResponseCache dùng chung, đọc từ đĩa khi cần lần đầu"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+
+class ThinkFilter:
+    """
+    Bỏ khối <think>...</think> của deepseek-r1 khỏi luồng trả lời ngay khi đang stream,
+    không cần chờ hết câu trả lời. Thẻ bị cắt giữa hai đoạn vẫn được nhận ra.
+    """
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.inside = False
+        self.started = False
+
+    @staticmethod
+    def _partial_tag(text, tag):
+        """Độ dài phần cuối của text có thể là phần đầu của tag"""
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+    def _visible(self, text):
+        # Bỏ khoảng trắng ở đầu câu trả lời (thường là "\n\n" ngay sau </think>)
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+    def feed(self, text):
+        """Nhận thêm một đoạn, trả về phần có thể hiển thị ngay"""
+        self.buffer += text
+        out = []
+        while self.buffer:
+            tag = self.CLOSE if self.inside else self.OPEN
+            idx = self.buffer.find(tag)
+            if idx >= 0:
+                if not self.inside:
+                    out.append(self.buffer[:idx])
+                self.buffer = self.buffer[idx + len(tag):]
+                self.inside = not self.inside
+                continue
+            keep = self._partial_tag(self.buffer, tag)
+            if not self.inside:
+                out.append(self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return self._visible("".join(out))
+
+    def flush(self):
+        """Phần còn giữ lại khi luồng kết thúc"""
+        rest = "" if self.inside else self.buffer
+        self.buffer = ""
+        return self._visible(rest)
+
+
+def strip_thinking(text):
+    """Bỏ khối <think>...</think> khỏi câu trả lời đầy đủ"""
+    return re.sub(r"<think>.*?(</think>|$)", "", text, flags=re.DOTALL).strip()
+
+
+def _stream_subprocess(prompt, model, generation):
+    """
+    Chạy `ollama run` và yield stdout theo từng đoạn thay vì chờ process kết thúc.
+    Process bị kill khi generation dừng, phần đã đọc được vẫn được giữ.
+    """
+    # Nhóm process riêng: kill được cả các process con đang giữ stdout,
+    # và Ctrl+C của người dùng không đi thẳng tới `ollama run`
+    process = subprocess.Popen(
+        ["ollama", "run", model],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        with generation.watch(lambda: _kill_process(process)):
+            yield from _read_process(process, prompt)
+    finally:
+        if process.poll() is None:
+            _kill_process(process)
+        process.wait()
+
+
+def _kill_process(process):
+    """Kill `ollama run` cùng các process con của nó"""
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+
+def _read_process(process, prompt):
+    try:
+        process.stdin.write((prompt + "\n").encode("utf-8"))
+        process.stdin.close()
+    except BrokenPipeError:
+        # Process đã bị kill trước khi đọc hết prompt
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    fd = process.stdout.fileno()
+    while True:
+        data = os.read(fd, 1024)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _stream_chunks(prompt, model, use_http, generation):
+    """
+    Yield các đoạn trả lời thô, ưu tiên HTTP, quay về `ollama run` nếu không kết nối được.
+    Khi generation bị dừng (hủy / hết hạn) thì kết thúc bình thường với phần đã nhận.
+    """
+    try:
+        if use_http and requests is not None:
+            started = False
+            try:
+                for chunk in get_client().stream(prompt, model, generation):
+                    started = True
+                    yield chunk
+                return
+            except requests.ConnectionError as e:
+                if started or generation.stopped():
+                    raise
+                logger.warning("Không kết nối được Ollama server, chuyển sang `ollama run`: %s", e)
+        yield from _stream_subprocess(prompt, model, generation)
+    except Exception:
+        if not generation.stopped():
+            raise
+
+
+def _queue_timeout(timeout, generation):
+    """Thời gian chờ đến lượt gọi model, không quá hạn chót của câu trả lời"""
+    remaining = generation.remaining()
+    if remaining is None:
+        return timeout
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def _ask_ollama_stream(prompt, model, use_http, hide_thinking, cache, priority, timeout, generation):
+    if cache is not None:
+        cached = cache.get(prompt, model)
+        if cached is not None:
+            yield strip_thinking(cached) if hide_thinking else cached
+            return
+
+    think_filter = ThinkFilter() if hide_thinking else None
+    parts = []
+    start = time.perf_counter()
+    try:
+        with get_scheduler().slot(priority, _queue_timeout(timeout, generation)), generation:
+            yield from _stream_filtered(prompt, model, use_http, generation, think_filter, parts, start)
+        record("ollama.stream", time.perf_counter() - start)
+        if generation.stopped() == "deadline":
+            yield ("\n\n" if parts else "") + TIMEOUT_NOTE
+        elif cache is not None and parts and generation.reason is None:
+            # Cache câu trả lời thô (kể cả <think>) khi đã nhận đủ
+            cache.put(prompt, model, "".join(parts).strip())
+    except (QueueFull, DeadlineExceeded) as e:
+        logger.warning("Không gọi được Ollama: %s", e)
+        yield BUSY_MESSAGE
+    except Exception as e:
+        logger.error("Lỗi Ollama: %s", e)
+        yield "❌ Lỗi khi gọi Ollama."
+
+
+def _stream_filtered(prompt, model, use_http, generation, think_filter, parts, start):
+    """Yield phần hiển thị được của câu trả lời, gom đoạn thô vào parts"""
+    for chunk in _stream_chunks(prompt, model, use_http, generation):
+        if not parts:
+            # Thời gian chờ đoạn đầu tiên (xếp hàng + nạp model + xử lý prompt)
+            record("ollama.first_chunk", time.perf_counter() - start)
+        parts.append(chunk)
+        if think_filter:
+            chunk = think_filter.feed(chunk)
+        if chunk:
+            yield chunk
+    if think_filter:
+        rest = think_filter.flush()
+        if rest:
+            yield rest
+
+
+def ask_ollama(prompt, model="deepseek-r1:7b", use_http=True, stream=False, hide_thinking=False, use_cache=True,
+               priority=INTERACTIVE, timeout=None, deadline=OLLAMA_DEADLINE, generation=None):
+    """
+    Hỏi model qua Ollama.
+
+    Mặc định dùng HTTP API với kết nối giữ sẵn; nếu không cài requests hoặc
+    không kết nối được server Ollama thì quay về chạy `ollama run`.
+
+    Args:
+        stream: True để nhận generator yield từng đoạn câu trả lời ngay khi có
+        hide_thinking: Bỏ khối <think>...</think> của deepseek-r1
+        use_cache: Dùng lại câu trả lời cũ cho câu hỏi giống nhau (xem llm_cache)
+        priority: INTERACTIVE hoặc BATCH (llm_scheduler), lời gọi model xếp hàng theo mức này
+        timeout: Thời gian chờ đến lượt gọi model tối đa (giây), None = chờ mãi
+        deadline: Thời gian tối đa cho cả câu trả lời (giây), 0/None = không giới hạn.
+            Hết hạn thì dừng model và trả về phần đã nhận kèm TIMEOUT_NOTE
+        generation: Generation tự tạo để có thể cancel() từ thread khác (thay cho deadline)
+
+    Với stream=True, đóng generator giữa chừng (hoặc Ctrl+C khi đang đọc) cũng dừng model.
+    """
+    cache = get_response_cache() if use_cache else None
+    if generation is None:
+        generation = Generation(deadline)
+    if stream:
+        return _ask_ollama_stream(prompt, model, use_http, hide_thinking, cache, priority, timeout, generation)
+
+    answer = cache.get(prompt, model) if cache is not None else None
+    if answer is not None:
+        return strip_thinking(answer) if hide_thinking else answer
     try:
-        process = subprocess.Popen(
-            ["ollama", "run", model],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,               # text mode
-            encoding="utf-8"          # ← quan trọng
-        )
-        stdout, stderr = process.communicate(prompt + "\n")
-        if stderr:
-            print("Lỗi Ollama:", stderr)
-        return stdout.strip()
+        with get_scheduler().slot(priority, _queue_timeout(timeout, generation)), generation, \
+                span("ollama.generate"):
+            answer = "".join(_stream_chunks(prompt, model, use_http, generation)).strip()
+    except (QueueFull, DeadlineExceeded) as e:
+        logger.warning("Không gọi được Ollama: %s", e)
+        return BUSY_MESSAGE
     except Exception as e:
-        print("Lỗi Ollama:", e)
-        return "❌ Lỗi khi gọi Ollama."
\ No newline at end of file
+        logger.error("Lỗi Ollama: %s", e)
+        return "❌ Lỗi khi gọi Ollama."
+    if cache is not None and answer and generation.reason is None:
+        cache.put(prompt, model, answer)
+    if hide_thinking:
+        answer = strip_thinking(answer)
+    if generation.stopped() == "deadline":
+        answer = f"{answer}\n\n{TIMEOUT_NOTE}" if answer else TIMEOUT_NOTE
+    return answer
@@ -0,0 +1,178 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Tắt mặc định: span() trả về một context rỗng dùng chung nên gần như không tốn gì
+_enabled = False
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = {}
+_NULL_SPAN = nullcontext()
+
+# Biên các ô của histogram (giây)
+HISTOGRAM_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Xóa số liệu cộng dồn"""
+    with _lock:
+        _histograms.clear()
+
+
+class _Span:
+    __slots__ = ("name", "start", "depth")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        self.depth = len(stack)
+        stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _local.stack.pop()
+        record(self.name, elapsed, self.depth, self.start)
+        return False
+
+
+def span(name):
+    """
+    Đo thời gian một đoạn code:
+
+        with span("supabase.sync"):
+            ...
+
+    Các span lồng nhau được ghi kèm độ sâu để in dạng cây (xem collect).
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def record(name, seconds, depth=0, start=None):
+    """Ghi một khoảng thời gian đo sẵn vào histogram và vào collect() đang mở (nếu có)"""
+    if not _enabled:
+        return
+    with _lock:
+        _histograms.setdefault(name, []).append(seconds)
+    records = getattr(_local, "records", None)
+    if records is not None:
+        records.append((time.perf_counter() - seconds if start is None else start, depth, name, seconds))
+
+
+@contextmanager
+def collect():
+    """
+    Gom các span chạy trong khối with (cùng thread), dùng để in bảng thời gian
+    cho từng câu hỏi. Yield danh sách (start, depth, name, seconds).
+    """
+    previous = getattr(_local, "records", None)
+    records = []
+    _local.records = records
+    try:
+        yield records
+    finally:
+        _local.records = previous
+
+
+def format_breakdown(records):
+    """Bảng thời gian theo thứ tự bắt đầu, thụt lề theo độ sâu"""
+    if not records:
+        return ""
+    records = sorted(records)
+    base_depth = min(depth for _, depth, _, _ in records)
+    total = sum(seconds for _, depth, _, seconds in records if depth == base_depth)
+    lines = []
+    for _, depth, name, seconds in records:
+        share = f"{seconds / total:6.1%}" if total else "      "
+        indent = "  " * (depth - base_depth)
+        lines.append(f"  {indent}{name:<{32 - len(indent)}} {seconds * 1000:10.2f} ms {share}")
+    lines.append(f"  {'tổng':<32} {total * 1000:10.2f} ms")
+    return "\n".join(lines)
+
+
+def _percentile(samples, q):
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def histogram_summary():
+    """{tên span: {count, total_ms, mean_ms, p50_ms, p90_ms, p99_ms, max_ms, buckets}}"""
+    with _lock:
+        snapshot = {name: sorted(samples) for name, samples in _histograms.items()}
+    summary = {}
+    for name, samples in snapshot.items():
+        buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for seconds in samples:
+            i = 0
+            while i < len(HISTOGRAM_BOUNDS) and seconds > HISTOGRAM_BOUNDS[i]:
+                i += 1
+            buckets[i] += 1
+        total = sum(samples)
+        summary[name] = {
+            "count": len(samples),
+            "total_ms": total * 1000,
+            "mean_ms": total / len(samples) * 1000,
+            "p50_ms": _percentile(samples, 0.5) * 1000,
+            "p90_ms": _percentile(samples, 0.9) * 1000,
+            "p99_ms": _percentile(samples, 0.99) * 1000,
+            "max_ms": samples[-1] * 1000,
+            "buckets": buckets,
+        }
+    return summary
+
+
+def format_histograms():
+    labels = [f"<={b * 1000:g}ms" for b in HISTOGRAM_BOUNDS] + [f">{HISTOGRAM_BOUNDS[-1] * 1000:g}ms"]
+    lines = [f"{'span':<28} {'count':>6} {'total ms':>11} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for name, s in sorted(histogram_summary().items(), key=lambda x: -x[1]["total_ms"]):
+        lines.append(f"{name:<28} {s['count']:>6} {s['total_ms']:>11.2f} {s['p50_ms']:>9.2f}"
+                     f" {s['p90_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+        lines.append("    " + "  ".join(f"{label} {n}" for label, n in zip(labels, s["buckets"]) if n))
+    return "\n".join(lines)
+
+
+def dump(path, profiler=None, limit=50):
+    """
+    Ghi histogram cộng dồn của các span và (nếu có) thống kê cProfile ra file văn bản.
+    Dữ liệu cProfile thô được ghi thêm vào path + ".prof" để mở bằng pstats/snakeviz.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# Thời gian theo span\n")
+        f.write(format_histograms())
+        f.write("\n")
+        if profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+            f.write("\n# cProfile (sắp theo thời gian cộng dồn)\n")
+            f.write(stream.getvalue())
+    if profiler is not None:
+        profiler.dump_stats(f"{path}.prof")
+
+
+def start_profiler():
+    """Bật span và cProfile cho cả phiên chạy. Returns: cProfile.Profile đang chạy"""
+    enable()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
@@ -0,0 +1,151 @@
+import os
+from datetime import date
+
+from data_processor import StatsQuery, format_currency, run_queries
+from profiling import span
+from transaction_frame import as_frame
+
+# Số token tối đa của cả prompt (quy tắc + dữ liệu tóm tắt + câu hỏi), 0 = không gửi dữ liệu
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+# Ước lượng thô: khoảng 3 ký tự tiếng Việt có dấu mỗi token
+CHARS_PER_TOKEN = 3
+
+# Số dòng tối đa của từng phần tóm tắt
+CONTEXT_MONTHS = 12
+CONTEXT_CATEGORIES = 10
+CONTEXT_RECENT = 10
+
+GROUP_LABELS = {
+    "expense": "Chi tiêu",
+    "income": "Thu nhập",
+    "debt-loan": "Vay / nợ",
+}
+
+NO_DATA_TEXT = "Không có giao dịch nào."
+NO_ROOM_TEXT = "Không đủ chỗ cho dữ liệu giao dịch."
+
+PROMPT_TEMPLATE = """
+Bạn là trợ lý phân tích tài chính cá nhân cho ứng dụng quản lý chi tiêu.
+
+QUY TẮC:
+1. Nếu người dùng hỏi về chi tiêu, hóa đơn, số tiền, tổng tiền, theo ngày/tháng/năm:
+   - Bạn CHỈ được sử dụng dữ liệu tại phần "DỮ LIỆU SUPABASE" (bản tóm tắt đã tính sẵn bên dưới).
+   - Các con số là tổng đã cộng sẵn, không được bịa số liệu.
+   - Nếu không đủ dữ liệu thì phải trả lời đúng câu: "Không đủ dữ liệu để trả lời.".
+
+2. Nếu câu hỏi không liên quan đến tài chính:
+   - Trả lời như một chatbot bình thường.
+   - Có thể sáng tạo và nói chuyện thoải mái.
+
+DỮ LIỆU SUPABASE CỦA NGƯỜI DÙNG {user_email}:
+{context}
+
+CÂU HỎI CỦA NGƯỜI DÙNG:
+{question}
+"""
+
+
+def estimate_tokens(text):
+    """Số token ước lượng của một đoạn văn bản"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _group_label(group):
+    return GROUP_LABELS.get(group, group.title() if group else "Khác")
+
+
+def _context_sections(frame):
+    """
+    Các phần tóm tắt [(tiêu đề, [dòng, ...]), ...] theo thứ tự ưu tiên, tính từ các
+    tổng của get_transaction_stats (mọi nhóm trong MỘT lượt duyệt run_queries)
+    """
+    groups = [g for g in frame.groups if g]
+    stats = dict(zip(groups, run_queries(frame, [StatsQuery('stats', g) for g in groups])))
+    stats = {g: s for g, s in stats.items() if s['count']}
+
+    overview = [
+        f"- {_group_label(g)}: {format_currency(s['total'])}, {s['count']} giao dịch"
+        for g, s in stats.items()
+    ]
+    if frame.dates[0]:
+        # Đoạn đầu của row_ranges() là các dòng có ngày, giảm dần
+        start, stop = frame.row_ranges()[0]
+        first, last = date.fromordinal(frame.dates[stop - 1]), date.fromordinal(frame.dates[start])
+        overview.append(f"- Dữ liệu từ {first.isoformat()} đến {last.isoformat()}")
+
+    # Tháng gần nhất trước
+    months = sorted({m for s in stats.values() for m in s['by_month']}, reverse=True)
+    by_month = []
+    for month in months[:CONTEXT_MONTHS]:
+        parts = [
+            f"{_group_label(g).lower()} {format_currency(s['by_month'][month])}"
+            for g, s in stats.items() if month in s['by_month']
+        ]
+        by_month.append(f"- {month}: " + ", ".join(parts))
+
+    by_category = []
+    for g, s in stats.items():
+        for category, amount in list(s['by_category'].items())[:CONTEXT_CATEGORIES]:
+            percent = amount / s['total'] * 100 if s['total'] > 0 else 0
+            by_category.append(
+                f"- {_group_label(g)} / {category.title()}: {format_currency(amount)} ({percent:.1f}%)"
+            )
+
+    # Bảng đã sắp xếp theo ngày giảm dần: các dòng đầu là giao dịch mới nhất
+    recent = []
+    for i in range(min(len(frame), CONTEXT_RECENT)):
+        ordinal = frame.dates[i]
+        day = date.fromordinal(ordinal).isoformat() if ordinal else "không rõ ngày"
+        category = frame.categories[frame.category_codes[i]] or "Khác"
+        group = _group_label(frame.groups[frame.group_codes[i]])
+        recent.append(f"- {day}: {category} ({group}) {format_currency(frame.amounts[i])}")
+
+    return [
+        ("TỔNG QUAN:", overview),
+        ("THEO THÁNG (gần nhất trước):", by_month),
+        ("THEO DANH MỤC (lớn nhất trước):", by_category),
+        ("GIAO DỊCH GẦN ĐÂY:", recent),
+    ]
+
+
+def build_context(transactions, budget):
+    """
+    Tóm tắt dữ liệu giao dịch trong tối đa budget token. Mỗi phần bị cắt bớt
+    dòng cuối (ít quan trọng nhất) khi hết chỗ, nên độ dài không phụ thuộc
+    số giao dịch.
+    """
+    frame = as_frame(transactions or [])
+    if not len(frame):
+        return NO_DATA_TEXT
+
+    lines = []
+    used = 0
+    for title, items in _context_sections(frame):
+        section = []
+        cost = estimate_tokens(title)
+        for item in items:
+            item_cost = estimate_tokens(item)
+            if used + cost + item_cost > budget:
+                break
+            section.append(item)
+            cost += item_cost
+        if section:
+            lines.append(title)
+            lines.extend(section)
+            used += cost
+    return "\n".join(lines) if lines else NO_ROOM_TEXT
+
+
+def build_prompt(user_email, transactions, question, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Prompt cho LLM gồm quy tắc, bản tóm tắt dữ liệu (tổng theo nhóm / tháng /
+    danh mục và vài giao dịch gần nhất) và câu hỏi, tổng cộng khoảng budget token.
+
+    Args:
+        transactions: Danh sách giao dịch hoặc TransactionFrame
+        budget: Số token tối đa của prompt (ước lượng bằng estimate_tokens)
+    """
+    with span("prompt.build"):
+        fixed = PROMPT_TEMPLATE.format(user_email=user_email, context="", question=question)
+        context = build_context(transactions, budget - estimate_tokens(fixed))
+        return PROMPT_TEMPLATE.format(user_email=user_email, context=context, question=question)
@@ -1,6 +1,169 @@
 from datetime import datetime, timedelta, date
-from data_processor import get_transaction_stats, format_stats, find_highest_spending_category, format_currency
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+from typing import NamedTuple, Optional, Tuple
+from data_processor import StatsQuery, run_queries, format_stats, format_currency
+from transaction_frame import TransactionFrame
+from keyword_matcher import KeywordMatcher
+from log_utils import get_logger
+from profiling import span
 import random
+import re
+
+logger = get_logger(__name__)
+
+# Từ khóa nhận diện câu hỏi (dựng một lần khi import)
+GREETING_PHRASES = frozenset([
+    "xin chào",
+    "xin chao",
+    "hello",
+    "hi",
+    "chào",
+    "chao",
+    "chào bạn",
+    "chao ban"
+])
+
+GREETING_RESPONSES = [
+    "Chào bạn! Tôi có thể giúp gì bạn hôm nay?",
+    "Xin chào! Bạn đang muốn xem chi tiêu hay thu nhập?",
+    "Hello, mình có thể hỗ trợ bạn xem tổng tiền hoặc hóa đơn.",
+    "Chào bạn, mình có thể giúp bạn phân tích chi tiêu theo tháng/năm.",
+    "Xin chào! Hãy hỏi mình về tổng tiền, hóa đơn hoặc danh mục chi tiêu nhé."
+]
+
+# Detect finance / transaction-related question
+FINANCE_KEYWORDS = [
+    # General
+    "tổng", "bao nhiêu", "tiền", "chi phí", "thu nhập", "thống kê",
+    "đã chi", "đã thu", "số tiền", "hết bao nhiêu", "giao dịch",
+    "income", "expense", "money", "spent", "earned", "tính", "tính tổng",
+    "chi", "thu", "lương", "bill", "hóa đơn", "nhiều nhất", "cao nhất", "lớn nhất", "tốn kém nhất", "chi nhiều nhất", "ít nhất", "nhỏ nhất",
+    # Time periods
+    "hôm nay", "hôm qua", "tuần này", "tuần trước",
+    "tháng này", "tháng trước", "năm nay", "năm ngoái",
+    "3 tháng", "quý này", "quý trước",
+    # Categories
+    "nước", "điện", "tiền điện", "tiền nước", "hóa đơn điện", "hóa đơn nước",
+    "ăn uống", "nhà hàng", "cà phê", "siêu thị", "chợ", "đi chợ",
+    "xăng", "nhiên liệu", "gửi xe", "mua sắm", "quần áo", "giày dép",
+    "giải trí", "xem phim", "du lịch", "khách sạn",
+    "y tế", "khám bệnh", "bệnh viện", "thuốc men", "bảo hiểm",
+    "học phí", "sách vở", "giáo dục",
+    "tiền nhà", "tiền thuê", "tiền phòng", "tiền trọ", "điện nước",
+    "internet", "mạng", "điện thoại", "truyền hình"
+]
+
+CATEGORY_MAPPING = {
+    # Tiện ích
+    'nước': 'water',
+    'tiền nước': 'water',
+    'hóa đơn nước': 'water',
+    'water bill': 'water',
+    'điện': 'electricity',
+    'tiền điện': 'electricity',
+    'hóa đơn điện': 'electricity',
+    'internet': 'internet',
+    'mạng': 'internet',
+    'điện thoại': 'phone',
+    'di động': 'phone',
+    'truyền hình': 'cable',
+    'truyền hình cáp': 'cable',
+    'tivi': 'cable',
+
+    # Ăn uống
+    'ăn uống': 'food',
+    'thức ăn': 'food',
+    'đồ ăn': 'food',
+    'nhà hàng': 'restaurant',
+    'quán ăn': 'restaurant',
+    'cà phê': 'coffee',
+    'nước uống': 'beverage',
+    'đồ uống': 'beverage',
+
+    # Mua sắm
+    'mua sắm': 'shopping',
+    'siêu thị': 'grocery',
+    'đi chợ': 'grocery',
+    'chợ': 'grocery',
+    'quần áo': 'clothing',
+    'thời trang': 'clothing',
+    'giày dép': 'footwear',
+
+    # Nhà ở
+    'tiền nhà': 'rent',
+    'thuê nhà': 'rent',
+    'tiền thuê': 'rent',
+    'tiền phòng': 'rent',
+    'tiền trọ': 'rent',
+
+    # Giao thông
+    'xăng': 'gas',
+    'dầu': 'gas',
+    'nhiên liệu': 'gas',
+    'đổ xăng': 'gas',
+    'gửi xe': 'parking',
+    'đậu xe': 'parking',
+
+    # Giải trí
+    'giải trí': 'entertainment',
+    'xem phim': 'movies',
+    'phim ảnh': 'movies',
+    'game': 'gaming',
+    'trò chơi': 'gaming',
+    'thể thao': 'sports',
+    'gym': 'fitness',
+    'tập thể dục': 'fitness',
+
+    # Y tế
+    'y tế': 'healthcare',
+    'khám bệnh': 'healthcare',
+    'bệnh viện': 'healthcare',
+    'thuốc men': 'medicine',
+
+    # Giáo dục
+    'giáo dục': 'education',
+    'học phí': 'tuition',
+    'sách vở': 'books',
+
+    # Khác
+    'quà tặng': 'gifts',
+    'tiệc tùng': 'party',
+    'sửa chữa': 'repairs',
+    'bảo hiểm': 'insurance'
+}
+
+PERIOD_KEYWORDS = [
+    "hôm nay", "hôm qua", "tuần này", "tuần trước",
+    "tháng này", "tháng nay", "tháng trước", "năm nay", "năm ngoái",
+    "3 tháng", "ba tháng", "quý này", "quý trước", "tháng "
+]
+HIGHEST_KEYWORDS = frozenset(["nhiều nhất", "cao nhất", "nhiều tiền nhất", "lớn nhất", "tốn kém nhất", "chi nhiều nhất"])
+HIGHEST_EXPENSE_KEYWORDS = frozenset(["chi tiêu", "expense", "chi phí", "đã chi", "chi ra"])
+LOWEST_KEYWORDS = frozenset(["ít nhất", "nhỏ nhất"])
+EXPENSE_HINT_KEYWORDS = frozenset(["chi tiêu", "expense", "chi phí", "đã chi"])
+INCOME_KEYWORDS = frozenset(["thu nhập", "lương", "income", "tiền lương"])
+EXPENSE_KEYWORDS = frozenset(["chi tiêu", "expense", "chi phí", "đã chi", "đã tiêu"])
+COMPARE_KEYWORDS = frozenset(["so sánh", "so sanh"])
+# Câu hỏi tài chính mở (tư vấn) không tính được bằng truy vấn thống kê: hỏi LLM
+# kèm bản tóm tắt giao dịch (xem prompt_builder)
+ADVICE_KEYWORDS = frozenset([
+    "tiết kiệm", "ngân sách", "đầu tư", "cắt giảm", "nợ", "vay",
+    "budget", "saving", "invest", "finance", "debt", "loan",
+])
+
+FINANCE_KEYWORD_SET = frozenset(FINANCE_KEYWORDS)
+# Thứ tự ưu tiên của từ khóa danh mục (giống thứ tự duyệt CATEGORY_MAPPING)
+CATEGORY_ORDER = {keyword: i for i, keyword in enumerate(CATEGORY_MAPPING)}
+
+# Một automaton cho mọi từ khóa: mỗi câu hỏi chỉ duyệt một lượt
+KEYWORD_MATCHER = KeywordMatcher(
+    set(FINANCE_KEYWORDS) | set(CATEGORY_MAPPING) | set(PERIOD_KEYWORDS) |
+    HIGHEST_KEYWORDS | HIGHEST_EXPENSE_KEYWORDS | LOWEST_KEYWORDS |
+    INCOME_KEYWORDS | EXPENSE_KEYWORDS | COMPARE_KEYWORDS | ADVICE_KEYWORDS
+)
+EXPLICIT_MONTH_RE = re.compile(r"tháng\s+(\d{1,2})(?:/(\d{4}))?")
 
 def parse_date(date_str, date_format='%Y-%m-%d'):
     """Parse date string to date object"""
@@ -11,114 +174,79 @@ def parse_date(date_str, date_format='%Y-%m-%d'):
     except (ValueError, TypeError):
         return None
 
-def handle_question(question, transactions):
-    if not question or not isinstance(question, str):
-        return None, "Vui lòng nhập câu hỏi hợp lệ"
-        
-    question_lower = question.lower().strip()
-    
-    # Handle greetings first (chỉ khi cả câu là lời chào)
-    greeting_phrases = [
-        "xin chào",
-        "xin chao",
-        "hello",
-        "hi",
-        "chào",
-        "chao",
-        "chào bạn",
-        "chao ban"
-    ]
-    if question_lower in greeting_phrases:
-        greeting_responses = [
-            "Chào bạn! Tôi có thể giúp gì bạn hôm nay?",
-            "Xin chào! Bạn đang muốn xem chi tiêu hay thu nhập?",
-            "Hello, mình có thể hỗ trợ bạn xem tổng tiền hoặc hóa đơn.",
-            "Chào bạn, mình có thể giúp bạn phân tích chi tiêu theo tháng/năm.",
-            "Xin chào! Hãy hỏi mình về tổng tiền, hóa đơn hoặc danh mục chi tiêu nhé."
-        ]
-        return None, random.choice(greeting_responses)
-    
-    # Detect finance / transaction-related question
-    finance_keywords = [
-        # General
-        "tổng", "bao nhiêu", "tiền", "chi phí", "thu nhập", "thống kê",
-        "đã chi", "đã thu", "số tiền", "hết bao nhiêu", "giao dịch",
-        "income", "expense", "money", "spent", "earned", "tính", "tính tổng",
-        "chi", "thu", "lương", "bill", "hóa đơn", "nhiều nhất", "cao nhất", "lớn nhất", "tốn kém nhất", "chi nhiều nhất", "ít nhất", "nhỏ nhất",
-        # Time periods
-        "hôm nay", "hôm qua", "tuần này", "tuần trước",
-        "tháng này", "tháng trước", "năm nay", "năm ngoái",
-        "3 tháng", "quý này", "quý trước",
-        # Categories
-        "nước", "điện", "tiền điện", "tiền nước", "hóa đơn điện", "hóa đơn nước",
-        "ăn uống", "nhà hàng", "cà phê", "siêu thị", "chợ", "đi chợ",
-        "xăng", "nhiên liệu", "gửi xe", "mua sắm", "quần áo", "giày dép",
-        "giải trí", "xem phim", "du lịch", "khách sạn",
-        "y tế", "khám bệnh", "bệnh viện", "thuốc men", "bảo hiểm",
-        "học phí", "sách vở", "giáo dục",
-        "tiền nhà", "tiền thuê", "tiền phòng", "tiền trọ", "điện nước",
-        "internet", "mạng", "điện thoại", "truyền hình"
-    ]
-    has_finance_keyword = any(k in question_lower for k in finance_keywords)
+class QueryPlan(NamedTuple):
+    """
+    Kết quả phân tích một câu hỏi, không phụ thuộc dữ liệu giao dịch.
 
-    # Nếu câu hỏi KHÔNG liên quan tài chính → để main.py xử lý bằng LLM
-    if not has_finance_keyword:
-        return None, None
+    intent: 'invalid', 'greeting', 'chat' (không phải câu hỏi tài chính → LLM),
+            'advice' (câu hỏi tài chính mở → LLM kèm dữ liệu),
+            'highest', 'lowest', 'income', 'expense', 'compare', 'category', 'summary'
+    group: nhóm giao dịch cần lọc ('income', 'expense') hoặc None
+    categories: các cặp (từ khóa trong câu, danh mục) theo thứ tự ưu tiên
+    """
+    intent: str
+    group: Optional[str] = None
+    categories: Tuple[Tuple[str, str], ...] = ()
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    time_period: str = ""
+    time_period_display: str = ""
 
-    # Từ đây trở xuống: CHỈ xử lý bằng dữ liệu giao dịch (Supabase)
-    today = date.today()
+
+def _parse_period(hits, question_lower, today):
+    """Trả về (start_date, end_date, time_period, time_period_display)"""
     time_period = ""
     time_period_display = ""
     start_date = end_date = None
 
     # Time period detection
-    if "hôm nay" in question_lower:
+    if "hôm nay" in hits:
         start_date = today
         end_date = today
         time_period = f" ngày {today.strftime('%d/%m/%Y')}"
         time_period_display = f"ngày {today.strftime('%d/%m/%Y')}"
-    elif "hôm qua" in question_lower:
+    elif "hôm qua" in hits:
         start_date = today - timedelta(days=1)
         end_date = start_date
         time_period = f" ngày {start_date.strftime('%d/%m/%Y')}"
         time_period_display = f"ngày {start_date.strftime('%d/%m/%Y')}"
-    elif "tuần này" in question_lower:
+    elif "tuần này" in hits:
         start_date = today - timedelta(days=today.weekday())
         end_date = today
         time_period = f" tuần này (từ {start_date.strftime('%d/%m')} đến {end_date.strftime('%d/%m/%Y')})"
         time_period_display = "tuần này"
-    elif "tuần trước" in question_lower:
+    elif "tuần trước" in hits:
         end_date = today - timedelta(days=today.weekday() + 1)
         start_date = end_date - timedelta(days=6)
         time_period = f" tuần trước (từ {start_date.strftime('%d/%m/%Y')} đến {end_date.strftime('%d/%m/%Y')})"
         time_period_display = "tuần trước"
-    elif "tháng này" in question_lower or "tháng nay" in question_lower:
+    elif "tháng này" in hits or "tháng nay" in hits:
         start_date = today.replace(day=1)
         end_date = today
         time_period = f" tháng {today.month}/{today.year}"
         time_period_display = f"tháng {today.month}/{today.year}"
-    elif "tháng trước" in question_lower:
+    elif "tháng trước" in hits:
         first_day_current_month = today.replace(day=1)
         end_date = first_day_current_month - timedelta(days=1)
         start_date = end_date.replace(day=1)
         time_period = f" tháng {start_date.month}/{start_date.year}"
         time_period_display = f"tháng {start_date.month}/{start_date.year}"
-    elif "năm nay" in question_lower:
+    elif "năm nay" in hits:
         start_date = today.replace(month=1, day=1)
         end_date = today
         time_period = f" năm {today.year}"
         time_period_display = f"năm {today.year}"
-    elif "năm ngoái" in question_lower:
+    elif "năm ngoái" in hits:
         start_date = today.replace(year=today.year-1, month=1, day=1)
         end_date = today.replace(year=today.year-1, month=12, day=31)
         time_period = f" năm {today.year-1}"
         time_period_display = f"năm {today.year-1}"
-    elif "3 tháng" in question_lower or "ba tháng" in question_lower or "quý này" in question_lower:
+    elif "3 tháng" in hits or "ba tháng" in hits or "quý này" in hits:
         end_date = today
         start_date = today - timedelta(days=90)
         time_period = f" 3 tháng gần đây (từ {start_date.strftime('%d/%m/%Y')} đến {end_date.strftime('%d/%m/%Y')})"
         time_period_display = "3 tháng gần đây"
-    elif "quý trước" in question_lower:
+    elif "quý trước" in hits:
         current_quarter = (today.month - 1) // 3 + 1
         if current_quarter == 1:
             start_date = today.replace(year=today.year-1, month=10, day=1)
@@ -131,9 +259,8 @@ def handle_question(question, transactions):
         time_period_display = "quý trước"
 
     # Parse explicit month like "tháng 11" or "tháng 11/2025"
-    if "tháng " in question_lower and start_date is None and end_date is None:
-        import re
-        match = re.search(r"tháng\s+(\d{1,2})(?:/(\d{4}))?", question_lower)
+    if "tháng " in hits and start_date is None and end_date is None:
+        match = EXPLICIT_MONTH_RE.search(question_lower)
         if match:
             month = int(match.group(1))
             year = int(match.group(2)) if match.group(2) else today.year
@@ -148,261 +275,320 @@ def handle_question(question, transactions):
                 time_period = f" tháng {month}/{year}"
                 time_period_display = f"tháng {month}/{year}"
 
+    return start_date, end_date, time_period, time_period_display
+
+
+@lru_cache(maxsize=1024)
+def _parse_normalized(question_lower, today):
+    # Handle greetings first (chỉ khi cả câu là lời chào)
+    if question_lower in GREETING_PHRASES:
+        return QueryPlan("greeting")
+
+    # Mọi từ khóa (tài chính, thời gian, danh mục, ý định) tìm trong một lượt
+    hits = KEYWORD_MATCHER.find(question_lower)
+
+    # Nếu câu hỏi KHÔNG liên quan tài chính → để main.py xử lý bằng LLM
+    if hits.isdisjoint(FINANCE_KEYWORD_SET):
+        return QueryPlan("chat" if hits.isdisjoint(ADVICE_KEYWORDS) else "advice")
+
+    start_date, end_date, time_period, time_period_display = _parse_period(hits, question_lower, today)
+    period = dict(
+        start_date=start_date,
+        end_date=end_date,
+        time_period=time_period,
+        time_period_display=time_period_display,
+    )
+
     # Câu hỏi "nhiều nhất" / "lớn nhất" phải xử lý TRƯỚC khi trả thống kê chung
-    if any(x in question_lower for x in ["nhiều nhất", "cao nhất", "nhiều tiền nhất", "lớn nhất", "tốn kém nhất", "chi nhiều nhất"]):
-        is_expense = any(x in question_lower for x in ["chi tiêu", "expense", "chi phí", "đã chi", "chi ra"])
-        group = "expense" if is_expense else None
-
-        category, amount = find_highest_spending_category(
-            transactions,
-            group_name=group,
-            start_date=start_date,
-            end_date=end_date
-        )
-        if not category or amount <= 0:
-            return None, "Không đủ dữ liệu để trả lời."
-
-        amount_fmt = format_currency(amount)
-        period_text = f"{time_period_display} " if time_period_display else ""
-        if is_expense:
-            return amount, f"Bạn chi nhiều nhất cho {category} {period_text}là {amount_fmt}"
-        else:
-            return amount, f"Danh mục có số tiền lớn nhất {period_text}là {category} ({amount_fmt})"
-
-    # Câu hỏi "ít nhất" / "nhỏ nhất" cho chi tiêu
-    if any(x in question_lower for x in ["ít nhất", "nhỏ nhất"]):
-        # Mặc định hiểu là chi tiêu nếu không nói rõ
-        is_expense = any(x in question_lower for x in ["chi tiêu", "expense", "chi phí", "đã chi"]) or True
-        if is_expense:
-            stats = get_transaction_stats(
-                transactions,
-                group_name="expense",
-                start_date=start_date,
-                end_date=end_date
-            )
-            if not stats['by_category']:
-                return None, "Không đủ dữ liệu để trả lời."
-
-            # Tìm danh mục có chi tiêu nhỏ nhất > 0
-            min_cat = None
-            min_val = None
-            for cat, val in stats['by_category'].items():
-                if val <= 0:
-                    continue
-                if min_val is None or val < min_val:
-                    min_val = val
-                    min_cat = cat
-
-            if not min_cat or min_val is None:
-                return None, "Không đủ dữ liệu để trả lời."
-
-            amount_fmt = format_currency(min_val)
-            period_text = f"{time_period_display} " if time_period_display else ""
-            return min_val, f"Danh mục bạn chi ít nhất {period_text}là {min_cat} ({amount_fmt})"
-
-    # Thu nhập
-    if any(x in question_lower for x in ["thu nhập", "lương", "income", "tiền lương"]):
-        stats = get_transaction_stats(
-            transactions,
-            group_name="income",
-            start_date=start_date,
-            end_date=end_date
-        )
-        if stats['count'] == 0:
-            return None, "Không đủ dữ liệu để trả lời."
-        return stats['total'], format_stats(stats, time_period, "thu nhập")
-    
-    # Chi tiêu
-    if any(x in question_lower for x in ["chi tiêu", "expense", "chi phí", "đã chi", "đã tiêu"]):
-        stats = get_transaction_stats(
-            transactions,
-            group_name="expense",
-            start_date=start_date,
-            end_date=end_date
-        )
-        if stats['count'] == 0:
-            return None, "Không đủ dữ liệu để trả lời."
-        return stats['total'], format_stats(stats, time_period, "chi tiêu")
-    
-    # Map danh mục
-    category_mapping = {
-        # Tiện ích
-        'nước': 'water',
-        'tiền nước': 'water',
-        'hóa đơn nước': 'water',
-        'water bill': 'water',
-        'điện': 'electricity',
-        'tiền điện': 'electricity',
-        'hóa đơn điện': 'electricity',
-        'internet': 'internet',
-        'mạng': 'internet',
-        'điện thoại': 'phone',
-        'di động': 'phone',
-        'truyền hình': 'cable',
-        'truyền hình cáp': 'cable',
-        'tivi': 'cable',
-        
-        # Ăn uống
-        'ăn uống': 'food',
-        'thức ăn': 'food',
-        'đồ ăn': 'food',
-        'nhà hàng': 'restaurant',
-        'quán ăn': 'restaurant',
-        'cà phê': 'coffee',
-        'nước uống': 'beverage',
-        'đồ uống': 'beverage',
-        
-        # Mua sắm
-        'mua sắm': 'shopping',
-        'siêu thị': 'grocery',
-        'đi chợ': 'grocery',
-        'chợ': 'grocery',
-        'quần áo': 'clothing',
-        'thời trang': 'clothing',
-        'giày dép': 'footwear',
-        
-        # Nhà ở
-        'tiền nhà': 'rent',
-        'thuê nhà': 'rent',
-        'tiền thuê': 'rent',
-        'tiền phòng': 'rent',
-        'tiền trọ': 'rent',
-        
-        # Giao thông
-        'xăng': 'gas',
-        'dầu': 'gas',
-        'nhiên liệu': 'gas',
-        'đổ xăng': 'gas',
-        'gửi xe': 'parking',
-        'đậu xe': 'parking',
-        
-        # Giải trí
-        'giải trí': 'entertainment',
-        'xem phim': 'movies',
-        'phim ảnh': 'movies',
-        'game': 'gaming',
-        'trò chơi': 'gaming',
-        'thể thao': 'sports',
-        'gym': 'fitness',
-        'tập thể dục': 'fitness',
-        
-        # Y tế
-        'y tế': 'healthcare',
-        'khám bệnh': 'healthcare',
-        'bệnh viện': 'healthcare',
-        'thuốc men': 'medicine',
-        
-        # Giáo dục
-        'giáo dục': 'education',
-        'học phí': 'tuition',
-        'sách vở': 'books',
-        
-        # Khác
-        'quà tặng': 'gifts',
-        'tiệc tùng': 'party',
-        'sửa chữa': 'repairs',
-        'bảo hiểm': 'insurance'
-    }
+    if not hits.isdisjoint(HIGHEST_KEYWORDS):
+        is_expense = not hits.isdisjoint(HIGHEST_EXPENSE_KEYWORDS)
+        return QueryPlan("highest", group="expense" if is_expense else None, **period)
+
+    # Câu hỏi "ít nhất" / "nhỏ nhất": mặc định hiểu là chi tiêu
+    if not hits.isdisjoint(LOWEST_KEYWORDS):
+        return QueryPlan("lowest", group="expense", **period)
+
+    if not hits.isdisjoint(INCOME_KEYWORDS):
+        return QueryPlan("income", group="income", **period)
+
+    if not hits.isdisjoint(EXPENSE_KEYWORDS):
+        return QueryPlan("expense", group="expense", **period)
+
+    # Từ khóa danh mục có trong câu, theo thứ tự của CATEGORY_MAPPING,
+    # mỗi danh mục chỉ giữ từ khóa đầu tiên
+    matched_categories = []
+    for keyword in sorted(hits.intersection(CATEGORY_ORDER), key=CATEGORY_ORDER.get):
+        category = CATEGORY_MAPPING[keyword]
+        if category not in [c for _, c in matched_categories]:
+            matched_categories.append((keyword, category))
 
     # So sánh hai danh mục trong cùng một khoảng thời gian
     # Ví dụ: "so sánh tiền điện và tiền nước tháng 11"
-    if "so sánh" in question_lower or "so sanh" in question_lower:
-        matched_categories = []  # danh sách (keyword, mapped_category)
-        for keyword, category in category_mapping.items():
-            if keyword in question_lower:
-                if category not in [c for _, c in matched_categories]:
-                    matched_categories.append((keyword, category))
-            if len(matched_categories) >= 2:
-                break
-
-        if len(matched_categories) >= 2:
-            (kw1, cat1), (kw2, cat2) = matched_categories[0], matched_categories[1]
-
-            stats1 = get_transaction_stats(
-                transactions,
-                category_name=cat1,
-                start_date=start_date,
-                end_date=end_date
-            )
-            stats2 = get_transaction_stats(
-                transactions,
-                category_name=cat2,
-                start_date=start_date,
-                end_date=end_date
-            )
-
-            # Nếu cả hai đều không có giao dịch thì coi như không đủ dữ liệu
-            if stats1['count'] == 0 and stats2['count'] == 0:
-                return None, "Không đủ dữ liệu để trả lời."
-
-            total1 = stats1['total'] if stats1['count'] > 0 else 0
-            total2 = stats2['total'] if stats2['count'] > 0 else 0
-
-            # Nếu cả hai đều 0 thì cũng xem như không có dữ liệu ý nghĩa
-            if total1 == 0 and total2 == 0:
-                return None, "Không đủ dữ liệu để trả lời."
-
-            fmt1 = format_currency(total1)
-            fmt2 = format_currency(total2)
-            diff = abs(total1 - total2)
-            diff_fmt = format_currency(diff) if diff != 0 else None
-
-            period_text = f" {time_period_display}" if time_period_display else ""
-
-            if total1 > total2:
-                if diff_fmt:
-                    return diff, f"Bạn chi cho {kw1}{period_text} nhiều hơn {kw2} là {diff_fmt} ({fmt1} so với {fmt2})."
-                else:
-                    return total1, f"Bạn chi cho {kw1}{period_text} nhiều hơn {kw2}."
-            elif total2 > total1:
-                if diff_fmt:
-                    return diff, f"Bạn chi cho {kw2}{period_text} nhiều hơn {kw1} là {diff_fmt} ({fmt2} so với {fmt1})."
-                else:
-                    return total2, f"Bạn chi cho {kw2}{period_text} nhiều hơn {kw1}."
-            else:
-                # total1 == total2
-                return total1, f"Bạn chi cho {kw1} và {kw2}{period_text} bằng nhau ({fmt1})."
-
-    for keyword, category in category_mapping.items():
-        if keyword in question_lower:
-            stats = get_transaction_stats(
-                transactions,
-                category_name=category,
-                start_date=start_date,
-                end_date=end_date
-            )
-            if stats['count'] == 0:
-                return None, "Không đủ dữ liệu để trả lời."
-            return stats['total'], format_stats(stats, time_period, keyword)
-
-    # Câu hỏi "nhiều nhất"
-    if any(x in question_lower for x in ["nhiều nhất", "cao nhất", "nhiều tiền nhất"]):
-        is_expense = any(x in question_lower for x in ["chi tiêu", "expense", "chi phí", "đã chi"])
-        group = "expense" if is_expense else None
-        
-        category, amount = find_highest_spending_category(
-            transactions,
-            group_name=group,
-            start_date=start_date,
-            end_date=end_date
-        )
-        if not category or amount <= 0:
-            return None, "Không đủ dữ liệu để trả lời."
-
-        amount_fmt = format_currency(amount)
-        period_text = f"{time_period_display} " if time_period_display else ""
-        if is_expense:
-            return amount, f"Bạn chi nhiều nhất cho {category} {period_text}là {amount_fmt}"
-        else:
-            return amount, f"Danh mục có số tiền lớn nhất {period_text}là {category} ({amount_fmt})"
+    if not hits.isdisjoint(COMPARE_KEYWORDS) and len(matched_categories) >= 2:
+        return QueryPlan("compare", categories=tuple(matched_categories[:2]), **period)
+
+    if matched_categories:
+        return QueryPlan("category", categories=tuple(matched_categories[:1]), **period)
 
     # Thống kê chung nếu vẫn là câu hỏi tài chính
-    stats = get_transaction_stats(
-        transactions,
-        start_date=start_date,
-        end_date=end_date
-    )
+    return QueryPlan("summary", **period)
+
+
+def parse_question(question, today=None):
+    """
+    Phân tích câu hỏi thành QueryPlan (hàm thuần, không đụng tới dữ liệu giao dịch).
+    Kết quả được nhớ theo (câu hỏi đã chuẩn hóa, ngày hiện tại) nên câu hỏi lặp lại
+    không phải phân tích lại.
+    """
+    if not question or not isinstance(question, str):
+        return QueryPlan("invalid")
+    return _parse_normalized(question.lower().strip(), today or date.today())
+
+
+def plan_queries(plan):
+    """
+    Các truy vấn thống kê cần để trả lời một QueryPlan (rỗng nếu không cần dữ liệu).
+    Executor tương ứng nhận kết quả theo đúng thứ tự này.
+    """
+    if plan.intent == "highest":
+        return [StatsQuery('highest', plan.group, None, plan.start_date, plan.end_date)]
+    if plan.intent in ("lowest", "income", "expense"):
+        return [StatsQuery('stats', plan.group, None, plan.start_date, plan.end_date)]
+    if plan.intent in ("compare", "category"):
+        return [
+            StatsQuery('stats', None, category, plan.start_date, plan.end_date)
+            for _, category in plan.categories
+        ]
+    if plan.intent == "summary":
+        return [StatsQuery('stats', None, None, plan.start_date, plan.end_date)]
+    return []
+
+
+def _execute_highest(plan, results):
+    category, amount = results[0]
+    if not category or amount <= 0:
+        return None, "Không đủ dữ liệu để trả lời."
+
+    amount_fmt = format_currency(amount)
+    period_text = f"{plan.time_period_display} " if plan.time_period_display else ""
+    if plan.group == "expense":
+        return amount, f"Bạn chi nhiều nhất cho {category} {period_text}là {amount_fmt}"
+    else:
+        return amount, f"Danh mục có số tiền lớn nhất {period_text}là {category} ({amount_fmt})"
+
+
+def _execute_lowest(plan, results):
+    stats = results[0]
+    if not stats['by_category']:
+        return None, "Không đủ dữ liệu để trả lời."
+
+    # Tìm danh mục có chi tiêu nhỏ nhất > 0
+    min_cat = None
+    min_val = None
+    for cat, val in stats['by_category'].items():
+        if val <= 0:
+            continue
+        if min_val is None or val < min_val:
+            min_val = val
+            min_cat = cat
+
+    if not min_cat or min_val is None:
+        return None, "Không đủ dữ liệu để trả lời."
+
+    amount_fmt = format_currency(min_val)
+    period_text = f"{plan.time_period_display} " if plan.time_period_display else ""
+    return min_val, f"Danh mục bạn chi ít nhất {period_text}là {min_cat} ({amount_fmt})"
+
+
+def _execute_group(plan, results):
+    """Thu nhập / chi tiêu"""
+    stats = results[0]
     if stats['count'] == 0:
         return None, "Không đủ dữ liệu để trả lời."
+    label = "thu nhập" if plan.intent == "income" else "chi tiêu"
+    return stats['total'], format_stats(stats, plan.time_period, label)
+
+
+def _execute_compare(plan, results):
+    (kw1, _), (kw2, _) = plan.categories
+    stats1, stats2 = results
+
+    # Nếu cả hai đều không có giao dịch thì coi như không đủ dữ liệu
+    if stats1['count'] == 0 and stats2['count'] == 0:
+        return None, "Không đủ dữ liệu để trả lời."
+
+    total1 = stats1['total'] if stats1['count'] > 0 else 0
+    total2 = stats2['total'] if stats2['count'] > 0 else 0
+
+    # Nếu cả hai đều 0 thì cũng xem như không có dữ liệu ý nghĩa
+    if total1 == 0 and total2 == 0:
+        return None, "Không đủ dữ liệu để trả lời."
+
+    fmt1 = format_currency(total1)
+    fmt2 = format_currency(total2)
+    diff = abs(total1 - total2)
+    diff_fmt = format_currency(diff) if diff != 0 else None
+
+    period_text = f" {plan.time_period_display}" if plan.time_period_display else ""
+
+    if total1 > total2:
+        if diff_fmt:
+            return diff, f"Bạn chi cho {kw1}{period_text} nhiều hơn {kw2} là {diff_fmt} ({fmt1} so với {fmt2})."
+        else:
+            return total1, f"Bạn chi cho {kw1}{period_text} nhiều hơn {kw2}."
+    elif total2 > total1:
+        if diff_fmt:
+            return diff, f"Bạn chi cho {kw2}{period_text} nhiều hơn {kw1} là {diff_fmt} ({fmt2} so với {fmt1})."
+        else:
+            return total2, f"Bạn chi cho {kw2}{period_text} nhiều hơn {kw1}."
+    else:
+        # total1 == total2
+        return total1, f"Bạn chi cho {kw1} và {kw2}{period_text} bằng nhau ({fmt1})."
+
+
+def _execute_category(plan, results):
+    keyword = plan.categories[0][0]
+    stats = results[0]
+    if stats['count'] == 0:
+        return None, "Không đủ dữ liệu để trả lời."
+    return stats['total'], format_stats(stats, plan.time_period, keyword)
+
+
+def _execute_summary(plan, results):
+    stats = results[0]
+    if stats['count'] == 0:
+        return None, "Không đủ dữ liệu để trả lời."
+
+    return stats['total'], format_stats(stats, plan.time_period)
+
+
+_EXECUTORS = {
+    "highest": _execute_highest,
+    "lowest": _execute_lowest,
+    "income": _execute_group,
+    "expense": _execute_group,
+    "compare": _execute_compare,
+    "category": _execute_category,
+    "summary": _execute_summary,
+}
+
+
+# Cache câu trả lời theo (QueryPlan, phiên bản dữ liệu). Khi dữ liệu được tải lại
+# hoặc đồng bộ thêm, TransactionFrame.version đổi nên các mục cũ không còn được dùng.
+ANSWER_CACHE_SIZE = 256
+_answer_cache = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+
+def clear_answer_cache():
+    with _answer_cache_lock:
+        _answer_cache.clear()
+
+
+def needs_transactions(plan):
+    """True nếu plan phải trả lời bằng dữ liệu giao dịch (không phải chào hỏi / hỏi LLM)"""
+    return plan.intent in _EXECUTORS
+
+
+def wants_finance_context(plan):
+    """True nếu câu hỏi cho LLM nên kèm bản tóm tắt giao dịch (câu hỏi tài chính mở)"""
+    return plan.intent == "advice"
+
+
+def _cache_get(key):
+    with _answer_cache_lock:
+        answer = _answer_cache.get(key)
+        if answer is not None:
+            _answer_cache.move_to_end(key)
+        return answer
+
+
+def _cache_put(key, answer):
+    with _answer_cache_lock:
+        _answer_cache[key] = answer
+        while len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+
+def _cacheable(plan, transactions):
+    return isinstance(transactions, TransactionFrame) and plan.intent in _EXECUTORS
+
+
+def execute_plan(plan, transactions):
+    """
+    Trả lời một QueryPlan bằng dữ liệu giao dịch. Returns: (result, message)
+
+    Nếu transactions là TransactionFrame, câu trả lời được nhớ theo
+    (plan, transactions.version) nên câu hỏi lặp lại chỉ tốn một lần tra dict.
+    """
+    return execute_plans([plan], transactions)[0]
+
+
+def execute_plans(plans, transactions):
+    """
+    Trả lời nhiều QueryPlan cùng lúc. Truy vấn thống kê của mọi plan chưa có
+    trong cache được gộp lại (bỏ trùng) và tính trong MỘT lượt duyệt dữ liệu
+    (data_processor.run_queries), mỗi truy vấn có bộ cộng dồn riêng.
+    Kết quả giống hệt gọi execute_plan cho từng plan.
+    """
+    answers = [None] * len(plans)
+    pending = []
+    for i, plan in enumerate(plans):
+        logger.debug("Plan: %s", plan)
+        if plan.intent not in _EXECUTORS:
+            answers[i] = _execute_simple(plan)
+            continue
+        if _cacheable(plan, transactions):
+            answers[i] = _cache_get((plan, transactions.version))
+        if answers[i] is None:
+            pending.append(i)
+
+    if not pending:
+        return answers
+
+    # Từ đây trở xuống: CHỈ xử lý bằng dữ liệu giao dịch (Supabase).
+    # run_queries dựng bảng cột một lần cho cả lô câu hỏi (không tốn gì nếu đã là
+    # TransactionFrame), hoặc gom tổng trên database nếu là RemoteTransactions
+    queries = {}
+    for i in pending:
+        for query in plan_queries(plans[i]):
+            queries.setdefault(query, len(queries))
+    logger.debug("%d/%d plan cần tính, %d truy vấn thống kê", len(pending), len(plans), len(queries))
+    results = run_queries(transactions, list(queries))
+
+    with span("format"):
+        for i in pending:
+            plan = plans[i]
+            plan_results = [results[queries[q]] for q in plan_queries(plan)]
+            answers[i] = _EXECUTORS[plan.intent](plan, plan_results)
+            if _cacheable(plan, transactions):
+                _cache_put((plan, transactions.version), answers[i])
+    return answers
+
+
+def _execute_simple(plan):
+    """Các plan không cần dữ liệu giao dịch"""
+    if plan.intent == "invalid":
+        return None, "Vui lòng nhập câu hỏi hợp lệ"
+    if plan.intent == "greeting":
+        return None, random.choice(GREETING_RESPONSES)
+    return None, None
+
+
+def handle_question(question, transactions):
+    with span("parse"):
+        plan = parse_question(question)
+    return execute_plan(plan, transactions)
+
+
+def handle_questions(questions, transactions):
+    """
+    Trả lời một lô câu hỏi trên cùng dữ liệu (dashboard, báo cáo định kỳ).
+    Dữ liệu chỉ được duyệt một lần cho cả lô thay vì một lần mỗi câu hỏi.
 
-    return stats['total'], format_stats(stats, time_period)
\ No newline at end of file
+    Returns: danh sách (result, message) theo thứ tự questions, giống hệt
+    [handle_question(q, transactions) for q in questions]
+    """
+    with span("parse"):
+        plans = [parse_question(q) for q in questions]
+    return execute_plans(plans, transactions)
@@ -0,0 +1,106 @@
+import sys
+from datetime import date
+
+
+def _month_bounds(month):
+    """Ordinal ngày đầu và ngày cuối của mã tháng (year * 12 + month - 1)"""
+    year, m = divmod(month, 12)
+    first = date(year, m + 1, 1).toordinal()
+    if m == 11:
+        last = date(year + 1, 1, 1).toordinal() - 1
+    else:
+        last = date(year, m + 2, 1).toordinal() - 1
+    return first, last
+
+
+class RollupCube:
+    """
+    Tổng số tiền gom sẵn theo (tháng, nhóm, danh mục), dựng một lần khi tải giao dịch.
+
+    - months: {mã tháng: {(mã nhóm, mã danh mục): [tổng, số giao dịch]}}
+    - days: cùng cấu trúc nhưng theo ordinal ngày, dùng cho các tháng chỉ
+      nằm một phần trong khoảng cần tính ("hôm nay", "tuần này", ...)
+    - undated: các giao dịch không có ngày (luôn được tính, giống logic cũ)
+
+    Khoảng ngày phủ trọn tháng được trả lời thẳng từ months, chỉ các tháng
+    ở biên mới phải cộng dồn từ days.
+    """
+
+    def __init__(self):
+        self.months = {}
+        self.days = {}
+        self.undated = {}
+
+    def add(self, ordinal, month, group_code, category_code, amount):
+        """Cộng một giao dịch vào các ô tương ứng"""
+        key = (group_code, category_code)
+        if ordinal:
+            buckets = (
+                self.months.setdefault(month, {}),
+                self.days.setdefault(ordinal, {}),
+            )
+        else:
+            buckets = (self.undated,)
+        for bucket in buckets:
+            cell = bucket.get(key)
+            if cell is None:
+                bucket[key] = [amount, 1]
+            else:
+                cell[0] += amount
+                cell[1] += 1
+
+    def memory_usage(self):
+        """Ước lượng số byte bộ nhớ của các ô"""
+        # Mỗi ô: khóa (mã nhóm, mã danh mục) + list [tổng, số giao dịch] + chỗ trong dict
+        cell_size = sys.getsizeof((0, 0)) + sys.getsizeof([0.0, 0]) + 2 * 8
+        size = 0
+        for buckets in (self.months.values(), self.days.values(), (self.undated,)):
+            for cells in buckets:
+                size += sys.getsizeof(cells) + len(cells) * cell_size
+        return size
+
+    def _cells(self, lo, hi):
+        """Sinh (mã tháng hoặc -1, ô) cho mọi ô nằm trong khoảng [lo, hi]"""
+        for month, cells in self.months.items():
+            first, last = _month_bounds(month)
+            if (lo and last < lo) or (hi and first > hi):
+                continue
+            if (not lo or lo <= first) and (not hi or last <= hi):
+                # Cả tháng nằm trong khoảng: dùng ô đã gom sẵn
+                yield month, cells
+                continue
+            # Tháng ở biên: chỉ cộng các ngày nằm trong khoảng
+            for day in range(max(first, lo or first), min(last, hi or last) + 1):
+                day_cells = self.days.get(day)
+                if day_cells:
+                    yield month, day_cells
+        if self.undated:
+            yield -1, self.undated
+
+    def aggregate_many(self, specs):
+        """
+        Cùng giao diện và kết quả với các engine trong data_processor: mỗi bộ lọc
+        (mã nhóm, tập mã danh mục, lo, hi) cho (total, count, {mã danh mục: số tiền},
+        {mã tháng: số tiền}); các bộ lọc cùng khoảng ngày chỉ duyệt các ô một lần.
+        """
+        results = [[0.0, 0, {}, {}] for _ in specs]
+        by_range = {}
+        for spec, acc in zip(specs, results):
+            by_range.setdefault(spec[2:], []).append((spec[0], spec[1], acc))
+
+        for (lo, hi), filters in by_range.items():
+            for month, cells in self._cells(lo, hi):
+                for (gcode, ccode), (amount, n) in cells.items():
+                    for group, categories, acc in filters:
+                        if group is not None and gcode != group:
+                            continue
+                        if categories is not None and ccode not in categories:
+                            continue
+                        acc[0] += amount
+                        acc[1] += n
+                        by_code = acc[2]
+                        by_code[ccode] = by_code.get(ccode, 0) + amount
+                        if month >= 0:
+                            by_month = acc[3]
+                            by_month[month] = by_month.get(month, 0) + amount
+        return [tuple(acc) for acc in results]
@@ -0,0 +1,259 @@
+# Chế độ server HTTP cho nhiều người dùng cùng lúc (Flask).
+#
+#   python server.py --port 5000
+#   (hoặc chạy bằng WSGI server: gunicorn --threads 16 server:app)
+#
+#   POST /login      {"email": "..."} + header X-Api-Key    -> {"session", "user", "wallets"}
+#   POST /ask        {"session", "question", "stream"?, "priority"?}
+#                                                           -> {"result", "message"} hoặc text stream từ LLM
+#   POST /ask_batch  {"session", "questions": [...]}       -> {"answers": [{"result", "message"}, ...]}
+#   POST /refresh    {"session"}                            -> đọc lại danh sách ví, tải lại giao dịch
+#   POST /logout     {"session"}
+#   GET  /health                                           -> số liệu cache / session / LLM
+#
+# Dữ liệu giao dịch của mỗi người dùng được giữ trong DatasetCache (LRU theo bộ nhớ)
+# nên các request sau khi đăng nhập không phải tải lại. Mọi request dùng chung một
+# Supabase client (và pool kết nối HTTP của nó) cùng một OllamaClient; số lời gọi
+# model chạy cùng lúc do llm_scheduler giới hạn ("priority": "batch" xếp sau các
+# câu hỏi tương tác).
+#
+# /login chỉ kiểm tra email, nên phải có SERVER_API_KEY (gửi kèm header X-Api-Key);
+# không đặt SERVER_API_KEY thì server chỉ nhận đăng nhập từ localhost và từ chối
+# chạy với --host khác địa chỉ loopback.
+#
+# STATS_PUSHDOWN=1: câu hỏi thống kê được gom tổng ngay trên database (hàm RPC
+# transaction_stats), server không tải và giữ giao dịch của người dùng.
+import argparse
+import ipaddress
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from dataset_cache import DatasetCache
+from llm_scheduler import BATCH, INTERACTIVE, get_scheduler
+from log_utils import configure_logging, get_logger
+from ollama_client import ask_ollama, get_response_cache
+from query_handler import execute_plan, execute_plans, needs_transactions, parse_question
+from supabase_client import STATS_PUSHDOWN, RemoteTransactions, cache_stats, get_user_with_wallets, invalidate_cache
+
+logger = get_logger(__name__)
+
+# Khóa dùng chung để đăng nhập, không đặt thì chỉ cho phép localhost
+SERVER_API_KEY = os.getenv("SERVER_API_KEY", "")
+# Thời gian sống của một phiên đăng nhập không hoạt động (giây)
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+# Thời gian chờ tối đa để tải dữ liệu của một người dùng (giây)
+DATASET_TIMEOUT = float(os.getenv("DATASET_TIMEOUT", "120"))
+# Thời gian chờ đến lượt gọi LLM tối đa (giây), quá hạn thì trả lời "đang bận"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+app = Flask(__name__)
+datasets = DatasetCache()
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _create_session(email, user, wallets):
+    token = secrets.token_urlsafe(24)
+    with _sessions_lock:
+        _sessions[token] = {
+            "email": email,
+            "user_id": user["id"],
+            "wallet_ids": [w["id"] for w in wallets],
+            "last_seen": time.monotonic(),
+        }
+    return token
+
+
+def _get_session(token):
+    now = time.monotonic()
+    with _sessions_lock:
+        # Bỏ các phiên đã hết hạn
+        for key in [k for k, s in _sessions.items() if now - s["last_seen"] > SESSION_TTL]:
+            del _sessions[key]
+        session = _sessions.get(token) if token else None
+        if session is not None:
+            session["last_seen"] = now
+        return session
+
+
+def _session_from_request():
+    body = request.get_json(silent=True) or {}
+    token = request.headers.get("X-Session") or body.get("session")
+    return body, _get_session(token)
+
+
+def _error(message, status):
+    return jsonify({"error": message}), status
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def _login_allowed():
+    """Có SERVER_API_KEY thì phải gửi đúng khóa, không có thì chỉ nhận request từ localhost"""
+    if SERVER_API_KEY:
+        return secrets.compare_digest(request.headers.get("X-Api-Key", ""), SERVER_API_KEY)
+    return _is_loopback(request.remote_addr or "")
+
+
+@app.post("/login")
+def login():
+    if not _login_allowed():
+        return _error("Không có quyền đăng nhập", 403)
+    body = request.get_json(silent=True) or {}
+    email = (body.get("email") or "").strip()
+    if not email:
+        return _error("Thiếu email", 400)
+
+    user, wallets = get_user_with_wallets(email)
+    if not user:
+        return _error("Không tìm thấy người dùng", 404)
+
+    token = _create_session(email, user, wallets)
+    if wallets and not STATS_PUSHDOWN:
+        # Bắt đầu tải giao dịch ngay, câu hỏi đầu tiên chỉ chờ nếu chưa xong
+        datasets.prefetch(user["id"], [w["id"] for w in wallets])
+    return jsonify({
+        "session": token,
+        "user": {"id": user["id"], "full_name": user.get("full_name")},
+        "wallets": [
+            {"id": w["id"], "name": w.get("name"), "balance": w.get("balance")}
+            for w in wallets
+        ],
+    })
+
+
+@app.post("/logout")
+def logout():
+    body = request.get_json(silent=True) or {}
+    token = request.headers.get("X-Session") or body.get("session")
+    with _sessions_lock:
+        session = _sessions.pop(token, None)
+    if session is not None:
+        invalidate_cache(email=session["email"], user_id=session["user_id"], wallet_ids=session["wallet_ids"])
+    return jsonify({"ok": True})
+
+
+@app.post("/refresh")
+def refresh():
+    _, session = _session_from_request()
+    if session is None:
+        return _error("Phiên đăng nhập không hợp lệ hoặc đã hết hạn", 401)
+    # Đọc lại user / ví từ database (có thể vừa thêm ví) và đồng bộ lại giao dịch
+    invalidate_cache(email=session["email"], user_id=session["user_id"], wallet_ids=session["wallet_ids"])
+    user, wallets = get_user_with_wallets(session["email"])
+    if not user:
+        return _error("Không tìm thấy người dùng", 404)
+    wallet_ids = [w["id"] for w in wallets]
+    with _sessions_lock:
+        session["wallet_ids"] = wallet_ids
+    datasets.invalidate(session["user_id"])
+    if wallet_ids and not STATS_PUSHDOWN:
+        datasets.prefetch(session["user_id"], wallet_ids)
+    return jsonify({"ok": True, "wallets": len(wallet_ids)})
+
+
+def _transactions_for(session):
+    if not session["wallet_ids"]:
+        return []
+    if STATS_PUSHDOWN:
+        return RemoteTransactions(session["wallet_ids"])
+    return datasets.get(session["user_id"], session["wallet_ids"], timeout=DATASET_TIMEOUT)
+
+
+def _answer_json(answer):
+    result, message = answer
+    return {"result": result, "message": message}
+
+
+@app.post("/ask")
+def ask():
+    body, session = _session_from_request()
+    if session is None:
+        return _error("Phiên đăng nhập không hợp lệ hoặc đã hết hạn", 401)
+    question = (body.get("question") or "").strip()
+
+    plan = parse_question(question)
+    transactions = _transactions_for(session) if needs_transactions(plan) else None
+    answer = execute_plan(plan, transactions)
+    if answer != (None, None):
+        return jsonify(_answer_json(answer))
+
+    # Không phải câu hỏi tài chính: hỏi LLM
+    priority = BATCH if body.get("priority") == "batch" else INTERACTIVE
+    if body.get("stream"):
+        return Response(ask_ollama(question, stream=True, hide_thinking=True,
+                                   priority=priority, timeout=LLM_TIMEOUT),
+                        mimetype="text/plain; charset=utf-8")
+    # Gọi ngay trên thread của request: llm_scheduler giới hạn hàng đợi và thời gian chờ
+    answer = ask_ollama(question, hide_thinking=True, priority=priority, timeout=LLM_TIMEOUT)
+    return jsonify({"result": None, "message": answer})
+
+
+@app.post("/ask_batch")
+def ask_batch():
+    body, session = _session_from_request()
+    if session is None:
+        return _error("Phiên đăng nhập không hợp lệ hoặc đã hết hạn", 401)
+    questions = body.get("questions")
+    if not isinstance(questions, list):
+        return _error("questions phải là danh sách câu hỏi", 400)
+
+    plans = [parse_question(q if isinstance(q, str) else "") for q in questions]
+    transactions = _transactions_for(session) if any(map(needs_transactions, plans)) else None
+    answers = execute_plans(plans, transactions)
+    return jsonify({"answers": [_answer_json(a) for a in answers]})
+
+
+@app.get("/health")
+def health():
+    with _sessions_lock:
+        sessions = len(_sessions)
+    return jsonify({
+        "sessions": sessions,
+        "datasets": datasets.stats(),
+        "supabase": cache_stats(),
+        "llm": get_scheduler().stats(),
+        "llm_cache": get_response_cache().stats(),
+    })
+
+
+@app.errorhandler(FutureTimeoutError)
+def handle_dataset_timeout(e):
+    # Dữ liệu vẫn đang tải nền (DatasetCache giữ lần tải), client thử lại sau
+    return _error("Đang tải dữ liệu, vui lòng thử lại sau", 503)
+
+
+@app.errorhandler(Exception)
+def handle_exception(e):
+    if isinstance(e, HTTPException):
+        return e
+    logger.exception("Lỗi khi xử lý request %s", request.path)
+    return _error("Có lỗi xảy ra, vui lòng thử lại", 500)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Server HTTP trợ lý quản lý tài chính")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "5000")))
+    args = parser.parse_args(argv)
+    if not SERVER_API_KEY and not _is_loopback(args.host):
+        parser.error("Cần đặt SERVER_API_KEY để chạy server trên địa chỉ khác localhost")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_logging()
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi giống nhau đang chạy đồng thời: lời gọi đầu tiên với một khóa
+    thực sự chạy, các lời gọi trùng khóa đến trong lúc đó chờ và dùng chung kết quả
+    (hoặc lỗi) của nó.
+
+    Kết quả thỏa cache_if được giữ thêm ttl giây; invalidate() bỏ kết quả đã giữ
+    và đảm bảo lời gọi đang chạy dở không ghi đè kết quả cũ vào cache.
+    """
+
+    def __init__(self, ttl=0.0, max_entries=1024, cache_if=bool, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache_if = cache_if
+        self.clock = clock
+        self.calls = 0
+        self.shared = 0
+        self.hits = 0
+        self._inflight = {}
+        self._results = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if self.clock() - cached[1] <= self.ttl:
+                    self.hits += 1
+                    return cached[0]
+                del self._results[key]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                generation = self._generation
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if self.ttl > 0 and generation == self._generation and self.cache_if(value):
+                self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value):
+        now = self.clock()
+        self._results[key] = (value, now)
+        if len(self._results) > self.max_entries:
+            for k in [k for k, (_, t) in self._results.items() if now - t > self.ttl]:
+                del self._results[k]
+            while len(self._results) > self.max_entries:
+                del self._results[next(iter(self._results))]
+
+    def invalidate(self, match=None):
+        """
+        Bỏ kết quả đã cache. match: None = tất cả, hoặc hàm nhận khóa trả về True
+        với các khóa cần bỏ.
+        """
+        with self._lock:
+            self._generation += 1
+            if match is None:
+                self._results.clear()
+            else:
+                for key in [k for k in self._results if match(k)]:
+                    del self._results[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared": self.shared,
+                "hits": self.hits,
+                "cached": len(self._results),
+                "inflight": len(self._inflight),
+            }
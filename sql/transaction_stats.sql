@@ -0,0 +1,34 @@
+-- Hàm RPC cho supabase_client.get_transaction_stats_remote
+-- Gom tổng theo (tháng, danh mục) ngay trên database thay vì tải toàn bộ giao dịch về.
+-- Chạy một lần trong Supabase SQL editor.
+-- Tên danh mục được so khớp chuỗi con theo nghĩa đen: %, _ và \ trong p_category_name
+-- được thoát trước khi đưa vào LIKE (giống data_processor khi lọc bằng Python).
+-- Lưu ý: wallet_id được so sánh dưới dạng text để dùng được cho cả id kiểu uuid lẫn int.
+
+create or replace function transaction_stats(
+    p_wallet_ids text[],
+    p_group_name text default null,
+    p_category_name text default null,
+    p_start_date date default null,
+    p_end_date date default null
+)
+returns table (month text, category text, total numeric, count bigint)
+language sql
+stable
+as $$
+    select
+        substr(cast(t.date as text), 1, 7) as month,
+        lower(trim(c.categoryname)) as category,
+        sum(t.amount) as total,
+        count(*) as count
+    from transactions t
+    join categories c on c.id = t.category_id
+    join groups g on g.id = c.group_id
+    where t.wallet_id::text = any(p_wallet_ids)
+      and (p_group_name is null or lower(trim(g.group_name)) = lower(trim(p_group_name)))
+      and (p_category_name is null or lower(trim(c.categoryname)) like '%' || replace(replace(replace(
+          lower(trim(p_category_name)), '\', '\\'), '%', '\%'), '_', '\_') || '%' escape '\')
+      and (t.date is null or p_start_date is null or t.date >= p_start_date)
+      and (t.date is null or p_end_date is null or t.date <= p_end_date)
+    group by 1, 2
+$$;
@@ -0,0 +1,87 @@
+# Câu SQL gom tổng giao dịch theo (tháng, danh mục), cùng logic với hàm RPC
+# sql/transaction_stats.sql trên Supabase.
+# Dùng cho database cục bộ qua DB-API (sqlite3, psycopg2, ...) để chạy thử
+# mà không cần Supabase. Kết quả có cùng dạng với get_transaction_stats.
+import re
+from datetime import date, datetime
+
+from data_processor import stats_from_aggregate_rows
+
+STATS_QUERY = """
+SELECT
+    substr(CAST(t.date AS TEXT), 1, 7) AS month,
+    lower(trim(c.categoryname)) AS category,
+    SUM(t.amount) AS total,
+    COUNT(*) AS count
+FROM transactions t
+JOIN categories c ON c.id = t.category_id
+JOIN groups g ON g.id = c.group_id
+WHERE t.wallet_id IN ({wallet_placeholders})
+  AND (:group_name IS NULL OR lower(trim(g.group_name)) = :group_name)
+  AND (:category_name IS NULL OR lower(trim(c.categoryname)) LIKE '%' || :category_name || '%' ESCAPE '\\')
+  AND (t.date IS NULL OR :start_date IS NULL OR t.date >= :start_date)
+  AND (t.date IS NULL OR :end_date IS NULL OR t.date <= :end_date)
+GROUP BY 1, 2
+"""
+
+
+def escape_like(text):
+    """Thoát các ký tự đại diện của LIKE (%, _ và chính ký tự thoát \\) để so khớp chuỗi con đúng nghĩa đen"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _date_param(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def build_stats_query(wallet_ids, group_name=None, category_name=None, start_date=None, end_date=None,
+                      paramstyle="named"):
+    """
+    Tạo (sql, params) cho DB-API.
+
+    Args:
+        paramstyle: 'named' (sqlite3, dạng :name) hoặc 'pyformat' (psycopg2, dạng %(name)s)
+
+    Returns:
+        Tuple (câu SQL, dict tham số)
+    """
+    params = {
+        "group_name": group_name.strip().lower() if group_name else None,
+        "category_name": escape_like(category_name.strip().lower()) if category_name else None,
+        "start_date": _date_param(start_date),
+        "end_date": _date_param(end_date),
+    }
+    placeholders = []
+    for i, wallet_id in enumerate(wallet_ids):
+        params[f"wallet_{i}"] = wallet_id
+        placeholders.append(f":wallet_{i}")
+    sql = STATS_QUERY.format(wallet_placeholders=", ".join(placeholders))
+
+    if paramstyle == "pyformat":
+        sql = sql.replace("%", "%%")
+        sql = re.sub(r":(\w+)", r"%(\1)s", sql)
+    elif paramstyle != "named":
+        raise ValueError(f"Không hỗ trợ paramstyle: {paramstyle}")
+    return sql, params
+
+
+def query_transaction_stats(conn, wallet_ids, group_name=None, category_name=None, start_date=None,
+                            end_date=None, paramstyle="named"):
+    """
+    Chạy câu SQL gom tổng trên một kết nối DB-API.
+
+    Returns:
+        Dict thống kê giống get_transaction_stats
+    """
+    if not wallet_ids:
+        return stats_from_aggregate_rows([])
+    sql, params = build_stats_query(wallet_ids, group_name, category_name, start_date, end_date, paramstyle)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    return stats_from_aggregate_rows(rows)
@@ -1,11 +1,17 @@
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable
 from supabase import create_client
 from dotenv import load_dotenv
+from data_processor import stats_from_aggregate_rows
+from log_utils import get_logger
+from profiling import span
+from single_flight import SingleFlight
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
 # Initialize Supabase client
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -15,9 +21,55 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Giữ kết quả user / ví / giao dịch trong vài giây: các request trùng nhau đến cùng lúc
+# (nhiều tab, nhiều widget dashboard) chỉ gọi database một lần
+SUPABASE_CACHE_TTL = float(os.getenv("SUPABASE_CACHE_TTL", "30"))
+
+def _worth_caching(value: Any) -> bool:
+    """Chỉ giữ kết quả có dữ liệu (None / danh sách rỗng có thể do lỗi tạm thời)"""
+    if isinstance(value, tuple):
+        return all(value)
+    return bool(value)
+
+# Bật thì câu hỏi thống kê được gom tổng trên database (hàm RPC transaction_stats,
+# xem RemoteTransactions) thay vì tải toàn bộ giao dịch về máy
+STATS_PUSHDOWN = os.getenv("STATS_PUSHDOWN", "0") == "1"
+
+_flights = SingleFlight(ttl=SUPABASE_CACHE_TTL, cache_if=_worth_caching)
+# Các lần đồng bộ đồng thời vào cùng một bản sao dùng chung một lần tải;
+# không giữ kết quả vì lần đồng bộ sau phải hỏi lại database
+_syncs = SingleFlight()
+
+def _wallet_key(wallet_ids: List[str]) -> Tuple[str, ...]:
+    return tuple(sorted(str(w) for w in wallet_ids))
+
+def invalidate_cache(email: Optional[str] = None, user_id: Optional[str] = None,
+                     wallet_ids: Optional[List[str]] = None) -> None:
+    """
+    Bỏ user / ví / giao dịch đã cache để lần gọi sau đọc lại từ database (ví dụ sau
+    khi người dùng thêm ví). Không truyền tham số nào thì bỏ toàn bộ.
+    """
+    if email is None and user_id is None and wallet_ids is None:
+        _flights.invalidate()
+        return
+    targets = set()
+    if email is not None:
+        targets.update({("user", email), ("user_wallets", email)})
+    if user_id is not None:
+        targets.add(("wallets", str(user_id)))
+    if wallet_ids is not None:
+        targets.add(("transactions", _wallet_key(wallet_ids)))
+    _flights.invalidate(lambda key: key in targets)
+
+def cache_stats() -> Dict[str, Any]:
+    """Số lần gọi database thật / dùng chung lời gọi đang chạy / lấy từ cache"""
+    stats = _flights.stats()
+    stats["syncs"] = _syncs.stats()
+    return stats
+
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     """
-    Lấy thông tin người dùng bằng email
+    Lấy thông tin người dùng bằng email (các lời gọi trùng nhau dùng chung một truy vấn)
     
     Args:
         email: Email của người dùng
@@ -25,20 +77,25 @@ def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     Returns:
         Thông tin người dùng hoặc None nếu không tìm thấy
     """
+    user = _flights.do(("user", email), _fetch_user_by_email, email)
+    return dict(user) if user else user
+
+def _fetch_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     try:
-        res = supabase.table("users").select("*").eq("username", email).execute()
+        with span("supabase.user"):
+            res = supabase.table("users").select("*").eq("username", email).execute()
         if res.data:
-            print(f"[DEBUG] Tìm thấy user: {res.data[0]['id']}")
+            logger.debug("Tìm thấy user: %s", res.data[0]['id'])
             return res.data[0]
-        print(f"[DEBUG] Không tìm thấy user với email: {email}")
+        logger.debug("Không tìm thấy user với email: %s", email)
         return None
     except Exception as e:
-        print(f"[ERROR] Lỗi khi lấy thông tin user: {str(e)}")
+        logger.error("Lỗi khi lấy thông tin user: %s", e)
         return None
 
 def get_wallets_by_user_id(user_id: str) -> List[Dict[str, Any]]:
     """
-    Lấy danh sách ví của người dùng
+    Lấy danh sách ví của người dùng (các lời gọi trùng nhau dùng chung một truy vấn)
     
     Args:
         user_id: ID của người dùng
@@ -46,82 +103,306 @@ def get_wallets_by_user_id(user_id: str) -> List[Dict[str, Any]]:
     Returns:
         Danh sách các ví của người dùng
     """
+    return list(_flights.do(("wallets", str(user_id)), _fetch_wallets_by_user_id, user_id))
+
+def _fetch_wallets_by_user_id(user_id: str) -> List[Dict[str, Any]]:
     try:
-        res = supabase.table("wallets").select("*").eq("user_id", user_id).execute()
+        with span("supabase.wallets"):
+            res = supabase.table("wallets").select("*").eq("user_id", user_id).execute()
         wallets = res.data if res.data else []
-        print(f"[DEBUG] Số lượng ví tìm thấy: {len(wallets)}")
+        logger.debug("Số lượng ví tìm thấy: %d", len(wallets))
         for wallet in wallets:
-            print(f"  - Ví {wallet['id']}: {wallet.get('name', 'Không có tên')}")
+            logger.debug("  - Ví %s: %s", wallet['id'], wallet.get('name', 'Không có tên'))
         return wallets
     except Exception as e:
-        print(f"[ERROR] Lỗi khi lấy danh sách ví: {str(e)}")
+        logger.error("Lỗi khi lấy danh sách ví: %s", e)
         return []
 
+def get_user_with_wallets(email: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Lấy người dùng và danh sách ví trong MỘT lần gọi (PostgREST nhúng bảng wallets
+    qua khóa ngoại wallets.user_id). Nếu database không hỗ trợ nhúng thì quay về
+    gọi get_user_by_email rồi get_wallets_by_user_id.
+
+    Returns:
+        (thông tin người dùng hoặc None, danh sách ví)
+    """
+    user, wallets = _flights.do(("user_wallets", email), _fetch_user_with_wallets, email)
+    return (dict(user) if user else user), list(wallets)
+
+def _fetch_user_with_wallets(email: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    try:
+        with span("supabase.user_wallets"):
+            res = supabase.table("users").select("*, wallets(*)").eq("username", email).execute()
+    except Exception as e:
+        logger.debug("Không lấy gộp được users + wallets (%s), gọi riêng từng bảng", e)
+        user = get_user_by_email(email)
+        return user, get_wallets_by_user_id(user["id"]) if user else []
+
+    if not res.data:
+        logger.debug("Không tìm thấy user với email: %s", email)
+        return None, []
+    user = dict(res.data[0])
+    wallets = user.pop("wallets", None)
+    if wallets is None:
+        # Phản hồi không kèm bảng nhúng: lấy ví bằng một lần gọi riêng
+        return user, get_wallets_by_user_id(user["id"])
+    logger.debug("Tìm thấy user: %s, số lượng ví: %d", user.get("id"), len(wallets))
+    return user, wallets
+
+TRANSACTION_SELECT = '''
+    *,
+    categories!inner(
+        *,
+        groups!inner(
+            group_name
+        )
+    )
+'''
+
+# Số giao dịch mỗi trang, nhỏ hơn giới hạn max-rows mặc định của PostgREST (1000)
+PAGE_SIZE = 1000
+
+def _flatten_category(t: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuyển categories lồng nhau thành {'categoryname', 'group_name'}"""
+    category = t['categories']
+    t['categories'] = {
+        'categoryname': category.get('categoryname'),
+        'group_name': (category.get('groups') or {}).get('group_name', '')
+    }
+    return t
+
+def _keyset_filter(last: Dict[str, Any]) -> str:
+    """
+    Điều kiện PostgREST để lấy các dòng nằm SAU dòng cuối của trang trước
+    theo thứ tự (date desc nulls first, id desc)
+    """
+    last_date, last_id = last.get('date'), last.get('id')
+    if last_date is None:
+        return f"and(date.is.null,id.lt.{last_id}),date.not.is.null"
+    return f"date.lt.{last_date},and(date.eq.{last_date},id.lt.{last_id})"
+
+def iter_transaction_batches(wallet_ids: List[str], page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Lấy giao dịch theo từng trang (keyset pagination trên (date, id)): giao dịch
+    không có ngày trước, sau đó mới nhất trước.
+
+    Mỗi lần yield một danh sách giao dịch để bên gọi cộng dồn vào
+    TransactionFrame, không cần giữ toàn bộ lịch sử dạng dict trong bộ nhớ.
+    Khi đã nhận các trang đến ngày D thì mọi giao dịch sau ngày D (và mọi giao
+    dịch không có ngày) đều đã về, nên câu hỏi về khoảng gần đây trả lời được
+    trước khi tải xong. Lỗi giữa chừng được ném ra sau các trang đã lấy được.
+
+    Args:
+        wallet_ids: Danh sách ID ví cần lấy giao dịch
+        page_size: Số giao dịch mỗi trang
+    """
+    if not wallet_ids:
+        logger.debug("Không có wallet_ids")
+        return
+
+    logger.debug("Đang lấy giao dịch cho các wallet: %s", wallet_ids)
+    last = None
+    page = 0
+    while True:
+        try:
+            query = supabase.table('transactions')\
+                .select(TRANSACTION_SELECT)\
+                .in_('wallet_id', wallet_ids)
+            if last is not None:
+                query = query.or_(_keyset_filter(last))
+            with span("supabase.page"):
+                res = query\
+                    .order('date', desc=True, nullsfirst=True)\
+                    .order('id', desc=True)\
+                    .limit(page_size)\
+                    .execute()
+        except Exception as e:
+            logger.error("Lỗi khi lấy dữ liệu giao dịch (trang %d): %s", page + 1, e)
+            raise
+
+        rows = res.data or []
+        page += 1
+        batch = [_flatten_category(t) for t in rows if t.get('categories')]
+        logger.debug("Trang %d: %d giao dịch", page, len(batch))
+        if batch:
+            yield batch
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+
+def iter_transactions_changed_since(
+    wallet_ids: List[str],
+    since: Optional[Tuple[Any, Any]],
+    sync_column: str = "updated_at",
+    page_size: int = PAGE_SIZE,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Lấy các giao dịch mới hoặc vừa sửa sau high-water mark since = (updated_at, id),
+    theo từng trang, thứ tự (sync_column asc, id asc). Giao dịch không có
+    sync_column không so được với mark nên bị bỏ qua. Lỗi giữa chừng được ném ra
+    để bên gọi không coi lần đồng bộ dở dang là đã xong.
+
+    Args:
+        wallet_ids: Danh sách ID ví
+        since: (updated_at, id) lớn nhất đã có ở bản sao cục bộ
+        sync_column: Cột thời gian cập nhật của bảng transactions
+        page_size: Số giao dịch mỗi trang
+    """
+    last = since
+    page = 0
+    while True:
+        try:
+            query = supabase.table('transactions')\
+                .select(TRANSACTION_SELECT)\
+                .in_('wallet_id', wallet_ids)\
+                .filter(sync_column, 'not.is', 'null')
+            if last is not None:
+                mark, mark_id = last
+                query = query.or_(f"{sync_column}.gt.{mark},and({sync_column}.eq.{mark},id.gt.{mark_id})")
+            with span("supabase.page"):
+                res = query\
+                    .order(sync_column)\
+                    .order('id')\
+                    .limit(page_size)\
+                    .execute()
+        except Exception as e:
+            logger.error("Lỗi khi lấy giao dịch thay đổi (trang %d): %s", page + 1, e)
+            raise
+
+        rows = res.data or []
+        page += 1
+        batch = [_flatten_category(t) for t in rows if t.get('categories')]
+        if batch:
+            yield batch
+        if len(rows) < page_size:
+            return
+        last = (rows[-1].get(sync_column), rows[-1].get('id'))
+
+def sync_transactions(snapshot, wallet_ids: List[str], on_batch: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> int:
+    """
+    Đồng bộ bản sao cục bộ (TransactionSnapshot) với Supabase.
+
+    Lần đầu (hoặc khi danh sách ví thay đổi) tải toàn bộ lịch sử bằng
+    iter_transaction_batches, mới nhất trước, và gọi on_batch(trang) cho từng
+    trang để bên gọi dựng TransactionFrame trong lúc tải. Danh sách ví chỉ được
+    ghi vào bản sao khi tải xong, nên lần tải bị ngắt giữa chừng sẽ được tải lại
+    từ đầu. Các lần sau chỉ tải giao dịch có updated_at sau high-water mark
+    (on_batch không được gọi, bên gọi đọc lại từ bản sao).
+
+    Các lần gọi đồng thời cho cùng một file bản sao dùng chung một lần đồng bộ;
+    chỉ on_batch của lần gọi đầu tiên được dùng.
+
+    Returns:
+        Số giao dịch đã tải về trong lần đồng bộ này
+    """
+    key = (snapshot.path, _wallet_key(wallet_ids))
+    return _syncs.do(key, _sync_transactions, snapshot, wallet_ids, on_batch)
+
+def _sync_transactions(snapshot, wallet_ids: List[str], on_batch=None) -> int:
+    wallet_key = sorted(str(w) for w in wallet_ids)
+    since = snapshot.high_water_mark()
+    fetched = 0
+    if snapshot.wallet_ids() != wallet_key or since is None:
+        # Chưa có bản sao, lần trước chưa tải xong, hoặc danh sách ví đã đổi: tải lại toàn bộ
+        logger.debug("Đồng bộ toàn bộ giao dịch")
+        snapshot.reset()
+        with span("supabase.sync"):
+            for batch in iter_transaction_batches(wallet_ids):
+                with span("snapshot.merge"):
+                    fetched += snapshot.merge(batch)
+                if on_batch is not None:
+                    on_batch(batch)
+        snapshot.set_wallet_ids(wallet_ids)
+    else:
+        logger.debug("Đồng bộ giao dịch thay đổi sau %s", since)
+        with span("supabase.sync"):
+            for batch in iter_transactions_changed_since(wallet_ids, since, snapshot.sync_column):
+                with span("snapshot.merge"):
+                    fetched += snapshot.merge(batch)
+    logger.debug("Số giao dịch mới/cập nhật: %d", fetched)
+    return fetched
+
 def get_transactions_by_wallet_ids(wallet_ids: List[str]) -> List[Dict[str, Any]]:
     """
-    Lấy danh sách giao dịch theo danh sách ID ví
-    
+    Lấy toàn bộ giao dịch theo danh sách ID ví, mới nhất trước (gộp mọi trang của
+    iter_transaction_batches). Các lời gọi trùng danh sách ví dùng chung một lần tải
+    và kết quả được giữ SUPABASE_CACHE_TTL giây.
+
+    Ứng dụng dùng sync_transactions + TransactionLoader; hàm này giữ lại cho các
+    script cần danh sách dict như trước.
+
     Args:
         wallet_ids: Danh sách ID ví cần lấy giao dịch
-        
+
     Returns:
-        Danh sách các giao dịch
+        Danh sách các giao dịch (rỗng nếu có lỗi)
     """
     if not wallet_ids:
-        print("[DEBUG] Không có wallet_ids")
         return []
-    
-    print(f"[DEBUG] Đang lấy giao dịch cho các wallet: {wallet_ids}")
-    
+    key = ("transactions", _wallet_key(wallet_ids))
+    return list(_flights.do(key, _fetch_transactions_by_wallet_ids, wallet_ids))
+
+def _fetch_transactions_by_wallet_ids(wallet_ids: List[str]) -> List[Dict[str, Any]]:
+    transactions = []
     try:
-        # Lấy dữ liệu giao dịch với thông tin category và group
-        res = supabase.table('transactions')\
-            .select('''
-                *,
-                categories!inner(
-                    *,
-                    groups!inner(
-                        group_name
-                    )
-                )
-            ''')\
-            .in_('wallet_id', wallet_ids)\
-            .order('date', desc=True)\
-            .execute()
-        
-        # Xử lý dữ liệu trả về
-        transactions = []
-        if res.data:
-            for t in res.data:
-                if 'categories' in t and t['categories']:
-                    # Chuyển đổi cấu trúc dữ liệu
-                    category = t['categories']
-                    t['categories'] = {
-                        'categoryname': category.get('categoryname'),
-                        'group_name': category.get('groups', {}).get('group_name', '')
-                    }
-                    transactions.append(t)
-        
-        print(f"[DEBUG] Số lượng giao dịch lấy được: {len(transactions)}")
-        
-        # In thông tin mẫu cho debug
-        if transactions:
-            print("\n[DEBUG] Mẫu dữ liệu giao dịch (3 giao dịch gần nhất):")
-            for i, t in enumerate(transactions[:3]):
-                print(f"Giao dịch {i+1}:")
-                print(f"  ID: {t.get('id')}")
-                print(f"  Số tiền: {float(t.get('amount', 0)):,.0f} VND")
-                print(f"  Ngày: {t.get('date')}")
-                print(f"  Ghi chú: {t.get('note', 'Không có')}")
-                print(f"  Danh mục: {t.get('categories', {}).get('categoryname', 'Chưa phân loại')}")
-                print(f"  Nhóm: {t.get('categories', {}).get('group_name', 'Chưa phân loại')}")
-                print("-" * 40)
-        else:
-            print("[DEBUG] Không tìm thấy giao dịch nào")
-        
-        return transactions
-        
+        for batch in iter_transaction_batches(wallet_ids):
+            transactions.extend(batch)
     except Exception as e:
-        print(f"[ERROR] Lỗi khi lấy dữ liệu giao dịch: {str(e)}")
-        print("[DEBUG] Kiểm tra lại cấu trúc bảng và quan hệ giữa các bảng")
+        logger.error("Lỗi khi lấy dữ liệu giao dịch: %s", e)
         return []
+    logger.debug("Số lượng giao dịch lấy được: %d", len(transactions))
+    return transactions
+
+def get_transaction_stats_remote(
+    wallet_ids: List[str],
+    group_name: Optional[str] = None,
+    category_name: Optional[str] = None,
+    start_date: Optional[Any] = None,
+    end_date: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """
+    Thống kê giao dịch được gom tổng ngay trên database (hàm RPC transaction_stats,
+    xem sql/transaction_stats.sql) thay vì tải toàn bộ giao dịch về rồi cộng bằng Python.
+
+    Args:
+        wallet_ids: Danh sách ID ví
+        group_name: Tên nhóm cần lọc ('income', 'expense', ...)
+        category_name: Chuỗi con của tên danh mục cần lọc
+        start_date, end_date: Khoảng ngày (datetime.date), tùy chọn
+
+    Returns:
+        Dict thống kê cùng dạng data_processor.get_transaction_stats
+    """
+    if not wallet_ids:
+        return stats_from_aggregate_rows([])
+
+    params = {
+        "p_wallet_ids": [str(w) for w in wallet_ids],
+        "p_group_name": group_name,
+        "p_category_name": category_name,
+        "p_start_date": start_date.isoformat() if start_date else None,
+        "p_end_date": end_date.isoformat() if end_date else None,
+    }
+    try:
+        with span("supabase.rpc"):
+            res = supabase.rpc("transaction_stats", params).execute()
+        rows = res.data or []
+        logger.debug("Số dòng thống kê nhận được: %d", len(rows))
+        return stats_from_aggregate_rows(rows)
+    except Exception as e:
+        logger.error("Lỗi khi gọi transaction_stats: %s", e)
+        return stats_from_aggregate_rows([])
+
+class RemoteTransactions:
+    """
+    Nguồn dữ liệu cho query_handler.execute_plans / data_processor.run_queries khi bật
+    STATS_PUSHDOWN: mỗi bộ lọc được gom tổng bằng get_transaction_stats_remote,
+    không cần tải giao dịch của các ví về.
+    """
+
+    def __init__(self, wallet_ids: List[str]):
+        self.wallet_ids = list(wallet_ids)
+
+    def aggregate_remote(self, group_name=None, category_name=None, start_date=None, end_date=None) -> Dict[str, Any]:
+        return get_transaction_stats_remote(self.wallet_ids, group_name, category_name, start_date, end_date)
@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+
+# Các module nằm ở thư mục gốc của repo (không đóng gói), thêm vào sys.path để import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# supabase_client đọc cấu hình khi import; giá trị giả chỉ để tạo được client,
+# các test không gọi tới database thật
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+
+
+class ManualClock:
+    """Đồng hồ giả cho các test: gán now để tua thời gian"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(predicate, timeout=2.0):
+    """Chờ (tối đa timeout giây) đến khi predicate() đúng, dùng khi đợi thread khác"""
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, "hết thời gian chờ điều kiện"
+        time.sleep(0.001)
@@ -0,0 +1,113 @@
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+pytest.importorskip("supabase")
+pytest.importorskip("dotenv")
+
+from dataset_cache import DatasetCache  # noqa: E402
+
+
+class FakeFrame:
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def memory_usage(self):
+        return self.size
+
+
+class FakeLoader:
+    """TransactionLoader giả: test tự quyết định khi nào tải xong (finish / fail)"""
+
+    def __init__(self, user_id, wallet_ids):
+        self.user_id = user_id
+        self.cancelled = False
+        self._future = Future()
+
+    def start(self):
+        return self
+
+    def finish(self, frame):
+        self._future.set_result(frame)
+
+    def fail(self, error):
+        self._future.set_exception(error)
+
+    def done(self):
+        return self._future.done()
+
+    def add_done_callback(self, fn):
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def result(self, timeout=None):
+        return self._future.result(timeout)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def loaders():
+    return {}
+
+
+@pytest.fixture
+def cache(loaders):
+    def factory(user_id, wallet_ids):
+        loader = loaders[user_id] = FakeLoader(user_id, wallet_ids)
+        return loader
+    return DatasetCache(max_bytes=100, max_age=60, loader_factory=factory, clock=lambda: 0.0)
+
+
+def test_prefetched_frame_is_counted_without_get(cache, loaders):
+    cache.prefetch("u1", [1])
+    assert cache.stats()["bytes"] == 0
+    loaders["u1"].finish(FakeFrame(40))
+    assert cache.stats()["bytes"] == 40
+    # get() sau đó dùng lại dữ liệu đã tải, không tải lại
+    assert cache.get("u1", [1]).size == 40
+    assert cache.stats()["misses"] == 1
+
+
+def test_prefetched_frames_are_evicted_over_budget(cache, loaders):
+    for user in ("u1", "u2", "u3"):
+        cache.prefetch(user, [1])
+        loaders[user].finish(FakeFrame(40))
+    stats = cache.stats()
+    assert (stats["users"], stats["bytes"], stats["evictions"]) == (2, 80, 1)
+    # u1 ít được dùng nhất nên bị bỏ, lần sau tải lại
+    cache.prefetch("u1", [1])
+    assert cache.stats()["misses"] == 4
+
+
+def test_loading_entry_is_not_evicted(cache, loaders):
+    cache.prefetch("u1", [1])
+    cache.prefetch("u2", [1])
+    loaders["u2"].finish(FakeFrame(150))
+    stats = cache.stats()
+    assert stats["users"] == 2 and stats["evictions"] == 0
+    loaders["u1"].finish(FakeFrame(10))
+    # u2 (cũ hơn trong LRU sau khi u1 tải xong) vượt ngân sách và bị bỏ
+    assert cache.stats()["users"] == 1
+
+
+def test_failed_prefetch_is_dropped(cache, loaders):
+    cache.prefetch("u1", [1])
+    loaders["u1"].fail(RuntimeError("mất kết nối"))
+    assert cache.stats()["users"] == 0
+    cache.prefetch("u1", [1])
+    loaders["u1"].finish(FakeFrame(5))
+    assert cache.get("u1", [1]).size == 5
+
+
+def test_get_timeout_keeps_loading(cache, loaders):
+    with pytest.raises(FutureTimeoutError):
+        cache.get("u1", [1], timeout=0.01)
+    first = loaders["u1"]
+    loaders["u1"].finish(FakeFrame(5))
+    assert cache.get("u1", [1], timeout=0.01).size == 5
+    assert loaders["u1"] is first
@@ -0,0 +1,151 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from data_processor import get_transaction_stats
+from transaction_frame import TransactionFrame
+
+CATEGORIES = [
+    "Electricity Bill", "electricity bill", "ELECTRICITY BILL", "Water Bill",
+    " Coffee ", "coffee", "Tiền Điện", "tiền điện thoại", "Food", "",
+]
+GROUPS = ["expense", "Expense", "income", "debt-loan", ""]
+FILTER_CATEGORIES = [None, "bill", "ELECTRICITY", "coffee", "điện", "không có"]
+FILTER_GROUPS = [None, "expense", "INCOME", "debt-loan"]
+
+
+def baseline_stats(transactions, group_name=None, category_name=None, start_date=None, end_date=None):
+    """Ngữ nghĩa của get_transaction_stats bản gốc (một vòng lặp Python trên dict)"""
+    stats = {'total': 0.0, 'count': 0, 'by_category': {}, 'by_month': {}, 'average': 0.0}
+    target_group = group_name.lower() if group_name else None
+    target_category = category_name.lower() if category_name else None
+    for t in transactions:
+        amount = float(t['amount'])
+        t_date = date.fromisoformat(t['date']) if t['date'] else None
+        category = t['categories']['categoryname'].lower().strip()
+        group = t['categories']['group_name'].lower().strip()
+        if target_group and group != target_group:
+            continue
+        if target_category and target_category not in category:
+            continue
+        if start_date and t_date and t_date < start_date:
+            continue
+        if end_date and t_date and t_date > end_date:
+            continue
+        stats['total'] += amount
+        stats['count'] += 1
+        if category:
+            stats['by_category'][category] = stats['by_category'].get(category, 0) + amount
+        if t_date:
+            month = t_date.strftime('%Y-%m')
+            stats['by_month'][month] = stats['by_month'].get(month, 0) + amount
+    if stats['count']:
+        stats['average'] = stats['total'] / stats['count']
+    return stats
+
+
+def random_transactions(rng, n):
+    first = date(2023, 11, 1)
+    rows = []
+    for i in range(n):
+        day = None if rng.random() < 0.1 else (first + timedelta(days=rng.randrange(150))).isoformat()
+        rows.append({
+            'id': i,
+            'amount': round(rng.uniform(-50_000, 5_000_000), 2),
+            'date': day,
+            'categories': {'categoryname': rng.choice(CATEGORIES), 'group_name': rng.choice(GROUPS)},
+        })
+    return rows
+
+
+def random_range(rng):
+    """Khoảng ngày ngẫu nhiên, thường cắt ngang ranh giới tháng (hoặc mở một đầu)"""
+    lo = date(2023, 10, 20) + timedelta(days=rng.randrange(170))
+    hi = lo + timedelta(days=rng.randrange(1, 90))
+    choice = rng.randrange(4)
+    return (lo if choice != 1 else None), (hi if choice != 2 else None)
+
+
+def assert_same_stats(actual, expected):
+    assert actual['count'] == expected['count']
+    assert actual['total'] == pytest.approx(expected['total'])
+    assert actual['average'] == pytest.approx(expected['average'])
+    assert actual['by_category'] == pytest.approx(expected['by_category'])
+    assert actual['by_month'] == pytest.approx(expected['by_month'])
+    amounts = list(actual['by_category'].values())
+    assert amounts == sorted(amounts, reverse=True)
+
+
+def engine_frame(rows, engine):
+    if engine == 'numpy':
+        pytest.importorskip("numpy")
+    return TransactionFrame.from_transactions(rows, rollup=(engine == 'rollup'))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("engine", ['python', 'rollup', 'numpy'])
+def test_engines_match_baseline(engine, seed):
+    rng = random.Random(seed)
+    rows = random_transactions(rng, 400)
+    frame = engine_frame(rows, engine)
+    for _ in range(40):
+        group = rng.choice(FILTER_GROUPS)
+        category = rng.choice(FILTER_CATEGORIES)
+        start, end = random_range(rng)
+        actual = get_transaction_stats(frame, group, category, start, end, engine=engine)
+        assert_same_stats(actual, baseline_stats(rows, group, category, start, end))
+
+
+@pytest.mark.parametrize("engine", ['python', 'rollup', 'numpy'])
+def test_range_inside_single_month_and_whole_months(engine):
+    rng = random.Random(42)
+    rows = random_transactions(rng, 300)
+    frame = engine_frame(rows, engine)
+    ranges = [
+        (date(2024, 1, 1), date(2024, 1, 31)),     # trọn một tháng
+        (date(2024, 1, 10), date(2024, 1, 12)),    # trong một tháng
+        (date(2023, 12, 31), date(2024, 1, 1)),    # ngang năm
+        (date(2023, 11, 15), date(2024, 3, 15)),   # nhiều tháng, cắt hai đầu
+        (date(2025, 1, 1), date(2025, 2, 1)),      # không có giao dịch có ngày
+    ]
+    for start, end in ranges:
+        actual = get_transaction_stats(frame, None, None, start, end, engine=engine)
+        assert_same_stats(actual, baseline_stats(rows, None, None, start, end))
+
+
+@pytest.mark.parametrize("engine", ['python', 'rollup', 'numpy'])
+def test_undated_rows_always_kept(engine):
+    rows = [
+        {'id': 1, 'amount': 100, 'date': None, 'categories': {'categoryname': 'Food', 'group_name': 'expense'}},
+        {'id': 2, 'amount': 50, 'date': '2024-02-29', 'categories': {'categoryname': 'FOOD', 'group_name': 'expense'}},
+        {'id': 3, 'amount': 25, 'date': '2024-03-01', 'categories': {'categoryname': 'food ', 'group_name': 'expense'}},
+    ]
+    frame = engine_frame(rows, engine)
+    stats = get_transaction_stats(frame, 'expense', 'Food', date(2024, 3, 1), date(2024, 3, 31), engine=engine)
+    assert stats['count'] == 2
+    assert stats['by_category'] == {'food': 125}
+    assert stats['by_month'] == {'2024-03': 25}
+
+
+def test_default_engine_on_plain_list():
+    rng = random.Random(7)
+    rows = random_transactions(rng, 200)
+    for _ in range(20):
+        start, end = random_range(rng)
+        group = rng.choice(FILTER_GROUPS)
+        category = rng.choice(FILTER_CATEGORIES)
+        actual = get_transaction_stats(rows, group, category, start, end)
+        assert_same_stats(actual, baseline_stats(rows, group, category, start, end))
+
+
+def test_rollup_engine_builds_cube_on_demand():
+    rng = random.Random(11)
+    rows = random_transactions(rng, 300)
+    frame = TransactionFrame.from_transactions(rows)
+    assert frame.rollup is None
+    for _ in range(20):
+        start, end = random_range(rng)
+        actual = get_transaction_stats(frame, 'expense', None, start, end, engine='rollup')
+        assert_same_stats(actual, baseline_stats(rows, 'expense', None, start, end))
+    assert frame.rollup is not None
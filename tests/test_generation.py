@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+import ollama_client
+from conftest import ManualClock
+from ollama_client import TIMEOUT_NOTE, Generation, ask_ollama
+
+
+class FakeCache:
+    def __init__(self):
+        self.saved = {}
+
+    def get(self, prompt, model):
+        return self.saved.get((prompt, model))
+
+    def put(self, prompt, model, answer):
+        self.saved[(prompt, model)] = answer
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """
+    Thay _stream_chunks bằng một model giả: yield các đoạn cho trước rồi treo
+    (như model còn đang sinh) đến khi generation bị dừng. Trả về trạng thái để kiểm tra.
+    """
+    state = {"chunks": ["Xin", " chào"], "hang": True, "aborted": False, "closed": False}
+
+    def fake_chunks(prompt, model, use_http, generation):
+        stop = threading.Event()
+
+        def abort():
+            state["aborted"] = True
+            stop.set()
+
+        try:
+            with generation.watch(abort):
+                yield from state["chunks"]
+                if state["hang"]:
+                    stop.wait(2)
+        finally:
+            state["closed"] = True
+
+    cache = FakeCache()
+    monkeypatch.setattr(ollama_client, "_stream_chunks", fake_chunks)
+    monkeypatch.setattr(ollama_client, "get_response_cache", lambda: cache)
+    state["cache"] = cache
+    return state
+
+
+def test_remaining_and_deadline_with_clock():
+    clock = ManualClock()
+    generation = Generation(timeout=5, clock=clock)
+    assert generation.remaining() == 5
+    assert generation.stopped() is None
+    clock.now = 6
+    assert generation.remaining() == 0.0
+    assert generation.stopped() == "deadline"
+    assert Generation().remaining() is None
+
+
+def test_cancel_runs_aborts_once_and_keeps_first_reason():
+    generation = Generation()
+    calls = []
+    with generation.watch(lambda: calls.append("a")):
+        generation.cancel()
+        generation.cancel("deadline")
+    assert calls == ["a"]
+    assert generation.stopped() == "cancelled"
+
+
+def test_watch_after_cancel_aborts_immediately():
+    generation = Generation()
+    generation.cancel()
+    calls = []
+    with generation.watch(lambda: calls.append("late")):
+        assert calls == ["late"]
+
+
+def test_watch_unregisters_on_exit():
+    generation = Generation()
+    calls = []
+    with generation.watch(lambda: calls.append("a")):
+        pass
+    generation.cancel()
+    assert calls == []
+
+
+def test_abort_oserror_is_ignored():
+    generation = Generation()
+
+    def broken():
+        raise OSError("socket đã đóng")
+
+    calls = []
+    with generation.watch(broken), generation.watch(lambda: calls.append("b")):
+        generation.cancel()
+    assert calls == ["b"]
+
+
+def test_timer_cancels_at_deadline():
+    aborted = threading.Event()
+    with Generation(timeout=0.05) as generation, generation.watch(aborted.set):
+        assert aborted.wait(2)
+    assert generation.reason == "deadline"
+
+
+def test_timer_stopped_on_exit():
+    with Generation(timeout=0.05) as generation:
+        pass
+    time.sleep(0.1)
+    assert generation.reason is None
+
+
+def test_deadline_returns_partial_answer(fake_model):
+    answer = ask_ollama("câu hỏi", deadline=0.1)
+    assert answer == f"Xin chào\n\n{TIMEOUT_NOTE}"
+    assert fake_model["aborted"]
+    # Câu trả lời dở dang không được cache
+    assert fake_model["cache"].saved == {}
+
+
+def test_deadline_with_no_output_returns_note(fake_model):
+    fake_model["chunks"] = []
+    assert ask_ollama("câu hỏi", deadline=0.1) == TIMEOUT_NOTE
+
+
+def test_complete_answer_is_cached(fake_model):
+    fake_model["hang"] = False
+    assert ask_ollama("câu hỏi", deadline=5) == "Xin chào"
+    assert fake_model["cache"].saved == {("câu hỏi", "deepseek-r1:7b"): "Xin chào"}
+
+
+def test_stream_deadline_appends_note(fake_model):
+    chunks = list(ask_ollama("câu hỏi", stream=True, deadline=0.1))
+    assert chunks == ["Xin", " chào", "\n\n" + TIMEOUT_NOTE]
+
+
+def test_stream_cancel_from_other_thread(fake_model):
+    generation = Generation()
+    answer = ask_ollama("câu hỏi", stream=True, generation=generation)
+    assert next(answer) == "Xin"
+    threading.Timer(0.05, generation.cancel).start()
+    # Hủy chủ động: không có ghi chú hết hạn, không cache
+    assert list(answer) == [" chào"]
+    assert generation.reason == "cancelled"
+    assert fake_model["aborted"]
+    assert fake_model["cache"].saved == {}
+
+
+def test_closing_stream_stops_model(fake_model):
+    answer = ask_ollama("câu hỏi", stream=True, deadline=5)
+    assert next(answer) == "Xin"
+    answer.close()
+    assert fake_model["closed"]
+    assert fake_model["cache"].saved == {}
+    # Chỗ gọi model đã được trả lại
+    assert ollama_client.get_scheduler().stats()["active"] == 0
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from keyword_matcher import KeywordMatcher
+import query_handler as qh
+
+
+def naive(keywords, text):
+    return {k for k in keywords if k and k in text}
+
+
+@pytest.mark.parametrize("keywords, text", [
+    (["he", "she", "his", "hers"], "ushers"),
+    (["a", "aa", "aaa"], "aaaa"),
+    (["abcd", "bc", "c"], "abce"),
+    (["chi tiêu", "chi", "tiêu"], "tổng chi tiêu tháng này"),
+    (["tháng ", "tháng này", "tháng trước"], "so sánh tháng này và tháng trước"),
+    (["", "x"], "xyz"),
+    (["điện", "tiền điện", "điện thoại"], "tiền điện thoại"),
+])
+def test_find_matches_substring_scan(keywords, text):
+    assert KeywordMatcher(keywords).find(text) == naive(keywords, text)
+
+
+def test_no_keywords_and_empty_text():
+    assert KeywordMatcher([]).find("bất kỳ") == set()
+    assert KeywordMatcher(["a"]).find("") == set()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_keywords_over_small_alphabet(seed):
+    rng = random.Random(seed)
+    word = lambda n: "".join(rng.choice("abcđ ") for _ in range(n))
+    keywords = {word(rng.randrange(1, 5)) for _ in range(30)}
+    matcher = KeywordMatcher(keywords)
+    for _ in range(50):
+        text = word(rng.randrange(0, 40))
+        assert matcher.find(text) == naive(keywords, text)
+
+
+def test_query_handler_matcher_on_questions():
+    keywords = (
+        set(qh.FINANCE_KEYWORDS) | set(qh.CATEGORY_MAPPING) | set(qh.PERIOD_KEYWORDS) |
+        qh.HIGHEST_KEYWORDS | qh.HIGHEST_EXPENSE_KEYWORDS | qh.LOWEST_KEYWORDS |
+        qh.INCOME_KEYWORDS | qh.EXPENSE_KEYWORDS | qh.COMPARE_KEYWORDS
+    )
+    for question in [
+        "tổng chi tiêu tháng trước",
+        "tôi chi nhiều nhất cho khoản nào năm nay?",
+        "so sánh tiền điện và tiền nước quý này",
+        "lương tháng 3/2024",
+        "kể chuyện cười đi",
+    ]:
+        assert qh.KEYWORD_MATCHER.find(question) == naive(keywords, question)
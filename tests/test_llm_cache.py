@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from llm_cache import ResponseCache, normalize_question
+
+MODEL = "deepseek-r1:7b"
+
+
+@pytest.fixture
+def now():
+    """Đồng hồ giả: test đặt now[0] để tua thời gian"""
+    return [0.0]
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "llm_cache.json")
+
+
+def make_cache(path, now, **kwargs):
+    return ResponseCache(path=path, clock=lambda: now[0], **kwargs)
+
+
+@pytest.mark.parametrize("variant", ["Xin chào", "xin chao", "  XIN   CHÀO ", "xin\tchào", "Xin Chào"])
+def test_normalization_ignores_case_diacritics_and_whitespace(variant):
+    assert normalize_question(variant) == "xin chao"
+
+
+def test_normalization_maps_d_stroke():
+    assert normalize_question("Đi đâu") == "di dau"
+
+
+def test_hit_for_normalized_variant(cache_path, now):
+    cache = make_cache(cache_path, now)
+    assert cache.get("Xin chào", MODEL) is None
+    cache.put("Xin chào", MODEL, "Chào bạn")
+    assert cache.get("xin   CHAO", MODEL) == "Chào bạn"
+    # Khóa gồm cả tên model
+    assert cache.get("xin chào", "llama3") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 1)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_lru_bound_evicts_least_recently_used(cache_path, now):
+    cache = make_cache(cache_path, now, max_entries=2)
+    cache.put("a", MODEL, "1")
+    cache.put("b", MODEL, "2")
+    assert cache.get("a", MODEL) == "1"
+    cache.put("c", MODEL, "3")
+    assert cache.get("b", MODEL) is None
+    assert (cache.get("a", MODEL), cache.get("c", MODEL)) == ("1", "3")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_entries_expire_after_ttl(cache_path, now):
+    cache = make_cache(cache_path, now, ttl=60)
+    cache.put("câu hỏi", MODEL, "trả lời")
+    now[0] = 60
+    assert cache.get("câu hỏi", MODEL) == "trả lời"
+    now[0] = 61
+    assert cache.get("câu hỏi", MODEL) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_persists_across_reloads(cache_path, now):
+    make_cache(cache_path, now).put("Xin chào", MODEL, "Chào bạn")
+    reloaded = make_cache(cache_path, now)
+    assert reloaded.get("xin chao", MODEL) == "Chào bạn"
+
+
+def test_reload_skips_expired_and_keeps_newest(cache_path, now):
+    cache = make_cache(cache_path, now, ttl=100)
+    cache.put("cũ", MODEL, "1")
+    now[0] = 50
+    cache.put("mới", MODEL, "2")
+    cache.put("mới nhất", MODEL, "3")
+    now[0] = 120
+    reloaded = make_cache(cache_path, now, ttl=100, max_entries=1)
+    assert reloaded.stats()["size"] == 1
+    assert reloaded.get("mới nhất", MODEL) == "3"
+
+
+def test_corrupt_file_is_ignored(cache_path, now):
+    with open(cache_path, "w", encoding="utf-8") as f:
+        f.write("{không phải json")
+    cache = make_cache(cache_path, now)
+    assert cache.stats()["size"] == 0
+    cache.put("a", MODEL, "1")
+    with open(cache_path, encoding="utf-8") as f:
+        assert len(json.load(f)) == 1
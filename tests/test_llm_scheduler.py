@@ -0,0 +1,195 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import llm_scheduler
+import profiling
+from conftest import ManualClock, wait_until
+from llm_scheduler import BATCH, INTERACTIVE, DeadlineExceeded, LLMScheduler, QueueFull
+
+
+def queued(scheduler, name):
+    return scheduler.stats()["queued"][name]
+
+
+def start_waiter(scheduler, priority, outcome, name, timeout=None):
+    """Thread chờ một chỗ gọi model; ghi tên hoặc tên lỗi vào outcome"""
+    def run():
+        try:
+            with scheduler.slot(priority, timeout=timeout):
+                outcome.append(name)
+        except (QueueFull, DeadlineExceeded) as e:
+            outcome.append((name, type(e).__name__))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_free_slot_is_granted_immediately():
+    scheduler = LLMScheduler(workers=2, max_queue=1)
+    with scheduler.slot(INTERACTIVE, timeout=5) as deadline:
+        assert deadline is not None
+        with scheduler.slot(BATCH):
+            assert scheduler.stats()["active"] == 2
+    stats = scheduler.stats()
+    assert (stats["active"], stats["admitted"], stats["completed"]) == (0, 2, 2)
+
+
+def test_interactive_is_served_before_earlier_batch():
+    scheduler = LLMScheduler(workers=1, max_queue=4)
+    outcome = []
+    scheduler.acquire()
+    batch = start_waiter(scheduler, BATCH, outcome, "batch")
+    wait_until(lambda: queued(scheduler, "batch") == 1)
+    interactive = start_waiter(scheduler, INTERACTIVE, outcome, "interactive")
+    wait_until(lambda: queued(scheduler, "interactive") == 1)
+    scheduler.release()
+    batch.join(2)
+    interactive.join(2)
+    assert outcome == ["interactive", "batch"]
+
+
+def test_full_queue_displaces_newest_batch():
+    scheduler = LLMScheduler(workers=1, max_queue=2)
+    outcome = []
+    scheduler.acquire()
+    first = start_waiter(scheduler, BATCH, outcome, "b1")
+    wait_until(lambda: queued(scheduler, "batch") == 1)
+    second = start_waiter(scheduler, BATCH, outcome, "b2")
+    wait_until(lambda: queued(scheduler, "batch") == 2)
+
+    interactive = start_waiter(scheduler, INTERACTIVE, outcome, "i1")
+    second.join(2)
+    assert outcome == [("b2", "QueueFull")]
+    wait_until(lambda: queued(scheduler, "interactive") == 1)
+
+    scheduler.release()
+    for thread in (first, interactive):
+        thread.join(2)
+    assert outcome == [("b2", "QueueFull"), "i1", "b1"]
+    assert scheduler.stats()["displaced"] == 1
+
+
+def test_full_queue_rejects_same_priority():
+    scheduler = LLMScheduler(workers=1, max_queue=1)
+    outcome = []
+    scheduler.acquire()
+    waiter = start_waiter(scheduler, INTERACTIVE, outcome, "i1")
+    wait_until(lambda: queued(scheduler, "interactive") == 1)
+    with pytest.raises(QueueFull):
+        scheduler.acquire(INTERACTIVE)
+    with pytest.raises(QueueFull):
+        scheduler.acquire(BATCH)
+    scheduler.release()
+    waiter.join(2)
+    assert outcome == ["i1"]
+    assert scheduler.stats()["rejected"] == 2
+
+
+def test_waiter_expires_while_queued():
+    scheduler = LLMScheduler(workers=1, max_queue=4)
+    scheduler.acquire()
+    with pytest.raises(DeadlineExceeded):
+        scheduler.acquire(INTERACTIVE, timeout=0.05)
+    stats = scheduler.stats()
+    assert stats["expired"] == 1
+    assert stats["queued"] == {"interactive": 0, "batch": 0}
+    scheduler.release()
+    # Lời gọi hết hạn không chiếm chỗ: lời gọi sau được cấp ngay
+    with scheduler.slot(INTERACTIVE, timeout=0.05):
+        pass
+
+
+def test_expired_waiter_is_skipped_on_release():
+    clock = ManualClock()
+    scheduler = LLMScheduler(workers=1, max_queue=4, clock=clock)
+    outcome = []
+    scheduler.acquire()
+    late = start_waiter(scheduler, INTERACTIVE, outcome, "late", timeout=10)
+    wait_until(lambda: queued(scheduler, "interactive") == 1)
+    on_time = start_waiter(scheduler, BATCH, outcome, "on_time")
+    wait_until(lambda: queued(scheduler, "batch") == 1)
+
+    clock.now = 20.0   # quá hạn của "late" trước khi có chỗ trống
+    scheduler.release()
+    late.join(2)
+    on_time.join(2)
+    assert sorted(outcome, key=str) == [("late", "DeadlineExceeded"), "on_time"]
+    stats = scheduler.stats()
+    assert stats["expired"] == 1
+    assert stats["wait_ms"]["batch"]["max"] == pytest.approx(20_000)
+
+
+def test_queue_wait_is_recorded_on_waiting_thread():
+    clock = ManualClock()
+    scheduler = LLMScheduler(workers=1, max_queue=4, clock=clock)
+    waited = []
+
+    def run():
+        with profiling.collect() as records:
+            with scheduler.slot(INTERACTIVE):
+                pass
+        waited.extend(seconds for _, _, name, seconds in records if name == "llm.queue_wait")
+
+    profiling.enable()
+    try:
+        with profiling.collect() as releasing:
+            scheduler.acquire()
+            waiter = threading.Thread(target=run)
+            waiter.start()
+            wait_until(lambda: queued(scheduler, "interactive") == 1)
+            clock.now = 1.5
+            scheduler.release()
+            waiter.join(2)
+    finally:
+        profiling.disable()
+        profiling.reset()
+    assert waited == [1.5]
+    # Thread vừa release chỉ có mẫu chờ của lần acquire của chính nó
+    assert [s for _, _, name, s in releasing if name == "llm.queue_wait"] == [0.0]
+
+
+class InterruptedEvent:
+    """Event giả: wait() bị ngắt bằng KeyboardInterrupt, sau khi chạy before_interrupt (nếu có)"""
+    before_interrupt = None
+
+    def wait(self, timeout=None):
+        if InterruptedEvent.before_interrupt is not None:
+            InterruptedEvent.before_interrupt()
+        raise KeyboardInterrupt
+
+    def set(self):
+        pass
+
+
+@pytest.fixture
+def interrupted_wait(monkeypatch):
+    # Chỉ waiter của llm_scheduler dùng Event giả, module threading thật giữ nguyên
+    monkeypatch.setattr(llm_scheduler, "threading", SimpleNamespace(Event=InterruptedEvent, Lock=threading.Lock))
+    monkeypatch.setattr(InterruptedEvent, "before_interrupt", None)
+    return InterruptedEvent
+
+
+def test_interrupted_waiter_leaves_queue(interrupted_wait):
+    scheduler = LLMScheduler(workers=1, max_queue=4)
+    scheduler.acquire()
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.acquire(INTERACTIVE)
+    assert queued(scheduler, "interactive") == 0
+    scheduler.release()
+    assert scheduler.stats()["active"] == 0
+
+
+def test_interrupted_after_grant_returns_slot(interrupted_wait):
+    scheduler = LLMScheduler(workers=1, max_queue=4)
+    scheduler.acquire()
+    # Chỗ được cấp cho waiter ngay trước khi wait() bị ngắt
+    interrupted_wait.before_interrupt = scheduler.release
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.acquire(INTERACTIVE)
+    stats = scheduler.stats()
+    assert (stats["active"], stats["queued"]["interactive"]) == (0, 0)
+    interrupted_wait.before_interrupt = None
+    assert scheduler.acquire(INTERACTIVE) is None
+    assert scheduler.stats()["active"] == 1
@@ -0,0 +1,127 @@
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ollama_client
+from ollama_client import ThinkFilter, ask_ollama, strip_thinking
+
+CHUNKS = ["<think>", "hmm</th", "ink>\n\nXin", " chào", " bạn!"]
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """/api/generate trả về NDJSON như Ollama, ghi lại địa chỉ kết nối của mỗi request"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.client_address, payload))
+        lines = [{"response": chunk, "done": False} for chunk in CHUNKS]
+        lines.append({"response": "", "done": True})
+        body = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client_for(monkeypatch):
+    """Trỏ OllamaClient dùng chung của ollama_client tới host cho trước"""
+    pytest.importorskip("requests")
+    clients = []
+
+    def make(host):
+        client = ollama_client.OllamaClient(host=host)
+        clients.append(client)
+        monkeypatch.setattr(ollama_client, "_client", client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_stream_yields_chunks_in_order(fake_server, client_for):
+    client = client_for(f"http://127.0.0.1:{fake_server.server_port}")
+    assert list(client.stream("câu hỏi", "model-x")) == CHUNKS
+    _, payload = fake_server.requests[0]
+    assert payload["prompt"] == "câu hỏi"
+    assert payload["model"] == "model-x"
+    assert payload["stream"] is True
+
+
+def test_connection_reused_across_calls(fake_server, client_for):
+    client_for(f"http://127.0.0.1:{fake_server.server_port}")
+    answers = [ask_ollama(f"câu {i}", use_cache=False, hide_thinking=True) for i in range(3)]
+    assert answers == ["Xin chào bạn!"] * 3
+    addresses = {address for address, _ in fake_server.requests}
+    assert len(fake_server.requests) == 3
+    assert len(addresses) == 1
+
+
+def test_stream_mode_hides_thinking(fake_server, client_for):
+    client_for(f"http://127.0.0.1:{fake_server.server_port}")
+    parts = list(ask_ollama("câu hỏi", stream=True, use_cache=False, hide_thinking=True))
+    assert "".join(parts) == "Xin chào bạn!"
+    assert not any("think" in part for part in parts)
+
+
+def test_falls_back_to_subprocess_when_http_fails(client_for, monkeypatch):
+    client_for(f"http://127.0.0.1:{_unused_port()}")
+    calls = []
+
+    def fake_subprocess(prompt, model, generation):
+        calls.append(prompt)
+        yield "từ "
+        yield "ollama run"
+
+    monkeypatch.setattr(ollama_client, "_stream_subprocess", fake_subprocess)
+    assert ask_ollama("câu hỏi", use_cache=False) == "từ ollama run"
+    assert list(ask_ollama("câu hỏi", stream=True, use_cache=False)) == ["từ ", "ollama run"]
+    assert calls == ["câu hỏi", "câu hỏi"]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 100])
+def test_think_filter_across_chunk_splits(size):
+    text = "<think>suy nghĩ <b> dài</think>\n\nCâu trả lời <think>nữa</think> cuối"
+    think_filter = ThinkFilter()
+    out = [think_filter.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    out.append(think_filter.flush())
+    assert "".join(out) == "Câu trả lời  cuối"
+    assert "".join(out) == strip_thinking(text)
+
+
+def test_think_filter_keeps_partial_tag_lookalikes():
+    think_filter = ThinkFilter()
+    out = think_filter.feed("a <thi") + think_filter.feed("s is fine") + think_filter.flush()
+    assert out == "a <this is fine"
+
+
+def test_think_filter_drops_unclosed_block():
+    think_filter = ThinkFilter()
+    out = think_filter.feed("<think>chưa xong") + think_filter.flush()
+    assert out == ""
@@ -0,0 +1,183 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import query_handler
+from data_processor import StatsQuery
+from query_handler import QueryPlan, execute_plan, needs_transactions, parse_question, plan_queries, wants_finance_context
+from transaction_frame import TransactionFrame
+
+TODAY = date(2024, 3, 15)
+
+
+@pytest.mark.parametrize("question", ["làm sao để tiết kiệm hơn?", "tôi có nên đầu tư không", "how do I make a budget"])
+def test_open_finance_questions_go_to_llm_with_context(question):
+    plan = parse_question(question, today=TODAY)
+    assert plan.intent == "advice"
+    assert not needs_transactions(plan)
+    assert wants_finance_context(plan)
+    assert execute_plan(plan, []) == (None, None)
+
+
+@pytest.mark.parametrize("question", ["kể chuyện cười đi", "what is python"])
+def test_small_talk_goes_to_llm_without_context(question):
+    plan = parse_question(question, today=TODAY)
+    assert plan.intent == "chat"
+    assert not wants_finance_context(plan)
+
+
+def test_same_question_on_different_days_gives_different_periods():
+    march = parse_question("tổng chi tiêu tháng này", today=date(2024, 3, 15))
+    april = parse_question("tổng chi tiêu tháng này", today=date(2024, 4, 2))
+    assert (march.start_date, march.end_date) == (date(2024, 3, 1), date(2024, 3, 15))
+    assert (april.start_date, april.end_date) == (date(2024, 4, 1), date(2024, 4, 2))
+    assert march.time_period != april.time_period
+    # Kết quả phân tích được nhớ theo (câu hỏi, ngày): cùng ngày thì dùng lại
+    assert parse_question("Tổng chi tiêu tháng này ", today=date(2024, 3, 15)) is march
+
+
+@pytest.mark.parametrize("question, intent, group, categories, start, end", [
+    ("thống kê hôm qua", "summary", None, (), date(2024, 3, 14), date(2024, 3, 14)),
+    ("tổng tiền tuần này", "summary", None, (), date(2024, 3, 11), date(2024, 3, 15)),
+    ("chi tiêu quý trước", "expense", "expense", (), date(2023, 10, 1), date(2023, 12, 31)),
+    ("thu nhập năm nay", "income", "income", (), date(2024, 1, 1), date(2024, 3, 15)),
+    ("tôi chi nhiều nhất cho khoản nào tháng này", "highest", None, (), date(2024, 3, 1), date(2024, 3, 15)),
+    ("khoản nào ít nhất", "lowest", "expense", (), None, None),
+    ("tiền điện tháng trước", "category", None, (("điện", "electricity"),), date(2024, 2, 1), date(2024, 2, 29)),
+    ("so sánh tiền điện và tiền nước tháng 11", "compare", None,
+     (("nước", "water"), ("điện", "electricity")), date(2024, 11, 1), date(2024, 11, 30)),
+])
+def test_plan_for_each_intent(question, intent, group, categories, start, end):
+    plan = parse_question(question, today=TODAY)
+    assert (plan.intent, plan.group, plan.categories, plan.start_date, plan.end_date) == \
+        (intent, group, categories, start, end)
+
+
+def test_plan_queries_per_intent():
+    start, end = date(2024, 3, 1), date(2024, 3, 15)
+    period = dict(start_date=start, end_date=end)
+    assert plan_queries(QueryPlan("highest", group="expense", **period)) == \
+        [StatsQuery("highest", "expense", None, start, end)]
+    for intent, group in (("lowest", "expense"), ("income", "income"), ("expense", "expense")):
+        assert plan_queries(QueryPlan(intent, group=group, **period)) == \
+            [StatsQuery("stats", group, None, start, end)]
+    categories = (("điện", "electricity"), ("nước", "water"))
+    assert plan_queries(QueryPlan("compare", categories=categories, **period)) == [
+        StatsQuery("stats", None, "electricity", start, end),
+        StatsQuery("stats", None, "water", start, end),
+    ]
+    assert plan_queries(QueryPlan("category", categories=categories[:1], **period)) == \
+        [StatsQuery("stats", None, "electricity", start, end)]
+    assert plan_queries(QueryPlan("summary", **period)) == [StatsQuery("stats", None, None, start, end)]
+    for intent in ("greeting", "chat", "advice", "invalid"):
+        assert plan_queries(QueryPlan(intent)) == []
+
+
+def sample_frame(today):
+    """Giao dịch trải trên 90 ngày gần today, có cả thu, chi và giao dịch không ngày"""
+    categories = [("Electricity Bill", "expense"), ("Water Bill", "expense"), ("Coffee", "expense"),
+                  ("Food", "expense"), ("Salary", "income")]
+    rows = []
+    for i in range(300):
+        name, group = categories[i % len(categories)]
+        day = today - timedelta(days=(i * 7) % 90)
+        rows.append({
+            'id': i,
+            'amount': float(1000 + (i * 37) % 5000),
+            'date': None if i % 50 == 0 else day.isoformat(),
+            'categories': {'categoryname': name, 'group_name': group},
+        })
+    return TransactionFrame.from_transactions(rows)
+
+
+MIXED_QUESTIONS = [
+    "tổng chi tiêu tháng này",
+    "thống kê tháng trước",
+    "tôi chi nhiều nhất cho khoản nào",
+    "khoản nào chi ít nhất",
+    "thu nhập năm nay",
+    "tiền điện tháng này",
+    "so sánh tiền điện và tiền nước",
+    "danh sách giao dịch tuần này",
+    "xin chào",
+    "kể chuyện cười đi",
+    "",
+    "tổng chi tiêu tháng này",
+]
+
+
+def test_handle_questions_matches_handle_question():
+    frame = sample_frame(date.today())
+
+    def answer_each():
+        random.seed(0)
+        query_handler.clear_answer_cache()
+        return [query_handler.handle_question(q, frame) for q in MIXED_QUESTIONS]
+
+    def answer_batch():
+        random.seed(0)
+        query_handler.clear_answer_cache()
+        return query_handler.handle_questions(MIXED_QUESTIONS, frame)
+
+    intents = {parse_question(q).intent for q in MIXED_QUESTIONS}
+    assert intents >= {"summary", "expense", "income", "highest", "lowest", "category", "compare",
+                       "greeting", "chat", "invalid"}
+    each = answer_each()
+    assert answer_batch() == each
+    # Có đủ các loại câu trả lời: số liệu, chào hỏi, hỏi LLM, câu không hợp lệ
+    assert any(result is not None for result, _ in each)
+    assert (None, None) in each
+    assert (None, "Vui lòng nhập câu hỏi hợp lệ") in each
+
+
+@pytest.fixture
+def counted_queries(monkeypatch):
+    """Đếm số lần query_handler phải tính thống kê thật; cache câu trả lời bắt đầu rỗng"""
+    calls = []
+    run_queries = query_handler.run_queries
+
+    def counting(transactions, queries):
+        calls.append(len(queries))
+        return run_queries(transactions, queries)
+
+    monkeypatch.setattr(query_handler, "run_queries", counting)
+    query_handler.clear_answer_cache()
+    yield calls
+    query_handler.clear_answer_cache()
+
+
+def test_answer_is_reused_for_same_plan_and_version(counted_queries):
+    frame = sample_frame(TODAY)
+    plan = parse_question("tổng chi tiêu tháng này", today=TODAY)
+    first = execute_plan(plan, frame)
+    assert execute_plan(plan, frame) is first
+    assert counted_queries == [1]
+
+
+def test_answer_is_recomputed_after_extend(counted_queries):
+    frame = sample_frame(TODAY)
+    plan = parse_question("tổng chi tiêu tháng này", today=TODAY)
+    before, _ = execute_plan(plan, frame)
+    version = frame.version
+    frame.extend([{'id': 'mới', 'amount': 500.0, 'date': TODAY.isoformat(),
+                   'categories': {'categoryname': 'Food', 'group_name': 'expense'}}])
+    assert frame.version != version
+    after, _ = execute_plan(plan, frame)
+    assert after == before + 500.0
+    assert counted_queries == [1, 1]
+
+
+def test_answer_cache_is_bounded(counted_queries, monkeypatch):
+    monkeypatch.setattr(query_handler, "ANSWER_CACHE_SIZE", 3)
+    frame = sample_frame(TODAY)
+    plans = [parse_question(q, today=TODAY) for q in
+             ("thống kê hôm qua", "thống kê tuần này", "thống kê tháng này", "thống kê năm nay")]
+    for plan in plans:
+        execute_plan(plan, frame)
+    assert len(query_handler._answer_cache) == 3
+    # Mục cũ nhất đã bị bỏ và phải tính lại, mục mới nhất vẫn còn
+    execute_plan(plans[-1], frame)
+    assert len(counted_queries) == 4
+    execute_plan(plans[0], frame)
+    assert len(counted_queries) == 5
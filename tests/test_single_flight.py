@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+from conftest import ManualClock, wait_until
+from single_flight import SingleFlight
+
+
+class SlowCall:
+    """Hàm đếm số lần chạy, chặn đến khi release() để các lời gọi khác kịp trùng"""
+
+    def __init__(self, result="value", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, *args):
+        self.calls += 1
+        self.started.set()
+        self.gate.wait(2)
+        if self.error is not None:
+            raise self.error
+        return (self.result,) + args
+
+    def release(self):
+        self.gate.set()
+
+
+def run_concurrently(flight, fn, count, key="k"):
+    """Chạy count lời gọi flight.do(key, fn, "x") cùng lúc; trả về (kết quả, lỗi) của từng lời gọi"""
+    outcomes = [None] * count
+
+    def call(i):
+        try:
+            outcomes[i] = (flight.do(key, fn, "x"), None)
+        except Exception as e:
+            outcomes[i] = (None, e)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    fn.started.wait(2)
+    wait_until(lambda: flight.stats()["shared"] == count - 1)
+    fn.release()
+    for thread in threads:
+        thread.join(2)
+    return outcomes
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    fn = SlowCall()
+    outcomes = run_concurrently(flight, fn, 5)
+    assert fn.calls == 1
+    assert outcomes == [(("value", "x"), None)] * 5
+    stats = flight.stats()
+    assert (stats["calls"], stats["shared"], stats["cached"], stats["inflight"]) == (1, 4, 0, 0)
+
+
+def test_error_is_shared_and_not_cached():
+    flight = SingleFlight(ttl=60)
+    fn = SlowCall(error=RuntimeError("hỏng"))
+    outcomes = run_concurrently(flight, fn, 3)
+    assert fn.calls == 1
+    assert all(isinstance(error, RuntimeError) for _, error in outcomes)
+    assert flight.stats()["cached"] == 0
+    # Lời gọi sau chạy lại thật
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_results_cached_for_ttl():
+    clock = ManualClock()
+    flight = SingleFlight(ttl=30, clock=clock)
+    calls = []
+    fetch = lambda: calls.append(1) or len(calls)
+    assert flight.do("k", fetch) == 1
+    clock.now = 30
+    assert flight.do("k", fetch) == 1
+    clock.now = 31
+    assert flight.do("k", fetch) == 2
+    assert flight.stats()["hits"] == 1
+
+
+def test_cache_if_skips_empty_results():
+    flight = SingleFlight(ttl=30, clock=ManualClock())
+    results = iter([[], ["wallet"]])
+    assert flight.do("k", lambda: next(results)) == []
+    assert flight.do("k", lambda: next(results)) == ["wallet"]
+    assert flight.do("k", lambda: pytest.fail("phải dùng kết quả đã cache")) == ["wallet"]
+
+
+def test_invalidate_by_key_match():
+    flight = SingleFlight(ttl=30, clock=ManualClock())
+    flight.do(("user", "a"), lambda: "a1")
+    flight.do(("user", "b"), lambda: "b1")
+    flight.invalidate(lambda key: key == ("user", "a"))
+    assert flight.do(("user", "a"), lambda: "a2") == "a2"
+    assert flight.do(("user", "b"), lambda: "b2") == "b1"
+    flight.invalidate()
+    assert flight.do(("user", "b"), lambda: "b3") == "b3"
+
+
+def test_invalidate_during_flight_does_not_cache_stale_result():
+    flight = SingleFlight(ttl=30, clock=ManualClock())
+    fn = SlowCall(result="cũ")
+    thread = threading.Thread(target=flight.do, args=("k", fn))
+    thread.start()
+    fn.started.wait(2)
+    flight.invalidate()
+    fn.release()
+    thread.join(2)
+    assert flight.stats()["cached"] == 0
+    assert flight.do("k", lambda: "mới") == "mới"
+
+
+def test_max_entries_evicts_oldest():
+    flight = SingleFlight(ttl=30, max_entries=2, clock=ManualClock())
+    for key in "abc":
+        flight.do(key, lambda key=key: key)
+    assert flight.stats()["cached"] == 2
+    assert flight.do("a", lambda: "a2") == "a2"
+    assert flight.do("c", lambda: "c2") == "c"
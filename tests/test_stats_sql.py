@@ -0,0 +1,101 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from data_processor import get_transaction_stats
+from query_handler import clear_answer_cache, execute_plans, parse_question
+from stats_sql import escape_like, query_transaction_stats
+from transaction_frame import TransactionFrame
+
+# Tên danh mục chứa các ký tự đại diện của LIKE
+CATEGORIES = ["coffee", "100% juice", "1000 juice", "a_b", "axb", "back\\slash", "backxslash", "electricity bill"]
+FILTERS = [None, "%", "_", "\\", "0%", "a_b", "k\\s", "coffee", "bill", "không có"]
+
+ROWS = [
+    # (id, ví, danh mục, nhóm, số tiền, ngày)
+    (i, 1 + i % 2, CATEGORIES[i % len(CATEGORIES)], "expense" if i % 3 else "income",
+     1000.0 * (i + 1), None if i % 7 == 0 else date(2024, 1 + i % 12, 1 + i % 28).isoformat())
+    for i in range(60)
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE groups (id INTEGER PRIMARY KEY, group_name TEXT);
+        CREATE TABLE categories (id INTEGER PRIMARY KEY, categoryname TEXT, group_id INTEGER);
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY, wallet_id INTEGER, category_id INTEGER,
+                                   amount REAL, date TEXT);
+    """)
+    groups = {"expense": 1, "income": 2}
+    conn.executemany("INSERT INTO groups VALUES (?, ?)", [(v, k) for k, v in groups.items()])
+    categories = {}
+    for _, _, name, group, _, _ in ROWS:
+        categories.setdefault((name, group), len(categories) + 1)
+    conn.executemany("INSERT INTO categories VALUES (?, ?, ?)",
+                     [(cid, name, groups[group]) for (name, group), cid in categories.items()])
+    conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?)",
+                     [(i, wallet, categories[(name, group)], amount, day)
+                      for i, wallet, name, group, amount, day in ROWS])
+    yield conn
+    conn.close()
+
+
+def as_dicts(rows):
+    return [
+        {'id': i, 'amount': amount, 'date': day,
+         'categories': {'categoryname': name, 'group_name': group}}
+        for i, _, name, group, amount, day in rows
+    ]
+
+
+def test_escape_like():
+    assert escape_like("100%") == "100\\%"
+    assert escape_like("a_b") == "a\\_b"
+    assert escape_like("c:\\x") == "c:\\\\x"
+    assert escape_like("coffee") == "coffee"
+
+
+@pytest.mark.parametrize("category_name", FILTERS)
+@pytest.mark.parametrize("group_name", [None, "expense"])
+def test_sql_matches_python_substring(conn, group_name, category_name):
+    start, end = date(2024, 3, 1), date(2024, 9, 30)
+    actual = query_transaction_stats(conn, [1, 2], group_name, category_name, start, end)
+    expected = get_transaction_stats(as_dicts(ROWS), group_name, category_name, start, end)
+    assert actual['count'] == expected['count']
+    assert actual['total'] == pytest.approx(expected['total'])
+    assert actual['by_category'] == pytest.approx(expected['by_category'])
+    assert actual['by_month'] == pytest.approx(expected['by_month'])
+
+
+def test_wildcards_are_literal(conn):
+    # '%' chỉ khớp "100% juice", '_' chỉ khớp "a_b" (không khớp mọi tên)
+    assert set(query_transaction_stats(conn, [1, 2], category_name="%")['by_category']) == {"100% juice"}
+    assert set(query_transaction_stats(conn, [1, 2], category_name="_")['by_category']) == {"a_b"}
+    assert set(query_transaction_stats(conn, [1, 2], category_name="\\")['by_category']) == {"back\\slash"}
+
+
+class SqliteTransactions:
+    """Giống supabase_client.RemoteTransactions nhưng gom tổng trên sqlite"""
+
+    def __init__(self, conn, wallet_ids):
+        self.conn = conn
+        self.wallet_ids = wallet_ids
+
+    def aggregate_remote(self, group_name=None, category_name=None, start_date=None, end_date=None):
+        return query_transaction_stats(self.conn, self.wallet_ids, group_name, category_name, start_date, end_date)
+
+
+def test_remote_source_answers_like_frame(conn):
+    today = date(2024, 12, 31)
+    questions = [
+        "Tổng giao dịch năm nay", "Tổng thu nhập năm nay", "Tổng chi tiêu tháng này",
+        "Tôi chi nhiều nhất cho khoản nào năm nay?", "so sánh tiền điện và tiền nước năm nay",
+        "tiền cà phê tháng trước", "thống kê",
+    ]
+    plans = [parse_question(q, today=today) for q in questions]
+    clear_answer_cache()
+    expected = execute_plans(plans, TransactionFrame.from_transactions(as_dicts(ROWS)))
+    assert execute_plans(plans, SqliteTransactions(conn, [1, 2])) == expected
@@ -0,0 +1,72 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from transaction_frame import TransactionFrame
+
+
+def random_rows(rng, n, first_id=0):
+    first = date(2024, 1, 1)
+    return [
+        {
+            'id': first_id + i,
+            'amount': float(rng.randrange(1, 1000)),
+            'date': None if rng.random() < 0.1 else (first + timedelta(days=rng.randrange(60))).isoformat(),
+            'categories': {'categoryname': rng.choice(["Food", "Rent", "Coffee"]), 'group_name': 'expense'},
+        }
+        for i in range(n)
+    ]
+
+
+def expected_ids(rows):
+    """Thứ tự của một lần sắp xếp ổn định toàn bộ: ngày giảm dần, không có ngày ở cuối"""
+    ordinal = [date.fromisoformat(r['date']).toordinal() if r['date'] else 0 for r in rows]
+    order = sorted(range(len(rows)), key=lambda i: (ordinal[i] == 0, -ordinal[i]))
+    return [rows[i]['id'] for i in order]
+
+
+def assert_consistent(frame):
+    dated = frame.dates[:frame._dated]
+    assert all(d for d in dated)
+    assert list(dated) == sorted(dated, reverse=True)
+    assert not any(frame.dates[frame._dated:])
+    columns = (frame.ids, frame.amounts, frame.dates, frame.months, frame.category_codes, frame.group_codes)
+    assert len({len(c) for c in columns}) == 1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_extend_in_batches_matches_full_sort(seed):
+    rng = random.Random(seed)
+    frame = TransactionFrame()
+    rows = []
+    for _ in range(8):
+        batch = random_rows(rng, rng.randrange(0, 60), first_id=len(rows))
+        if rng.random() < 0.5:
+            # Lô đã đúng thứ tự như Supabase trả về
+            batch = [b for i in expected_ids(batch) for b in batch if b['id'] == i]
+        frame.extend(batch)
+        rows += batch
+        assert frame.ids == expected_ids(rows)
+        assert_consistent(frame)
+
+    amounts = {r['id']: r['amount'] for r in rows}
+    assert list(frame.amounts) == [amounts[i] for i in frame.ids]
+
+
+def test_newer_batch_merges_in_front():
+    frame = TransactionFrame.from_transactions([
+        {'id': 1, 'amount': 1, 'date': '2024-01-05', 'categories': {'categoryname': 'A', 'group_name': 'x'}},
+        {'id': 2, 'amount': 2, 'date': None, 'categories': {'categoryname': 'A', 'group_name': 'x'}},
+    ])
+    version = frame.version
+    frame.extend([
+        {'id': 3, 'amount': 3, 'date': '2024-01-05', 'categories': {'categoryname': 'A', 'group_name': 'x'}},
+        {'id': 4, 'amount': 4, 'date': '2024-02-01', 'categories': {'categoryname': 'A', 'group_name': 'x'}},
+        {'id': 5, 'amount': 5, 'date': None, 'categories': {'categoryname': 'A', 'group_name': 'x'}},
+    ])
+    assert frame.ids == [4, 1, 3, 2, 5]
+    assert frame._dated == 3
+    assert frame.version != version
+    frame.extend([])
+    assert frame.ids == [4, 1, 3, 2, 5]
@@ -0,0 +1,89 @@
+import threading
+from datetime import date
+
+import pytest
+
+pytest.importorskip("supabase")
+pytest.importorskip("dotenv")
+
+import transaction_loader  # noqa: E402
+from transaction_loader import TransactionLoader  # noqa: E402
+
+
+def row(i, day):
+    return {
+        'id': i,
+        'amount': 10.0,
+        'date': day,
+        'categories': {'categoryname': 'Food', 'group_name': 'expense'},
+    }
+
+
+# Các trang theo thứ tự của iter_transaction_batches: không có ngày trước, rồi ngày giảm dần
+PAGES = [
+    [row(1, None)],
+    [row(2, '2024-03-10'), row(3, '2024-03-02')],
+    [row(4, '2024-02-20'), row(5, '2024-01-05')],
+]
+
+
+class FakeSnapshot:
+    path = "fake"
+
+    def __init__(self, user_id):
+        pass
+
+    def iter_batches(self):
+        return iter(PAGES)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def paused_sync(monkeypatch):
+    """sync_transactions giả: gửi từng trang qua on_batch, dừng sau mỗi trang đến khi test cho đi tiếp"""
+    sent = threading.Semaphore(0)
+    proceed = threading.Semaphore(0)
+
+    def fake_sync(snapshot, wallet_ids, on_batch=None):
+        for page in PAGES:
+            on_batch(page)
+            sent.release()
+            proceed.acquire(timeout=2)
+        return sum(map(len, PAGES))
+
+    monkeypatch.setattr(transaction_loader, "sync_transactions", fake_sync)
+    return sent, proceed
+
+
+def test_partial_frame_covers_recent_dates(paused_sync):
+    sent, proceed = paused_sync
+    loader = TransactionLoader("u1", ["w1"], snapshot_factory=FakeSnapshot).start()
+    sent.acquire(timeout=2)
+    # Mới có giao dịch không ngày: chưa đủ cho khoảng nào
+    with loader.partial(date(2024, 3, 1)) as frame:
+        assert frame is None
+    proceed.release()
+    sent.acquire(timeout=2)
+    # Đã tải đến 02/03: đủ cho từ 03/03, chưa đủ cho từ 02/03
+    with loader.partial(date(2024, 3, 3)) as frame:
+        assert sorted(frame.ids) == [1, 2, 3]
+    with loader.partial(date(2024, 3, 2)) as frame:
+        assert frame is None
+    with loader.partial(None) as frame:
+        assert frame is None
+    proceed.release()
+    sent.acquire(timeout=2)
+    proceed.release()
+    frame = loader.result(2)
+    assert list(frame.ids) == [2, 3, 4, 5, 1]
+    assert loader.fetched == 5
+
+
+def test_frame_is_built_from_snapshot_without_pages(monkeypatch):
+    # Đồng bộ thay đổi không gửi trang nào: bảng được dựng lại từ bản sao
+    monkeypatch.setattr(transaction_loader, "sync_transactions", lambda snapshot, wallet_ids, on_batch=None: 0)
+    loader = TransactionLoader("u1", ["w1"], snapshot_factory=FakeSnapshot).start()
+    assert list(loader.result(2).ids) == [2, 3, 4, 5, 1]
+    assert loader.fetched == 0
@@ -0,0 +1,135 @@
+import pytest
+
+from transaction_snapshot import TransactionSnapshot
+
+
+def row(i, updated_at, day="2024-01-01", amount=10.0):
+    return {
+        'id': i,
+        'amount': amount,
+        'date': day,
+        'updated_at': updated_at,
+        'categories': {'categoryname': 'Food', 'group_name': 'expense'},
+    }
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    snapshot = TransactionSnapshot("u1", directory=str(tmp_path))
+    yield snapshot
+    snapshot.close()
+
+
+def stored(snapshot):
+    return {t['id']: t for batch in snapshot.iter_batches() for t in batch}
+
+
+def test_merge_upserts_by_id(snapshot):
+    assert snapshot.merge([row(1, "2024-01-01T00:00:00"), row(2, "2024-01-01T00:00:00")]) == 2
+    snapshot.merge([row(1, "2024-01-02T00:00:00", amount=99.0)])
+    rows = stored(snapshot)
+    assert len(snapshot) == 2
+    assert rows[1]['amount'] == 99.0
+    assert rows[2]['amount'] == 10.0
+
+
+def test_high_water_mark_is_max_updated_at_then_id(snapshot):
+    assert snapshot.high_water_mark() is None
+    snapshot.merge([row(3, "2024-01-02"), row(1, "2024-01-03"), row(2, "2024-01-03")])
+    assert snapshot.high_water_mark() == ("2024-01-03", 2)
+    # Trang cũ hơn (hoặc không có updated_at) không kéo mark lùi lại
+    snapshot.merge([row(4, "2024-01-01"), row(5, None)])
+    assert snapshot.high_water_mark() == ("2024-01-03", 2)
+
+
+def test_mark_survives_reopen_and_reset_clears_it(tmp_path):
+    snapshot = TransactionSnapshot("u1", directory=str(tmp_path))
+    snapshot.merge([row(1, "2024-01-05")])
+    snapshot.set_wallet_ids(["b", "a"])
+    snapshot.close()
+
+    snapshot = TransactionSnapshot("u1", directory=str(tmp_path))
+    assert snapshot.high_water_mark() == ("2024-01-05", 1)
+    assert snapshot.wallet_ids() == ["a", "b"]
+    snapshot.reset()
+    assert (len(snapshot), snapshot.high_water_mark(), snapshot.wallet_ids()) == (0, None, None)
+    snapshot.close()
+
+
+def test_iter_batches_newest_first_undated_last(snapshot):
+    snapshot.merge([row(1, "x", "2024-01-01"), row(2, "x", None), row(3, "x", "2024-03-01")])
+    assert [t['id'] for t in next(snapshot.iter_batches())] == [3, 1, 2]
+
+
+@pytest.fixture
+def fake_pages(monkeypatch):
+    """Thay hai luồng tải của supabase_client bằng các trang cho trước; ghi lại mark được hỏi"""
+    pytest.importorskip("supabase")
+    pytest.importorskip("dotenv")
+    import supabase_client
+
+    pages = {"full": [], "changed": [], "since": []}
+
+    def replay(name):
+        for page in pages[name]:
+            if isinstance(page, Exception):
+                raise page
+            yield page
+
+    def full(wallet_ids):
+        return replay("full")
+
+    def changed(wallet_ids, since, sync_column):
+        pages["since"].append(since)
+        return replay("changed")
+
+    monkeypatch.setattr(supabase_client, "iter_transaction_batches", full)
+    monkeypatch.setattr(supabase_client, "iter_transactions_changed_since", changed)
+    return supabase_client, pages
+
+
+def test_incremental_sync_merges_changes_after_mark(snapshot, fake_pages):
+    supabase_client, pages = fake_pages
+    pages["full"] = [[row(1, "2024-01-01"), row(2, "2024-01-02")], [row(3, "2024-01-01")]]
+    seen = []
+    assert supabase_client.sync_transactions(snapshot, ["w"], on_batch=seen.append) == 3
+    assert len(seen) == 2
+    assert snapshot.wallet_ids() == ["w"]
+    assert snapshot.high_water_mark() == ("2024-01-02", 2)
+
+    # Lần sau chỉ tải thay đổi sau mark: sửa giao dịch 1, thêm giao dịch 4
+    pages["changed"] = [[row(1, "2024-02-01", amount=50.0), row(4, "2024-02-02")]]
+    assert supabase_client.sync_transactions(snapshot, ["w"], on_batch=seen.append) == 2
+    assert pages["since"] == [("2024-01-02", 2)]
+    assert len(seen) == 2
+    rows = stored(snapshot)
+    assert sorted(rows) == [1, 2, 3, 4]
+    assert rows[1]['amount'] == 50.0
+    assert snapshot.high_water_mark() == ("2024-02-02", 4)
+
+
+def test_failed_incremental_page_keeps_earlier_pages(snapshot, fake_pages):
+    supabase_client, pages = fake_pages
+    pages["full"] = [[row(1, "2024-01-01")]]
+    supabase_client.sync_transactions(snapshot, ["w"])
+    pages["changed"] = [[row(2, "2024-01-02")], RuntimeError("mất kết nối")]
+    with pytest.raises(RuntimeError):
+        supabase_client.sync_transactions(snapshot, ["w"])
+    # Trang đã nhận được ghi lại, lần sau tiếp tục từ đó
+    assert snapshot.high_water_mark() == ("2024-01-02", 2)
+    pages["changed"] = []
+    supabase_client.sync_transactions(snapshot, ["w"])
+    assert pages["since"][-1] == ("2024-01-02", 2)
+
+
+def test_interrupted_full_sync_starts_over(snapshot, fake_pages):
+    supabase_client, pages = fake_pages
+    pages["full"] = [[row(1, "2024-01-01")], RuntimeError("mất kết nối")]
+    with pytest.raises(RuntimeError):
+        supabase_client.sync_transactions(snapshot, ["w"])
+    # Chưa ghi danh sách ví: lần sau tải lại toàn bộ, không đồng bộ thay đổi
+    assert snapshot.wallet_ids() is None
+
+    pages["full"] = [[row(1, "2024-01-01"), row(2, "2024-01-01")]]
+    assert supabase_client.sync_transactions(snapshot, ["w"]) == 2
+    assert pages["since"] == []
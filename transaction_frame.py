@@ -0,0 +1,258 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import count
+import sys
+
+from rollup import RollupCube
+from transaction_record import normalize_transaction
+
+
+# Mỗi lần dữ liệu của một bảng thay đổi sẽ nhận một số phiên bản mới (duy nhất trong process)
+_versions = count(1)
+
+
+class CategoryIndex:
+    """
+    Chỉ mục ngược từ từ khóa danh mục ('electricity', 'water', ...) sang tập mã
+    danh mục có tên chứa từ khóa đó (so khớp chuỗi con, không phân biệt hoa thường).
+
+    Mỗi từ khóa chỉ được so với các tên danh mục một lần cho mỗi bộ dữ liệu;
+    danh mục mới thêm vào bảng được cập nhật vào mọi từ khóa đã có.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._tokens = {}
+
+    def add(self, code, key):
+        """Ghi nhận danh mục mới (mã code, tên chữ thường key)"""
+        self._keys.append((code, key))
+        if not key:
+            return
+        for token, codes in self._tokens.items():
+            if token in key:
+                self._tokens[token] = codes | {code}
+
+    def lookup(self, name):
+        """Tập mã danh mục khớp với name (frozenset, dùng chung giữa các lần gọi)"""
+        token = name.strip().lower()
+        codes = self._tokens.get(token)
+        if codes is None:
+            codes = frozenset(code for code, key in self._keys if key and token in key)
+            self._tokens[token] = codes
+        return codes
+
+
+class TransactionFrame:
+    """
+    Bảng giao dịch dạng cột, dựng MỘT lần từ các lô giao dịch đã đồng bộ (xem
+    TransactionLoader): Transaction (transaction_record) hoặc dict thô.
+
+    - amounts: số tiền (float64)
+    - dates: ngày dạng ordinal (int32), 0 nếu giao dịch không có ngày
+    - months: year * 12 + month - 1 (int32), -1 nếu không có ngày
+    - category_codes / group_codes: mã số nguyên trỏ vào categories / groups
+    - category_index: từ khóa danh mục -> tập mã danh mục (xem CategoryIndex)
+
+    Tên danh mục được gom theo chữ thường; categories giữ tên hiển thị đầu tiên gặp.
+
+    Các dòng luôn được giữ theo thứ tự ngày giảm dần (như Supabase trả về với
+    order('date', desc=True)), giao dịch không có ngày nằm ở cuối. Nhờ vậy
+    lọc theo khoảng ngày chỉ cần tìm nhị phân (xem row_ranges).
+
+    Nếu bật rollup, bảng giữ thêm một RollupCube được cập nhật cùng lúc với extend.
+
+    version đổi mỗi khi dữ liệu thay đổi, dùng làm khóa cho cache câu trả lời.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.amounts = array('d')
+        self.dates = array('i')
+        self.months = array('i')
+        self.category_codes = array('i')
+        self.group_codes = array('i')
+        self.categories = []
+        self.category_keys = []
+        self.groups = []
+        self._category_lookup = {}
+        self._group_lookup = {}
+        self.category_index = CategoryIndex()
+        # Số dòng có ngày: dates[:_dated] giảm dần, dates[_dated:] đều bằng 0
+        self._dated = 0
+        self.rollup = None
+        self.version = next(_versions)
+
+    @classmethod
+    def from_transactions(cls, transactions, rollup=False):
+        frame = cls()
+        if rollup:
+            frame.rollup = RollupCube()
+        frame.extend(transactions or [])
+        return frame
+
+    def build_rollup(self):
+        """Dựng RollupCube từ các dòng hiện có (nếu chưa có)"""
+        if self.rollup is None:
+            cube = RollupCube()
+            rows = zip(self.dates, self.months, self.group_codes, self.category_codes, self.amounts)
+            for row in rows:
+                cube.add(*row)
+            self.rollup = cube
+        return self.rollup
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def memory_usage(self):
+        """Ước lượng số byte bộ nhớ của bảng (các cột, id và RollupCube)"""
+        size = sum(
+            column.itemsize * len(column)
+            for column in (self.amounts, self.dates, self.months, self.category_codes, self.group_codes)
+        )
+        size += sys.getsizeof(self.ids) + sum(sys.getsizeof(i) for i in self.ids)
+        if self.rollup is not None:
+            size += self.rollup.memory_usage()
+        return size
+
+    def _intern_category(self, name, key):
+        code = self._category_lookup.get(key)
+        if code is None:
+            code = len(self.category_keys)
+            self._category_lookup[key] = code
+            self.category_keys.append(key)
+            self.categories.append(name)
+            self.category_index.add(code, key)
+        return code
+
+    def _intern_group(self, name):
+        code = self._group_lookup.get(name)
+        if code is None:
+            code = len(self.groups)
+            self._group_lookup[name] = code
+            self.groups.append(name)
+        return code
+
+    def extend(self, transactions):
+        """
+        Thêm các giao dịch (Transaction hoặc dict như Supabase trả về) vào bảng.
+        Chỉ lô mới được sắp xếp theo ngày rồi trộn vào các cột đã sắp xếp sẵn
+        (xem _merge), không sắp xếp lại toàn bộ bảng.
+        """
+        batch = ([], [], [], [], [], [])
+        dates, months, amounts, category_codes, group_codes, ids = batch
+        in_order = True
+        for t in transactions:
+            t = normalize_transaction(t)
+            if t is None:
+                # Giống logic cũ: giao dịch có số tiền lỗi bị bỏ qua
+                continue
+            d = t.date
+            if d:
+                ordinal = d.toordinal()
+                month = d.year * 12 + d.month - 1
+                if in_order and dates and not 0 < ordinal <= dates[-1]:
+                    in_order = False
+            else:
+                ordinal = 0
+                month = -1
+
+            category_code = self._intern_category(t.category, t.category_key)
+            group_code = self._intern_group(t.group)
+            dates.append(ordinal)
+            months.append(month)
+            amounts.append(t.amount)
+            category_codes.append(category_code)
+            group_codes.append(group_code)
+            ids.append(t.id)
+            if self.rollup is not None:
+                self.rollup.add(ordinal, month, group_code, category_code, t.amount)
+
+        if ids:
+            if not in_order:
+                # Giảm dần theo ngày (ổn định), dòng không có ngày xuống cuối
+                order = sorted(range(len(ids)), key=lambda i: (dates[i] == 0, -dates[i]))
+                batch = tuple([column[i] for i in order] for column in batch)
+            self._merge(batch)
+            self.version = next(_versions)
+        return self
+
+    def _columns(self):
+        return (self.dates, self.months, self.amounts, self.category_codes, self.group_codes, self.ids)
+
+    def _merge(self, batch):
+        """
+        Trộn lô mới (các cột theo thứ tự của _columns, đã sắp xếp như bảng) vào bảng.
+        Dòng cũ cùng ngày đứng trước dòng mới nên kết quả giống sắp xếp ổn định cả
+        bảng. Vị trí chèn tìm bằng tìm nhị phân; chỉ phần đuôi từ vị trí chèn đầu tiên
+        được chép lại (theo từng đoạn, không duyệt từng dòng).
+        """
+        size = len(self.dates)
+        dates = batch[0]
+        dated = len(dates) - dates.count(0)
+        if not dated or (self._dated == size and (not size or dates[0] <= self.dates[size - 1])):
+            # Lô mới nằm sau mọi dòng cũ (tải theo thứ tự): chỉ cần nối thêm
+            for column, values in zip(self._columns(), batch):
+                column.extend(values)
+            self._dated += dated
+            return
+
+        # Không giảm vì lô đã sắp xếp giảm dần theo ngày
+        positions = [
+            bisect_right(self.dates, -ordinal, 0, self._dated, key=lambda d: -d)
+            for ordinal in dates[:dated]
+        ]
+        start = positions[0]
+        for column, values in zip(self._columns(), batch):
+            tail = column[start:]
+            del column[start:]
+            prev = start
+            for pos, value in zip(positions, values):
+                column += tail[prev - start:pos - start]
+                column.append(value)
+                prev = pos
+            column += tail[prev - start:]
+            column.extend(values[dated:])
+        self._dated += dated
+
+    def row_ranges(self, lo=0, hi=0):
+        """
+        Các đoạn chỉ số [start, stop) chứa giao dịch có ordinal nằm trong [lo, hi]
+        (0 = không giới hạn). Giao dịch không có ngày luôn được giữ lại, giống logic cũ.
+        Chi phí O(log n) nhờ tìm nhị phân trên cột dates đã sắp xếp giảm dần.
+        """
+        start, stop = 0, self._dated
+        if hi:
+            start = bisect_left(self.dates, -hi, 0, self._dated, key=lambda d: -d)
+        if lo:
+            stop = bisect_right(self.dates, -lo, start, self._dated, key=lambda d: -d)
+        ranges = []
+        if start < stop:
+            ranges.append((start, stop))
+        if self._dated < len(self.dates):
+            ranges.append((self._dated, len(self.dates)))
+        return ranges
+
+    def oldest_ordinal(self):
+        """Ordinal của ngày cũ nhất trong bảng, 0 nếu chưa có giao dịch có ngày"""
+        return self.dates[self._dated - 1] if self._dated else 0
+
+    def group_code(self, group_name):
+        """Mã của nhóm, -1 nếu dữ liệu không có nhóm này"""
+        return self._group_lookup.get(group_name.strip().lower(), -1)
+
+    def category_codes_matching(self, category_name):
+        """Tập mã danh mục có tên chứa category_name (so khớp chuỗi con, không phân biệt hoa thường)"""
+        return self.category_index.lookup(category_name)
+
+
+def as_frame(transactions):
+    """Trả về TransactionFrame, dựng mới nếu đầu vào là danh sách dict"""
+    if isinstance(transactions, TransactionFrame):
+        return transactions
+    return TransactionFrame.from_transactions(transactions)
+
+
+def month_label(month):
+    """Chuyển mã tháng (year * 12 + month - 1) thành chuỗi 'YYYY-MM'"""
+    return f"{month // 12:04d}-{month % 12 + 1:02d}"
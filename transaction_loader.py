@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from log_utils import get_logger
+from profiling import collect, span
+from supabase_client import sync_transactions
+from transaction_frame import TransactionFrame
+from transaction_snapshot import TransactionSnapshot
+
+logger = get_logger(__name__)
+
+
+class TransactionLoader:
+    """
+    Đồng bộ giao dịch và dựng TransactionFrame trên một thread nền, để người dùng
+    có thể đặt câu hỏi ngay khi biết danh sách ví. Câu hỏi cần dữ liệu gọi
+    result() và chỉ phải chờ nếu dữ liệu chưa tải xong.
+
+    Lần tải toàn bộ đi theo ngày giảm dần và bảng được dựng dần theo từng trang,
+    nên câu hỏi về khoảng gần đây trả lời được trước khi tải xong (xem partial).
+
+        loader = TransactionLoader(user_id, wallet_ids).start()
+        ...
+        with loader.partial(plan.start_date) as transactions:
+            if transactions is None:
+                transactions = loader.result()
+    """
+
+    def __init__(self, user_id, wallet_ids, snapshot_factory=TransactionSnapshot):
+        self.user_id = user_id
+        self.wallet_ids = list(wallet_ids)
+        self.snapshot_factory = snapshot_factory
+        self.fetched = 0
+        self.timings = []
+        self._future = Future()
+        self._cancelled = threading.Event()
+        self._thread = None
+        # Bảng đang dựng dần từ các trang tải về; khóa giữ bảng không đổi khi đang đọc
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Thread daemon: thoát chương trình không phải chờ lần đồng bộ đang chạy
+        self._thread = threading.Thread(target=self._run, name=f"prefetch-{self.user_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        if not self._future.set_running_or_notify_cancel():
+            return
+        try:
+            with collect() as timings, span("load"):
+                frame = self._load()
+            self.timings = timings
+            self._future.set_result(frame)
+        except BaseException as e:
+            logger.error("Lỗi khi tải giao dịch nền: %s", e)
+            self._future.set_exception(e)
+
+    def _load(self):
+        snapshot = self.snapshot_factory(self.user_id)
+        try:
+            self.fetched = sync_transactions(snapshot, self.wallet_ids, on_batch=self._extend)
+            with self._lock:
+                frame = self._frame
+            if frame is not None:
+                return frame
+            # Đồng bộ thay đổi (hoặc dùng chung lần đồng bộ của loader khác):
+            # dựng bảng từ bản sao
+            with span("normalize"):
+                frame = TransactionFrame.from_transactions([], rollup=True)
+                for batch in snapshot.iter_batches():
+                    if self._cancelled.is_set():
+                        logger.debug("Dừng tải giao dịch của %s", self.user_id)
+                        break
+                    frame.extend(batch)
+            return frame
+        finally:
+            snapshot.close()
+
+    def _extend(self, batch):
+        """Cộng một trang vừa tải về vào bảng (gọi từ sync_transactions)"""
+        if self._cancelled.is_set():
+            return
+        with span("normalize"), self._lock:
+            if self._frame is None:
+                self._frame = TransactionFrame.from_transactions([], rollup=True)
+            self._frame.extend(batch)
+
+    @contextmanager
+    def partial(self, start_date):
+        """
+        Bảng đang tải dở nếu đã có đủ mọi giao dịch từ start_date trở đi, None nếu
+        chưa đủ (hoặc không có start_date). Giao dịch về theo ngày giảm dần, không có
+        ngày trước, nên chỉ cần ngày cũ nhất đã tải nhỏ hơn start_date. Trong khối
+        with bảng không bị thêm dòng.
+        """
+        with self._lock:
+            frame = self._frame
+            oldest = frame.oldest_ordinal() if frame is not None else 0
+            if start_date is None or not oldest or start_date.toordinal() <= oldest:
+                frame = None
+            yield frame
+
+    def done(self):
+        return self._future.done()
+
+    def add_done_callback(self, fn):
+        """Gọi fn(loader) khi tải xong hoặc lỗi (ngay lập tức nếu đã xong)"""
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def result(self, timeout=None):
+        """TransactionFrame đã tải xong (chờ nếu cần). Lỗi khi tải được ném lại ở đây."""
+        return self._future.result(timeout)
+
+    def cancel(self):
+        """Bỏ lần tải (khi đổi người dùng); phần đồng bộ đang chạy dở vẫn được ghi vào bản sao"""
+        self._cancelled.set()
@@ -0,0 +1,131 @@
+import sys
+from datetime import datetime, date
+from functools import lru_cache
+
+
+class Transaction:
+    """
+    Một giao dịch đã chuẩn hóa, tạo MỘT lần ngay sau khi tải từ Supabase.
+
+    - amount: float
+    - date: datetime.date, None nếu không có hoặc không đọc được
+    - category: tên danh mục hiển thị (đã strip), category_key: chữ thường
+    - group: tên nhóm chữ thường ('income', 'expense', 'debt-loan', ...)
+
+    Các chuỗi tên được intern nên mọi giao dịch cùng danh mục dùng chung một
+    đối tượng chuỗi; không còn giữ dict JSON lồng nhau của Supabase.
+    """
+    __slots__ = ('id', 'amount', 'date', 'category', 'category_key', 'group', 'note')
+
+    def __init__(self, id, amount, date=None, category='', category_key='', group='', note=None):
+        self.id = id
+        self.amount = amount
+        self.date = date
+        self.category = category
+        self.category_key = category_key
+        self.group = group
+        self.note = note
+
+    def __repr__(self):
+        return (f"Transaction(id={self.id!r}, amount={self.amount!r}, date={self.date!r}, "
+                f"category={self.category!r}, group={self.group!r})")
+
+    def __eq__(self, other):
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+
+@lru_cache(maxsize=8192)
+def _parse_date(text):
+    """Đọc 'YYYY-MM-DD...' (nhiều giao dịch cùng ngày dùng chung một đối tượng date)"""
+    try:
+        return date.fromisoformat(text[:10])
+    except ValueError:
+        return None
+
+
+def to_date(value):
+    """Chuyển ngày (str 'YYYY-MM-DD...', date, datetime) thành date, None nếu không đọc được"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return _parse_date(str(value))
+
+
+def to_ordinal(value):
+    """Chuyển ngày (str 'YYYY-MM-DD...', date, datetime) thành số ordinal, 0 nếu không đọc được"""
+    d = to_date(value)
+    return d.toordinal() if d else 0
+
+
+def _category_of(t):
+    """Lấy tên danh mục từ các trường có thể có của giao dịch"""
+    category = t.get('category')
+    category = category if isinstance(category, dict) else {}
+    categories = t.get('categories') or {}
+    return (
+        category.get('name') or
+        category.get('categoryname') or
+        t.get('category_name') or
+        categories.get('name') or
+        categories.get('categoryname') or
+        ''
+    ).strip()
+
+
+def _group_of(t):
+    """Lấy tên nhóm (income, expense, ...) từ các trường có thể có của giao dịch"""
+    category = t.get('category')
+    category = category if isinstance(category, dict) else {}
+    categories = t.get('categories') or {}
+    return (
+        t.get('group') or
+        t.get('group_name') or
+        category.get('group') or
+        categories.get('group_name') or
+        ''
+    ).strip().lower()
+
+
+# Tên thô -> tên đã intern, để mỗi tên chỉ phải strip/lower/intern một lần.
+# Có giới hạn vì server giữ process lâu với danh mục của mọi người dùng.
+@lru_cache(maxsize=4096)
+def _intern_category(name):
+    display = sys.intern(name)
+    return display, sys.intern(display.lower())
+
+
+@lru_cache(maxsize=1024)
+def _intern_group(name):
+    return sys.intern(name)
+
+
+def normalize_transaction(t):
+    """
+    Chuẩn hóa một giao dịch dạng dict (như Supabase trả về) thành Transaction.
+    Trả về None nếu số tiền không hợp lệ (giống logic cũ: giao dịch đó bị bỏ qua).
+    Transaction đã chuẩn hóa được trả về nguyên vẹn.
+    """
+    if isinstance(t, Transaction):
+        return t
+    try:
+        amount = float(t.get('amount', 0))
+    except (ValueError, TypeError):
+        return None
+    category, category_key = _intern_category(_category_of(t))
+    return Transaction(
+        t.get('id'),
+        amount,
+        to_date(t.get('date')),
+        category,
+        category_key,
+        _intern_group(_group_of(t)),
+        t.get('note'),
+    )
+
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import sqlite3
+
+# Thư mục lưu bản sao giao dịch cục bộ, mỗi người dùng một file SQLite
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".finance_snapshots"))
+# Cột thời gian cập nhật của bảng transactions, dùng làm high-water mark
+SYNC_COLUMN = os.getenv("TRANSACTIONS_SYNC_COLUMN", "updated_at")
+
+
+def _sort_key(value):
+    """Khóa so sánh cho id/updated_at (số so với số, còn lại so theo chuỗi)"""
+    if isinstance(value, (int, float)):
+        return (0, value, "")
+    return (1, 0, "" if value is None else str(value))
+
+
+class TransactionSnapshot:
+    """
+    Bản sao giao dịch của một người dùng trên đĩa (SQLite).
+
+    Lưu kèm high-water mark (updated_at, id) lớn nhất đã đồng bộ để lần đăng nhập
+    sau chỉ cần lấy các giao dịch mới hoặc vừa sửa (xem supabase_client.sync_transactions).
+    Giao dịch bị xóa trên server không được phát hiện; gọi reset() để tải lại toàn bộ.
+    """
+
+    def __init__(self, user_id, directory=SNAPSHOT_DIR, sync_column=SYNC_COLUMN):
+        os.makedirs(directory, exist_ok=True)
+        safe_id = re.sub(r"[^\w.-]", "_", str(user_id))
+        self.path = os.path.join(directory, f"{safe_id}.sqlite3")
+        self.sync_column = sync_column
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id TEXT PRIMARY KEY,
+                date TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date DESC, id DESC);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)),
+        )
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def high_water_mark(self):
+        """(updated_at, id) lớn nhất đã đồng bộ, None nếu chưa đồng bộ lần nào"""
+        mark = self._get_meta("high_water_mark")
+        return tuple(mark) if mark else None
+
+    def wallet_ids(self):
+        """Danh sách ví đã đồng bộ xong lần trước, None nếu chưa tải xong lần nào"""
+        return self._get_meta("wallet_ids")
+
+    def reset(self, wallet_ids=None):
+        """Xóa toàn bộ bản sao (dùng khi danh sách ví thay đổi hoặc muốn tải lại từ đầu)"""
+        with self.conn:
+            self.conn.execute("DELETE FROM transactions")
+            self.conn.execute("DELETE FROM meta")
+            if wallet_ids is not None:
+                self._set_meta("wallet_ids", sorted(str(w) for w in wallet_ids))
+
+    def set_wallet_ids(self, wallet_ids):
+        """Ghi danh sách ví sau khi đã tải xong toàn bộ giao dịch của chúng"""
+        with self.conn:
+            self._set_meta("wallet_ids", sorted(str(w) for w in wallet_ids))
+
+    def merge(self, transactions):
+        """Thêm hoặc cập nhật các giao dịch, nâng high-water mark. Trả về số giao dịch đã ghi."""
+        mark = self.high_water_mark()
+        rows = []
+        for t in transactions:
+            rows.append((str(t.get("id")), t.get("date"), json.dumps(t, ensure_ascii=False, default=str)))
+            updated_at = t.get(self.sync_column)
+            if updated_at is None:
+                continue
+            candidate = (updated_at, t.get("id"))
+            if mark is None or tuple(map(_sort_key, candidate)) > tuple(map(_sort_key, mark)):
+                mark = candidate
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO transactions (id, date, data) VALUES (?, ?, ?)",
+                rows,
+            )
+            if mark is not None:
+                self._set_meta("high_water_mark", list(mark))
+        return len(rows)
+
+    def iter_batches(self, batch_size=1000):
+        """Đọc lại giao dịch theo từng lô, mới nhất trước (date desc, không có ngày ở cuối)"""
+        cursor = self.conn.execute(
+            "SELECT data FROM transactions ORDER BY date IS NULL, date DESC, id DESC"
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [json.loads(data) for (data,) in rows]